@@ -0,0 +1,325 @@
+"""
+Chỉ mục ca bệnh tương tự trên lịch sử khám (LuotKham)
+- Mỗi lượt khám -> 1 vector từ Triệu chứng + Bệnh danh + Chứng danh (cùng model embedding với RAG)
+- Vector + ảnh chụp nhỏ của ca (văn bản, bài thuốc) lưu trong SQLite (storage/vector_db/case_index.sqlite3),
+  khởi động chỉ đọc lại vector vào FAISS (IndexIDMap2 theo LuotKhamID), không embedding lại
+- Cập nhật từng lượt khám khi tạo/sửa/xóa qua API: chỉ embedding lại khi nội dung chẩn đoán đổi (so hash)
+- sync(): bắt kịp lượt khám có chẩn đoán chưa có trong chỉ mục (so danh sách ID) + bỏ ca đã bị xóa
+- rebuild(): quét lại toàn bộ LuotKham theo lô (keyset trên ID), embedding theo lô, tái dùng vector cũ nếu khớp hash
+Tìm kiếm bằng cosine (vector đã chuẩn hóa, inner product)
+"""
+import os
+import sqlite3
+import hashlib
+import threading
+
+import faiss
+import numpy as np
+from sqlalchemy import and_, or_, case
+
+from app.ingest_store import SQL_BATCH_SIZE
+
+CASE_FIELDS = (("TrieuChung", "Triệu chứng"), ("BenhDanh", "Bệnh danh"), ("ChungDanh", "Chứng danh"))
+
+
+def case_text(visit) -> str:
+    """Văn bản đại diện 1 ca bệnh dùng để embedding (rỗng = lượt khám chưa có chẩn đoán, bỏ qua)"""
+    parts = []
+    for field, label in CASE_FIELDS:
+        value = (getattr(visit, field, None) or "").strip()
+        if value:
+            parts.append(f"{label}: {value}")
+    return ". ".join(parts)
+
+
+def _hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype="float32").reshape(len(vectors), -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.clip(norms, 1e-12, None)
+
+
+class CaseIndex:
+    def __init__(self, db_path: str, embeddings, batch_size: int = 256):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db_path = db_path
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.index = None
+        self.embedded = 0   # số ca đã phải embedding (không tính ca tái dùng vector)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS cases (
+                visit_id INTEGER PRIMARY KEY,
+                patient_id INTEGER NOT NULL,
+                text_hash TEXT NOT NULL,
+                text TEXT NOT NULL,
+                bai_thuoc TEXT,
+                vector BLOB NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_cases_patient ON cases (patient_id)")
+        self._conn.commit()
+        self._load()
+
+    # ---------- Nạp / ghi ----------
+    def _load(self):
+        """Đọc toàn bộ vector đã lưu vào FAISS (theo lô, không embedding lại)"""
+        with self._lock:
+            self.index = None
+            cursor = self._conn.execute("SELECT visit_id, vector FROM cases ORDER BY visit_id")
+            while True:
+                rows = cursor.fetchmany(SQL_BATCH_SIZE * 10)
+                if not rows:
+                    break
+                self._add_to_index([row[0] for row in rows], [np.frombuffer(row[1], dtype="float32") for row in rows])
+        if self.count:
+            print(f"🩺 Đã load chỉ mục {self.count} ca bệnh tương tự")
+
+    def _add_to_index(self, visit_ids, vectors):
+        vectors = np.vstack(vectors).astype("float32")
+        if self.index is None:
+            self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(vectors.shape[1]))
+        elif vectors.shape[1] != self.index.d:
+            raise ValueError(
+                f"Vector ca bệnh có {vectors.shape[1]} chiều nhưng chỉ mục đã có {self.index.d} chiều "
+                f"- đổi model embedding thì chạy: python rebuild_case_index.py --reembed"
+            )
+        self.index.add_with_ids(vectors, np.asarray(visit_ids, dtype="int64"))
+
+    def _remove_from_index(self, visit_ids):
+        if self.index is not None and visit_ids:
+            self.index.remove_ids(np.asarray(visit_ids, dtype="int64"))
+
+    def _stored_hashes(self, visit_ids):
+        found = {}
+        visit_ids = list(visit_ids)
+        for start in range(0, len(visit_ids), SQL_BATCH_SIZE):
+            batch = visit_ids[start:start + SQL_BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            found.update(self._conn.execute(
+                f"SELECT visit_id, text_hash FROM cases WHERE visit_id IN ({placeholders})", batch
+            ).fetchall())
+        return found
+
+    def _stored_vectors(self, text_hashes):
+        """Vector đã có theo hash văn bản (ca khác có cùng chẩn đoán cũng dùng lại được)"""
+        found = {}
+        text_hashes = list(text_hashes)
+        for start in range(0, len(text_hashes), SQL_BATCH_SIZE):
+            batch = text_hashes[start:start + SQL_BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            for text_hash, blob in self._conn.execute(
+                f"SELECT text_hash, vector FROM cases WHERE text_hash IN ({placeholders})", batch
+            ).fetchall():
+                found[text_hash] = np.frombuffer(blob, dtype="float32")
+        return found
+
+    # ---------- Cập nhật tăng dần ----------
+    def upsert_visits(self, visits, reembed: bool = False):
+        """
+        Thêm/cập nhật các lượt khám (đối tượng có LuotKhamID, BenhNhanID, TrieuChung, BenhDanh, ChungDanh, BaiThuoc)
+        Chẩn đoán không đổi -> chỉ cập nhật bài thuốc, không embedding lại. Trả về số ca phải embedding
+        """
+        visits = list(visits)
+        if not visits:
+            return 0
+        with self._lock:
+            stored = self._stored_hashes([v.LuotKhamID for v in visits])
+            empty, changed, unchanged = [], [], []
+            for visit in visits:
+                text = case_text(visit)
+                if not text:
+                    empty.append(visit.LuotKhamID)
+                elif reembed or stored.get(visit.LuotKhamID) != _hash_text(text):
+                    changed.append((visit, text, _hash_text(text)))
+                else:
+                    unchanged.append(visit)
+
+            vectors = {} if reembed else self._stored_vectors({h for _, _, h in changed})
+            missing = list({h: text for _, text, h in changed if h not in vectors}.items())
+            if missing:
+                embedded = self.embeddings.embed_documents([text for _, text in missing])
+                for (text_hash, _), vector in zip(missing, _normalize(embedded)):
+                    vectors[text_hash] = vector
+                self.embedded += len(missing)
+
+            self._conn.executemany(
+                "UPDATE cases SET bai_thuoc = ?, patient_id = ? WHERE visit_id = ?",
+                [(v.BaiThuoc, v.BenhNhanID, v.LuotKhamID) for v in unchanged]
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO cases (visit_id, patient_id, text_hash, text, bai_thuoc, vector) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(v.LuotKhamID, v.BenhNhanID, h, text, v.BaiThuoc, vectors[h].tobytes()) for v, text, h in changed]
+            )
+            removed = [visit_id for visit_id in empty if visit_id in stored]
+            self._delete_rows(removed)
+            self._conn.commit()
+
+            self._remove_from_index([v.LuotKhamID for v, _, _ in changed if v.LuotKhamID in stored] + removed)
+            if changed:
+                self._add_to_index([v.LuotKhamID for v, _, _ in changed], [vectors[h] for _, _, h in changed])
+            return len(missing)
+
+    def _delete_rows(self, visit_ids):
+        for start in range(0, len(visit_ids), SQL_BATCH_SIZE):
+            batch = visit_ids[start:start + SQL_BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            self._conn.execute(f"DELETE FROM cases WHERE visit_id IN ({placeholders})", batch)
+
+    def remove_visits(self, visit_ids):
+        visit_ids = [int(i) for i in visit_ids]
+        with self._lock:
+            stored = list(self._stored_hashes(visit_ids))
+            self._delete_rows(stored)
+            self._conn.commit()
+            self._remove_from_index(stored)
+        return len(stored)
+
+    def remove_patient(self, patient_id: int):
+        """Bỏ mọi ca của 1 bệnh nhân (gọi khi xóa bệnh nhân)"""
+        with self._lock:
+            visit_ids = [row[0] for row in self._conn.execute(
+                "SELECT visit_id FROM cases WHERE patient_id = ?", (patient_id,)
+            ).fetchall()]
+        return self.remove_visits(visit_ids)
+
+    def sync_patient(self, db, patient_id: int):
+        """Đồng bộ lại các lượt khám của 1 bệnh nhân (chỉ embedding ca có chẩn đoán thay đổi)"""
+        from app import models
+        visits = db.query(models.LuotKham).filter(models.LuotKham.BenhNhanID == patient_id).all()
+        with self._lock:
+            stale = set(row[0] for row in self._conn.execute(
+                "SELECT visit_id FROM cases WHERE patient_id = ?", (patient_id,)
+            ).fetchall()) - {v.LuotKhamID for v in visits}
+            self.remove_visits(stale)
+            return self.upsert_visits(visits)
+
+    # ---------- Đồng bộ / xây lại từ DB ----------
+    def _scan(self, db, after_id: int = 0):
+        """Duyệt LuotKham theo lô (keyset trên LuotKhamID), chỉ lấy các cột cần cho chỉ mục"""
+        from app import models
+        v = models.LuotKham
+        while True:
+            rows = db.query(v.LuotKhamID, v.BenhNhanID, v.TrieuChung, v.BenhDanh, v.ChungDanh, v.BaiThuoc)\
+                .filter(v.LuotKhamID > after_id)\
+                .order_by(v.LuotKhamID)\
+                .limit(self.batch_size).all()
+            if not rows:
+                return
+            yield rows
+            after_id = rows[-1].LuotKhamID
+
+    def _indexed_ids(self):
+        with self._lock:
+            return {row[0] for row in self._conn.execute("SELECT visit_id FROM cases").fetchall()}
+
+    @staticmethod
+    def _db_ids(db):
+        """(mọi LuotKhamID trong DB, LuotKhamID có chẩn đoán) - chỉ đọc ID, không đọc nội dung"""
+        from app import models
+        v = models.LuotKham
+        has_text = or_(*[and_(getattr(v, field).isnot(None), getattr(v, field) != "") for field, _ in CASE_FIELDS])
+        existing, with_text = set(), set()
+        for visit_id, flag in db.query(v.LuotKhamID, case((has_text, 1), else_=0)).all():
+            existing.add(visit_id)
+            if flag:
+                with_text.add(visit_id)
+        return existing, with_text
+
+    def _remove_deleted(self, db):
+        """Bỏ các ca không còn trong DB (so danh sách ID, không đọc nội dung)"""
+        existing, _ = self._db_ids(db)
+        return self.remove_visits(self._indexed_ids() - existing)
+
+    def sync(self, db):
+        """
+        Bắt kịp DB mà không xây lại: lập chỉ mục mọi lượt khám có chẩn đoán mà chỉ mục chưa có,
+        kể cả ID nhỏ hơn ca đã có (import_patients.py ghi trong lúc API chạy, cập nhật sau khi ghi bị lỗi),
+        bỏ ca đã xóa. Lượt khám bị sửa thẳng bằng SQL thì cần rebuild()
+        """
+        from app import models
+        v = models.LuotKham
+        existing, with_text = self._db_ids(db)
+        indexed = self._indexed_ids()
+        missing = sorted(with_text - indexed)
+        added = embedded = 0
+        step = min(self.batch_size, SQL_BATCH_SIZE)
+        for start in range(0, len(missing), step):
+            rows = db.query(v.LuotKhamID, v.BenhNhanID, v.TrieuChung, v.BenhDanh, v.ChungDanh, v.BaiThuoc)\
+                .filter(v.LuotKhamID.in_(missing[start:start + step])).all()
+            embedded += self.upsert_visits(rows)
+            added += len(rows)
+        removed = self.remove_visits(indexed - existing)
+        return {"scanned": added, "embedded": embedded, "removed": removed, "total": self.count}
+
+    def rebuild(self, db, reembed: bool = False, progress=None):
+        """
+        Quét lại toàn bộ LuotKham theo lô, embedding theo lô (tái dùng vector cũ nếu chẩn đoán không đổi)
+        reembed=True: embedding lại tất cả (sau khi đổi model embedding)
+        """
+        with self._lock:
+            if reembed:
+                self._conn.execute("DELETE FROM cases")
+                self._conn.commit()
+                self.index = None
+            scanned = embedded = 0
+            for rows in self._scan(db):
+                embedded += self.upsert_visits(rows, reembed=reembed)
+                scanned += len(rows)
+                if progress:
+                    progress(scanned, embedded)
+            removed = self._remove_deleted(db)
+            return {"scanned": scanned, "embedded": embedded, "removed": removed, "total": self.count}
+
+    # ---------- Tìm kiếm ----------
+    @property
+    def count(self) -> int:
+        return int(self.index.ntotal) if self.index is not None else 0
+
+    def search_by_vector(self, query_vector, k: int = 5, exclude_patient_id: int = None):
+        """
+        Trả về list {"visit_id", "patient_id", "score", "text", "bai_thuoc"} giống nhất (cosine giảm dần)
+        exclude_patient_id: bỏ các ca của chính bệnh nhân đang khám
+        """
+        with self._lock:
+            if not self.count:
+                return []
+            vector = _normalize([query_vector])
+            # Lấy dư 1 chút để còn đủ k sau khi bỏ ca của chính bệnh nhân
+            fetch = min(self.count, k * 4 if exclude_patient_id is not None else k)
+            scores, ids = self.index.search(vector, fetch)
+            hits = [(int(i), float(s)) for i, s in zip(ids[0], scores[0]) if i != -1]
+            if not hits:
+                return []
+            placeholders = ",".join("?" * len(hits))
+            rows = {
+                row[0]: row for row in self._conn.execute(
+                    f"SELECT visit_id, patient_id, text, bai_thuoc FROM cases WHERE visit_id IN ({placeholders})",
+                    [visit_id for visit_id, _ in hits]
+                ).fetchall()
+            }
+        results = []
+        for visit_id, score in hits:
+            row = rows.get(visit_id)
+            if row is None or (exclude_patient_id is not None and row[1] == exclude_patient_id):
+                continue
+            results.append({"visit_id": visit_id, "patient_id": row[1], "score": round(score, 4),
+                            "text": row[2], "bai_thuoc": row[3]})
+            if len(results) == k:
+                break
+        return results
+
+    def search(self, text: str, k: int = 5, exclude_patient_id: int = None):
+        return self.search_by_vector(self.embeddings.embed_query(text), k, exclude_patient_id)
+
+    def stats(self):
+        with self._lock:
+            patients = self._conn.execute("SELECT COUNT(DISTINCT patient_id) FROM cases").fetchone()[0]
+        return {"cases": self.count, "patients": patients, "embedded": self.embedded}
@@ -0,0 +1,187 @@
+"""
+Ghép context gửi cho Gemini trong giới hạn token
+- Chunk cùng nguồn nối tiếp/chồng nhau (splitter để overlap 200 ký tự) được nối thành 1 đoạn,
+  phần trùng chỉ giữ 1 lần
+- Chunk gần như trùng nội dung với đoạn đã chọn (cùng sách in 2 lần, đoạn lặp lại...) bị bỏ
+- Lấp đầy token_budget theo thứ tự liên quan (có thể lấy nhiều hơn k ứng viên từ FAISS)
+- Trả kèm thống kê token: baseline (top-k nguyên văn như trước) / packed / saved
+Đếm token bằng tiktoken (cl100k_base, xấp xỉ tokenizer của Gemini); thiếu thì ước lượng theo số ký tự
+"""
+import re
+from functools import lru_cache
+
+from langchain_core.documents import Document
+
+SEPARATOR = "\n\n"
+# Phần trùng ngắn hơn ngưỡng này coi là ngẫu nhiên, không nối
+MIN_OVERLAP_CHARS = 20
+SHINGLE_WORDS = 5
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return max(1, len(text) // 3)  # tiếng Việt có dấu: ~3 ký tự / token
+
+
+def overlap_length(a: str, b: str, max_overlap: int) -> int:
+    """Độ dài dài nhất mà phần cuối của a trùng phần đầu của b (0 nếu không trùng đủ dài)"""
+    if len(a) < MIN_OVERLAP_CHARS or len(b) < MIN_OVERLAP_CHARS:
+        return 0
+    probe = b[:MIN_OVERLAP_CHARS]
+    position = a.find(probe, max(0, len(a) - max_overlap))
+    while position != -1:
+        length = len(a) - position
+        if length <= len(b) and b.startswith(a[position:]):
+            return length
+        position = a.find(probe, position + 1)
+    return 0
+
+
+def _shingles(text: str):
+    words = _WORD.findall(text.lower())
+    if len(words) <= SHINGLE_WORDS:
+        return {tuple(words)}
+    return {tuple(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+
+class _Block:
+    """1 đoạn context: 1 chunk hoặc nhiều chunk cùng nguồn đã nối"""
+    __slots__ = ("text", "metadata", "source", "chunks", "shingles", "tokens")
+
+    def __init__(self, doc: Document, tokens: int):
+        self.text = doc.page_content
+        self.metadata = dict(doc.metadata)
+        self.source = doc.metadata.get("source")
+        self.chunks = 1
+        self.shingles = _shingles(doc.page_content)
+        self.tokens = tokens
+
+
+class ContextPacker:
+    def __init__(self, token_budget: int = 2000, fetch_k: int = 5, dedup_threshold: float = 0.85,
+                 max_overlap: int = 600):
+        self.token_budget = token_budget
+        self.fetch_k = fetch_k
+        self.dedup_threshold = dedup_threshold
+        self.max_overlap = max_overlap  # >= chunk_overlap của splitter, chừa chỗ cho khoảng trắng
+
+    def search_k(self, k: int) -> int:
+        """Số ứng viên cần lấy từ FAISS để lấp đầy budget"""
+        return max(k, self.fetch_k)
+
+    def _is_duplicate(self, text: str, shingles, blocks) -> bool:
+        for block in blocks:
+            if text in block.text:
+                return True
+            if len(shingles & block.shingles) >= self.dedup_threshold * len(shingles):
+                return True
+        return False
+
+    def _try_merge(self, block: _Block, text: str) -> int:
+        """Nối text vào block nếu cùng nguồn và chồng nhau; trả về số ký tự trùng đã bỏ (0 = không nối)"""
+        length = overlap_length(block.text, text, self.max_overlap)
+        if length:
+            block.text = block.text + text[length:]
+            return length
+        length = overlap_length(text, block.text, self.max_overlap)
+        if length:
+            block.text = text[:-length] + block.text
+            return length
+        return 0
+
+    def _absorb(self, block: _Block, blocks) -> int:
+        """Gộp các đoạn cùng nguồn chồng lên block vào block; trả về số token thay đổi"""
+        delta = 0
+        for other in list(blocks):
+            if other is block or other.source != block.source:
+                continue
+            before = block.tokens + other.tokens
+            if self._try_merge(block, other.text):
+                block.tokens = count_tokens(block.text)
+                block.chunks += other.chunks
+                block.shingles |= other.shingles
+                blocks.remove(other)
+                delta += block.tokens - before
+        return delta
+
+    def pack(self, candidates, k: int = 5):
+        """
+        candidates: Document theo thứ tự liên quan giảm dần (thường lấy search_k(k) kết quả)
+        Trả về (danh sách Document đã ghép, thống kê token)
+        """
+        candidates = list(candidates)
+        baseline = count_tokens(SEPARATOR.join(doc.page_content for doc in candidates[:k]))
+        blocks = []
+        used_tokens = 0
+        used_chunks = duplicates = 0
+        separator_tokens = count_tokens(SEPARATOR)
+
+        for doc in candidates:
+            text = doc.page_content
+            if not text.strip():
+                continue
+            shingles = _shingles(text)
+            if self._is_duplicate(text, shingles, blocks):
+                duplicates += 1
+                continue
+
+            overlapped = False
+            for block in blocks:
+                if block.source is None or block.source != doc.metadata.get("source"):
+                    continue
+                before = block.text
+                if not self._try_merge(block, text):
+                    continue
+                overlapped = True
+                extra = count_tokens(block.text) - block.tokens
+                if used_tokens + extra > self.token_budget:
+                    block.text = before  # nối vào thì vượt budget -> bỏ chunk này
+                else:
+                    block.tokens += extra
+                    block.chunks += 1
+                    block.shingles |= shingles
+                    used_tokens += extra
+                    used_chunks += 1
+                    # Chunk vừa nối có thể là cầu nối với 1 đoạn khác đã chọn -> gộp luôn
+                    used_tokens += self._absorb(block, blocks)
+                break
+            if overlapped:
+                continue
+
+            tokens = count_tokens(text) + (separator_tokens if blocks else 0)
+            # Chunk liên quan nhất luôn được giữ dù vượt budget (không để context rỗng)
+            if blocks and used_tokens + tokens > self.token_budget:
+                continue
+            blocks.append(_Block(doc, tokens))
+            used_tokens += tokens
+            used_chunks += 1
+
+        docs = [
+            Document(page_content=block.text, metadata={**block.metadata, "merged_chunks": block.chunks})
+            for block in blocks
+        ]
+        packed = count_tokens(SEPARATOR.join(block.text for block in blocks))
+        return docs, {
+            "baseline": baseline,
+            "packed": packed,
+            "saved": baseline - packed,
+            "candidates": len(candidates),
+            "chunks_used": used_chunks,
+            "merged": sum(block.chunks - 1 for block in blocks),
+            "duplicates_dropped": duplicates,
+        }
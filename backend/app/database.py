@@ -3,6 +3,8 @@ from sqlalchemy.orm import sessionmaker, declarative_base
 import os
 from dotenv import load_dotenv
 
+from app import metrics
+
 # 1. Lấy đường dẫn tuyệt đối tới file .env
 base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 env_path = os.path.join(base_dir, ".env")
@@ -20,11 +22,17 @@ if not DATABASE_URL:
     raise ValueError("Chua tim thay DATABASE_URL trong file .env")
 
 # 3. Tạo kết nối
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+# SQL Server + pyodbc: executemany gửi cả lô tham số 1 lần (nhập hàng loạt), tắt bằng DB_FAST_EXECUTEMANY=0
+engine_options = {}
+if DATABASE_URL.startswith("mssql+pyodbc") and os.getenv("DB_FAST_EXECUTEMANY", "1") != "0":
+    engine_options["fast_executemany"] = True
+engine = create_engine(DATABASE_URL, pool_pre_ping=True, **engine_options)
+metrics.instrument_engine(engine)  # đếm số câu SQL / thời gian mỗi request (tắt: METRICS_ENABLED=0)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
 def get_db():
+    metrics.mark_db_session()
     db = SessionLocal()
     try:
         yield db
@@ -0,0 +1,154 @@
+"""
+Tạo model embedding theo cấu hình (.env), cùng 1 interface Embeddings của LangChain
+- torch     : HuggingFaceEmbeddings (sentence-transformers, PyTorch full precision) - mặc định
+- onnx      : cùng model export sang ONNX, chạy bằng ONNX Runtime
+- onnx_int8 : bản ONNX lượng tử hóa động int8 (nhanh nhất trên CPU, lệch rất nhỏ)
+Cả 3 dùng cùng tokenizer + mean pooling của model gốc -> cùng số chiều, dùng chung index cũ được.
+Kiểm tra tốc độ + độ lệch cosine trước khi đổi: python -m benchmarks.bench_embeddings
+"""
+import os
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+from langchain_community.embeddings import HuggingFaceEmbeddings
+
+load_dotenv()
+
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx_int8")
+EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+# Model gốc cắt câu ở 128 token (max_seq_length của sentence-transformers)
+EMBEDDING_MAX_LENGTH = 128
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ONNX_MODELS_PATH = os.path.join(BASE_DIR, "storage", "models")
+
+ONNX_FILE = "model.onnx"
+ONNX_INT8_FILE = "model_int8.onnx"
+
+
+def embedding_params_from_env():
+    return {
+        "backend": os.getenv("EMBEDDING_BACKEND", "torch"),
+        "model": os.getenv("EMBEDDING_MODEL", EMBEDDING_MODEL),
+        "batch_size": int(os.getenv("EMBEDDING_BATCH_SIZE", "32")),
+        "threads": int(os.getenv("EMBEDDING_THREADS", "0")),  # 0 = để thư viện tự chọn
+        "onnx_path": os.getenv("EMBEDDING_ONNX_PATH", ""),     # trống = storage/models/<tên model>
+    }
+
+
+def onnx_dir(params: dict) -> str:
+    return params["onnx_path"] or os.path.join(ONNX_MODELS_PATH, params["model"].replace("/", "__"))
+
+
+def export_onnx(model_name: str, out_dir: str, quantize: bool = True):
+    """
+    Export transformer của model sang ONNX (trục batch/sequence động) + lưu tokenizer,
+    rồi lượng tử hóa động int8 (trọng số MatMul/Gemm). Chỉ cần chạy 1 lần, cần torch + onnx
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(out_dir, exist_ok=True)
+    print(f"📦 Export {model_name} sang ONNX: {out_dir}")
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name)
+    model.eval()
+
+    sample = tokenizer(["Bệnh nhân ho khan, sốt nhẹ"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]}
+    with torch.no_grad():
+        torch.onnx.export(
+            model, tuple(sample[name] for name in input_names), os.path.join(out_dir, ONNX_FILE),
+            input_names=input_names, output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes, opset_version=14, do_constant_folding=True,
+        )
+    tokenizer.save_pretrained(out_dir)
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        print("🔧 Lượng tử hóa động int8...")
+        quantize_dynamic(
+            os.path.join(out_dir, ONNX_FILE), os.path.join(out_dir, ONNX_INT8_FILE),
+            weight_type=QuantType.QInt8,
+        )
+    print("✅ Export xong")
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    Embedding bằng ONNX Runtime: tokenizer gốc -> transformer (ONNX) -> mean pooling theo attention mask
+    (giống hệt pipeline sentence-transformers của model, không chuẩn hóa vector)
+    Văn bản được sắp theo độ dài trước khi chia lô -> ít padding, mỗi lô chạy nhanh hơn
+    """
+
+    def __init__(self, model_dir: str, quantized: bool = False, batch_size: int = 32, threads: int = 0,
+                 max_length: int = EMBEDDING_MAX_LENGTH):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        model_file = os.path.join(model_dir, ONNX_INT8_FILE if quantized else ONNX_FILE)
+        self.session = ort.InferenceSession(model_file, options, providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.batch_size = batch_size
+        self.max_length = max_length
+
+    def _encode(self, texts):
+        encoded = self.tokenizer(
+            texts, padding=True, truncation=True, max_length=self.max_length, return_tensors="np"
+        )
+        feed = {name: encoded[name].astype("int64") for name in self.input_names}
+        hidden = self.session.run(None, feed)[0]
+        mask = encoded["attention_mask"][..., None].astype("float32")
+        return (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        if not texts:
+            return []
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            for i, vector in zip(batch, self._encode([texts[i] for i in batch])):
+                vectors[i] = vector.tolist()
+        return vectors
+
+    def embed_query(self, text):
+        return self._encode([text])[0].tolist()
+
+
+def create_embeddings(params: dict = None):
+    """Tạo model embedding theo params (mặc định đọc từ env); thiếu file ONNX thì tự export"""
+    params = params or embedding_params_from_env()
+    backend = params["backend"]
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"EMBEDDING_BACKEND không hợp lệ: {backend} (chọn: {', '.join(EMBEDDING_BACKENDS)})")
+
+    started = time.perf_counter()
+    if backend == "torch":
+        if params["threads"]:
+            import torch
+            torch.set_num_threads(params["threads"])
+        embeddings = HuggingFaceEmbeddings(
+            model_name=params["model"],
+            encode_kwargs={"batch_size": params["batch_size"]},
+        )
+    else:
+        model_dir = onnx_dir(params)
+        quantized = backend == "onnx_int8"
+        if not os.path.exists(os.path.join(model_dir, ONNX_INT8_FILE if quantized else ONNX_FILE)):
+            export_onnx(params["model"], model_dir, quantize=quantized)
+        embeddings = OnnxEmbeddings(
+            model_dir, quantized=quantized, batch_size=params["batch_size"], threads=params["threads"]
+        )
+    print(f"🧠 Embedding backend: {backend} ({time.perf_counter() - started:.1f}s để load)")
+    return embeddings
@@ -0,0 +1,135 @@
+"""
+Tạo / chuyển đổi FAISS index theo loại cấu hình
+- flat     : tìm chính xác (mặc định của FAISS.from_documents), chi phí tăng tuyến tính theo số chunk
+- hnsw     : đồ thị HNSW, nhanh, recall cao, tốn RAM hơn flat một chút
+- ivf_flat : chia cụm (IVF), chỉ quét nprobe cụm gần nhất
+- ivf_pq   : IVF + nén Product Quantization, tiết kiệm RAM nhất
+Tất cả dùng metric L2 giống index flat hiện tại để kết quả tương thích
+"""
+import os
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+
+# FAISS khuyến nghị >= 39 điểm train cho mỗi centroid
+MIN_POINTS_PER_CENTROID = 39
+
+
+def index_params_from_env():
+    """Đọc cấu hình index từ biến môi trường"""
+    return {
+        "type": os.getenv("VECTOR_INDEX_TYPE", "flat").lower(),
+        "nlist": int(os.getenv("VECTOR_INDEX_NLIST", "0")),  # 0 = tự tính theo số vector
+        "nprobe": int(os.getenv("VECTOR_INDEX_NPROBE", "16")),
+        "hnsw_m": int(os.getenv("VECTOR_INDEX_HNSW_M", "32")),
+        "ef_construction": int(os.getenv("VECTOR_INDEX_EF_CONSTRUCTION", "80")),
+        "ef_search": int(os.getenv("VECTOR_INDEX_EF_SEARCH", "64")),
+        "pq_m": int(os.getenv("VECTOR_INDEX_PQ_M", "48")),
+        "pq_nbits": int(os.getenv("VECTOR_INDEX_PQ_NBITS", "8")),
+        "train_size": int(os.getenv("VECTOR_INDEX_TRAIN_SIZE", "50000")),
+    }
+
+
+def index_type_of(index) -> str:
+    """Nhận diện loại của 1 FAISS index đang có"""
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+
+def min_train_size(params: dict) -> int:
+    """Số vector tối thiểu để train được loại index này"""
+    if params["type"] == "ivf_pq":
+        return max(2 ** params["pq_nbits"], MIN_POINTS_PER_CENTROID)
+    if params["type"] == "ivf_flat":
+        return MIN_POINTS_PER_CENTROID
+    return 0
+
+
+def _nlist_for(num_vectors: int, params: dict) -> int:
+    nlist = params["nlist"] or int(4 * np.sqrt(num_vectors))
+    # Không để số cụm vượt quá số điểm train cho phép
+    return max(1, min(nlist, num_vectors // MIN_POINTS_PER_CENTROID))
+
+
+def make_index(dim: int, params: dict, train_vectors=None):
+    """Tạo index rỗng (đã train nếu là IVF) theo params["type"]"""
+    index_type = params["type"]
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Loại index không hợp lệ: {index_type} (chọn 1 trong {', '.join(INDEX_TYPES)})")
+
+    if index_type == "flat":
+        return faiss.IndexFlatL2(dim)
+
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, params["hnsw_m"])
+        index.hnsw.efConstruction = params["ef_construction"]
+        return tune_index(index, params)
+
+    if train_vectors is None or len(train_vectors) < min_train_size(params):
+        raise ValueError(
+            f"Cần ít nhất {min_train_size(params)} vector để train index {index_type}"
+        )
+
+    train_vectors = np.ascontiguousarray(train_vectors, dtype="float32")
+    nlist = _nlist_for(len(train_vectors), params)
+    quantizer = faiss.IndexFlatL2(dim)
+    if index_type == "ivf_flat":
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+    else:
+        if dim % params["pq_m"] != 0:
+            raise ValueError(f"pq_m={params['pq_m']} phải chia hết số chiều {dim}")
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, params["pq_m"], params["pq_nbits"])
+    index.train(train_vectors)
+    return tune_index(index, params)
+
+
+def tune_index(index, params: dict):
+    """Áp tham số lúc tìm kiếm (nprobe cho IVF, efSearch cho HNSW)"""
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = params["ef_search"]
+    elif isinstance(index, faiss.IndexIVF):
+        index.nprobe = params["nprobe"]
+    return index
+
+
+def sample_vectors(vectors, size: int, seed: int = 42):
+    """Lấy mẫu ngẫu nhiên (không lặp) để train"""
+    if len(vectors) <= size:
+        return vectors
+    rng = np.random.default_rng(seed)
+    return vectors[np.sort(rng.choice(len(vectors), size, replace=False))]
+
+
+def all_vectors(index):
+    """Đọc lại toàn bộ vector đang nằm trong index (theo đúng thứ tự ID)"""
+    if isinstance(index, faiss.IndexIVF):
+        index.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def build_index(vectors, params: dict):
+    """Train trên 1 mẫu của vectors rồi add toàn bộ, giữ nguyên thứ tự (ID 0..n-1)"""
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    train = sample_vectors(vectors, params["train_size"]) if params["type"] in ("ivf_flat", "ivf_pq") else None
+    index = make_index(vectors.shape[1], params, train)
+    index.add(vectors)
+    return index
+
+
+def convert_index(index, params: dict):
+    """Chuyển index hiện có sang loại mới; thứ tự vector giữ nguyên nên docstore không phải đổi"""
+    if index_type_of(index) == "ivf_pq":
+        print("⚠️ Index nguồn là IVF-PQ (đã nén) - vector đọc lại chỉ là xấp xỉ")
+    return build_index(all_vectors(index), params)
+
+
+def index_memory_bytes(index) -> int:
+    """Dung lượng index khi serialize (xấp xỉ RAM mà index chiếm)"""
+    return int(faiss.serialize_index(index).nbytes)
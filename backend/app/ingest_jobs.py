@@ -0,0 +1,219 @@
+"""
+Hàng đợi job ingest PDF chạy nền cho /api/upload
+- Upload chỉ lưu file + xếp job rồi trả về job_id ngay (không giữ request suốt lúc parse/embedding)
+- 1 worker nền xử lý lần lượt (ingest_pdfs vốn đã chỉ cho 1 đợt ghi index mỗi lúc)
+- Hàng đợi có giới hạn (INGEST_QUEUE_MAX): đầy thì từ chối job mới (API trả 429) thay vì dồn RAM/ổ cứng
+- Cùng nội dung file (SHA-256) đang chờ/đang chạy -> gộp vào job đang có, không học 2 lần
+- Job học theo kiểu streaming (từng trang), tiến độ (trang, chunk đã xử lý) cập nhật sau mỗi lô embedding, xem qua /api/ingest/jobs/{id}
+"""
+import os
+import time
+import uuid
+import queue
+import hashlib
+import threading
+from collections import OrderedDict
+
+INGEST_QUEUE_MAX = int(os.getenv("INGEST_QUEUE_MAX", "8"))
+INGEST_JOB_HISTORY = int(os.getenv("INGEST_JOB_HISTORY", "200"))  # số job đã xong còn giữ để tra cứu
+
+ACTIVE_STATUSES = ("queued", "running")
+
+
+class QueueFullError(Exception):
+    """Hàng đợi ingest đã đầy - client nên thử lại sau"""
+
+
+def save_upload(fileobj, pdf_dir: str):
+    """Ghi file upload ra file tạm trong pdf_dir theo từng khối, tính SHA-256 luôn; trả về (đường dẫn tạm, hash)"""
+    tmp_path = os.path.join(pdf_dir, f".upload-{uuid.uuid4().hex}.part")
+    digest = hashlib.sha256()
+    with open(tmp_path, "wb") as f:
+        for block in iter(lambda: fileobj.read(1024 * 1024), b""):
+            digest.update(block)
+            f.write(block)
+    return tmp_path, digest.hexdigest()
+
+
+class IngestJob:
+    def __init__(self, file_path: str, filename: str, file_hash: str):
+        self.id = uuid.uuid4().hex
+        self.file_path = file_path
+        self.filename = filename
+        self.file_hash = file_hash
+        self.status = "queued"  # queued -> running -> done / failed
+        self.stage = None       # parsing -> embedding -> done
+        self.pages = 0
+        self.pages_total = None
+        self.chunks = 0
+        self.chunks_processed = 0
+        self.chunks_added = 0
+        self.skipped = False    # nội dung đã học từ trước -> không làm gì
+        self.duplicates = 0     # số lần upload trùng được gộp vào job này
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def update_progress(self, report):
+        self.pages = report["pages"]
+        self.pages_total = report.get("pages_total")
+        self.chunks = report["chunks"]
+        self.chunks_processed = report["chunks_processed"]
+        self.chunks_added = report["chunks_added"]
+        self.stage = "embedding" if self.chunks else "parsing"
+
+    def to_dict(self, queue_position: int = None):
+        if self.status == "done":
+            progress = 1.0
+        elif self.pages_total:
+            # Streaming: chưa biết tổng số chunk, tính theo số trang đã đọc
+            progress = self.pages / self.pages_total
+        else:
+            progress = self.chunks_processed / self.chunks if self.chunks else 0.0
+        finished = self.finished_at or time.time()
+        return {
+            "job_id": self.id,
+            "filename": self.filename,
+            "status": self.status,
+            "stage": self.stage,
+            "queue_position": queue_position,
+            "pages": self.pages,
+            "pages_total": self.pages_total,
+            "chunks": self.chunks,
+            "chunks_processed": self.chunks_processed,
+            "chunks_added": self.chunks_added,
+            "skipped": self.skipped,
+            "progress": round(progress, 4),
+            "duplicates": self.duplicates,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "elapsed_seconds": round(finished - self.started_at, 3) if self.started_at else None,
+        }
+
+
+class IngestJobQueue:
+    def __init__(self, rag_service, pdf_dir: str, max_queued: int = INGEST_QUEUE_MAX,
+                 history: int = INGEST_JOB_HISTORY):
+        self.rag = rag_service
+        self.pdf_dir = pdf_dir
+        self.history = history
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._jobs = OrderedDict()  # job_id -> IngestJob (cũ nhất trước)
+        self._active = {}           # file_hash -> IngestJob đang chờ/đang chạy
+        self._lock = threading.Lock()
+        self._worker = None
+
+    # ---------- Nhận upload ----------
+    def submit_upload(self, fileobj, filename: str):
+        """
+        Ghi file upload xuống ổ cứng theo từng khối (tính SHA-256 luôn trong lúc ghi) rồi xếp job
+        Trả về (job, coalesced). Hàng đợi đầy -> QueueFullError (kiểm tra trước cả khi ghi file)
+        """
+        if self._queue.full():
+            raise QueueFullError(self._full_message())
+        tmp_path, file_hash = save_upload(fileobj, self.pdf_dir)
+        return self.submit_file(tmp_path, filename, file_hash)
+
+    def is_full(self) -> bool:
+        return self._queue.full()
+
+    def submit_file(self, tmp_path: str, filename: str, file_hash: str):
+        """
+        Xếp job cho file upload đã ghi xong (tmp_path, SHA-256 file_hash); file tạm được đổi tên hoặc xóa
+        Trả về (job, coalesced) như submit_upload
+        """
+        filename = os.path.basename(filename or "upload.pdf")
+        with self._lock:
+            existing = self._active.get(file_hash)
+            if existing:
+                # Cùng nội dung đang chờ/đang học -> gộp, không ghi đè file job kia đang đọc
+                os.remove(tmp_path)
+                existing.duplicates += 1
+                return existing, True
+
+            path = os.path.join(self.pdf_dir, filename)
+            if any(job.file_path == path for job in self._active.values()):
+                # Trùng tên với file đang chờ học nhưng khác nội dung -> lưu tên khác
+                stem, ext = os.path.splitext(filename)
+                path = os.path.join(self.pdf_dir, f"{stem}-{file_hash[:8]}{ext}")
+            os.replace(tmp_path, path)
+
+            job = IngestJob(path, os.path.basename(path), file_hash)
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                os.remove(path)
+                raise QueueFullError(self._full_message())
+            self._active[file_hash] = job
+            self._jobs[job.id] = job
+            self._ensure_worker()
+            return job, False
+
+    def _full_message(self):
+        return f"Hàng đợi ingest đã đầy ({self._queue.maxsize} job), vui lòng thử lại sau"
+
+    # ---------- Tra cứu ----------
+    def get(self, job_id: str):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.to_dict(self._position(job)) if job else None
+
+    def list(self):
+        with self._lock:
+            return [job.to_dict(self._position(job)) for job in reversed(self._jobs.values())]
+
+    def stats(self):
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+        return {
+            "queued": statuses.count("queued"), "running": statuses.count("running"),
+            "done": statuses.count("done"), "failed": statuses.count("failed"),
+            "capacity": self._queue.maxsize,
+        }
+
+    def _position(self, job):
+        """Vị trí trong hàng đợi (1 = chạy tiếp theo); None nếu không còn chờ"""
+        if job.status != "queued":
+            return None
+        waiting = [j for j in self._jobs.values() if j.status == "queued"]
+        return waiting.index(job) + 1
+
+    # ---------- Worker ----------
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="ingest-worker", daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            job.status = "running"
+            job.stage = "parsing"
+            job.started_at = time.time()
+            try:
+                report = self.rag.ingest_pdf_stream(job.file_path, progress=job.update_progress)
+                job.update_progress(report)
+                job.skipped = bool(report["files_skipped"])
+                if report["files_failed"]:
+                    job.status = "failed"
+                    job.error = "Không đọc được nội dung PDF (file hỏng hoặc PDF scan chưa có text)"
+                else:
+                    job.status = "done"
+            except Exception as e:
+                job.status = "failed"
+                job.error = str(e)
+            finally:
+                job.stage = "done" if job.status == "done" else job.stage
+                job.finished_at = time.time()
+                with self._lock:
+                    self._active.pop(job.file_hash, None)
+                    self._trim_history()
+                self._queue.task_done()
+
+    def _trim_history(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.status not in ACTIVE_STATUSES]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[job_id]
@@ -0,0 +1,148 @@
+"""
+Pipeline ingest PDF song song
+- Giai đoạn 1 (process pool): đọc PDF bằng PyPDFLoader + cắt chunk, mỗi file 1 tiến trình
+- Hàng đợi có giới hạn: tối đa max_pending file đang xử lý/chờ, tránh tràn RAM
+- Giai đoạn 2 (tiến trình chính): RAGService gom chunk và embedding theo lô
+- iter_page_chunks: chế độ streaming cho 1 file - đọc từng trang, cắt chunk dần (RAM không phụ thuộc cỡ sách)
+  trang scan không có text layer được OCR (app.ocr); bulk ingest chuyển file cần OCR sang chế độ này
+Hàm ở đây phải đặt ở cấp module để pickle được sang tiến trình con (Windows dùng spawn)
+"""
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from langchain_core.documents import Document
+from langchain_community.document_loaders import PyPDFLoader
+from langchain_text_splitters.character import RecursiveCharacterTextSplitter
+
+from app.ocr import ocr_available, needs_ocr, iter_pdf_pages
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+
+def default_workers():
+    return int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 1)))
+
+
+def load_and_split(file_path: str):
+    """
+    Đọc PDF bằng PyPDFLoader và cắt nhỏ
+    Trả về (số trang, danh sách chunk) - danh sách rỗng nếu không đọc được,
+    chunks = None nếu có trang cần OCR (để tiến trình chính OCR song song theo trang)
+    """
+    # Dùng PyPDFLoader - đơn giản, ổn định
+    loader = PyPDFLoader(file_path)
+    docs = loader.load()
+
+    if not docs or len(docs) == 0:
+        print("❌ Không thể đọc nội dung PDF")
+        return 0, []
+
+    print(f"📄 Đã đọc {len(docs)} trang từ PDF")
+
+    if any(needs_ocr(doc.page_content) for doc in docs) and ocr_available():
+        print("🔎 PDF có trang scan không có text layer -> chuyển sang OCR")
+        return len(docs), None
+
+    # DEBUG: Check if docs have actual text content
+    total_text_length = sum(len(doc.page_content.strip()) for doc in docs)
+    print(f"🔍 DEBUG: Tổng độ dài text: {total_text_length} ký tự")
+
+    if total_text_length < 10:
+        print("⚠️ PDF có thể là scan/image, không có text layer. Cần OCR!")
+        return len(docs), []
+
+    # Cắt nhỏ văn bản (Chunking)
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP
+    )
+    chunks = splitter.split_documents(docs)
+
+    print(f"🔍 DEBUG: Số chunks sau split: {len(chunks) if chunks else 0}")
+
+    if not chunks or len(chunks) == 0:
+        print("❌ Không có nội dung sau chunking")
+        return len(docs), []
+    return len(docs), chunks
+
+
+def iter_page_chunks(file_path: str, ocr_cache=None, ocr_stats=None):
+    """
+    Đọc PDF lần lượt từng trang (lazy_load, trang scan thì OCR) và cắt chunk tăng dần
+    Chunk cuối của mỗi trang được giữ lại ghép với trang sau -> overlap liền mạch qua ranh giới trang.
+    Yield (số trang đã đọc, tổng số trang nếu biết, các chunk đã hoàn chỉnh) sau mỗi trang
+    ocr_cache/ocr_stats: xem app.ocr.iter_pdf_pages
+    """
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        add_start_index=True
+    )
+    carry, carry_metadata = "", None
+    pages, total_pages = 0, None
+    for page in iter_pdf_pages(file_path, cache=ocr_cache, stats=ocr_stats):
+        pages += 1
+        total_pages = page.metadata.get("total_pages", total_pages)
+        if not page.page_content.strip():
+            yield pages, total_pages, []
+            continue
+
+        # Phần đầu buffer là chunk còn dở của trang trước (giữ metadata trang đó)
+        prefix = len(carry) + 1 if carry else 0
+        buffer = carry + "\n" + page.page_content if carry else page.page_content
+        parts = splitter.create_documents([buffer])
+
+        ready = []
+        for part in parts:
+            metadata = carry_metadata if part.metadata["start_index"] < prefix else page.metadata
+            ready.append(Document(page_content=part.page_content, metadata=dict(metadata)))
+        last = ready.pop()
+        carry, carry_metadata = last.page_content, last.metadata
+        yield pages, total_pages, ready
+
+    if carry.strip():
+        yield pages, total_pages, [Document(page_content=carry, metadata=carry_metadata)]
+
+
+def _safe_load_and_split(file_path: str):
+    """Bọc load_and_split để lỗi của 1 file không làm hỏng cả pool"""
+    try:
+        num_pages, chunks = load_and_split(file_path)
+        return num_pages, chunks, None
+    except Exception as e:
+        return 0, [], str(e)
+
+
+def iter_parsed(file_paths, workers: int = None, max_pending: int = None):
+    """
+    Parse + chunk các file song song, trả về lần lượt (file_path, số trang, chunks, lỗi)
+    theo đúng thứ tự đầu vào. Chỉ giữ tối đa max_pending file trong hàng đợi:
+    tiến trình chính vừa embedding vừa để các worker parse file tiếp theo
+    """
+    file_paths = list(file_paths)
+    workers = workers or default_workers()
+
+    # 1 worker hoặc 1 file: chạy luôn trong tiến trình hiện tại, khỏi tốn chi phí tạo pool
+    if workers <= 1 or len(file_paths) <= 1:
+        for file_path in file_paths:
+            yield (file_path, *_safe_load_and_split(file_path))
+        return
+
+    max_pending = max_pending or workers * 2
+    with ProcessPoolExecutor(max_workers=min(workers, len(file_paths))) as pool:
+        queue = deque()
+        remaining = iter(file_paths)
+        for file_path in remaining:
+            queue.append((file_path, pool.submit(_safe_load_and_split, file_path)))
+            if len(queue) >= max_pending:
+                break
+
+        while queue:
+            file_path, future = queue.popleft()
+            # Lấy 1 kết quả ra thì nạp thêm 1 file vào hàng đợi
+            next_path = next(remaining, None)
+            if next_path is not None:
+                queue.append((next_path, pool.submit(_safe_load_and_split, next_path)))
+            yield (file_path, *future.result())
@@ -0,0 +1,189 @@
+"""
+Kho lưu trữ phục vụ ingest PDF không lặp (idempotent)
+- files: manifest hash nội dung file PDF -> đã học hay chưa
+- embeddings: hash nội dung chunk -> vector embedding (content-addressed)
+- ocr_pages: hash nội dung trang PDF scan + cấu hình OCR -> chữ đã OCR (không OCR lại khi chạy lại)
+- IngestJournal: nhật ký append-only để bulk ingest chết giữa chừng vẫn resume được
+Lưu bằng SQLite (thư viện chuẩn) cạnh storage/vector_db
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+import numpy as np
+
+# SQLite giới hạn số tham số trong 1 câu lệnh -> truy vấn theo lô
+SQL_BATCH_SIZE = 500
+
+
+def hash_file(file_path: str) -> str:
+    """SHA-256 nội dung file (đọc từng khối 1MB, không load cả file vào RAM)"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hash_chunk(text: str) -> str:
+    """SHA-256 nội dung 1 đoạn văn bản (dùng làm ID của chunk)"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class IngestStore:
+    def __init__(self, db_path: str):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                file_hash TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                num_chunks INTEGER NOT NULL,
+                ingested_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                chunk_hash TEXT PRIMARY KEY,
+                vector BLOB NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS ocr_pages (
+                page_key TEXT PRIMARY KEY,
+                text TEXT NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    # ---------- Manifest file PDF ----------
+    def get_file(self, file_hash: str):
+        """Trả về {"filename", "num_chunks", "ingested_at"} nếu file đã học, ngược lại None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT filename, num_chunks, ingested_at FROM files WHERE file_hash = ?",
+                (file_hash,)
+            ).fetchone()
+        if not row:
+            return None
+        return {"filename": row[0], "num_chunks": row[1], "ingested_at": row[2]}
+
+    def record_file(self, file_hash: str, filename: str, num_chunks: int):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (file_hash, filename, num_chunks, ingested_at) VALUES (?, ?, ?, ?)",
+                (file_hash, filename, num_chunks, time.time())
+            )
+            self._conn.commit()
+
+    def forget_document(self, filename: str):
+        """Bỏ manifest của mọi phiên bản 1 tài liệu (đã xóa/thay) -> upload lại sẽ được học lại"""
+        with self._lock:
+            self._conn.execute("DELETE FROM files WHERE filename = ?", (filename,))
+            self._conn.commit()
+
+    # ---------- Kho embedding theo hash chunk ----------
+    def get_embeddings(self, chunk_hashes):
+        """Trả về dict chunk_hash -> vector (np.float32) cho các hash đã có sẵn"""
+        found = {}
+        chunk_hashes = list(chunk_hashes)
+        with self._lock:
+            for start in range(0, len(chunk_hashes), SQL_BATCH_SIZE):
+                batch = chunk_hashes[start:start + SQL_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT chunk_hash, vector FROM embeddings WHERE chunk_hash IN ({placeholders})",
+                    batch
+                ).fetchall()
+                for chunk_hash, blob in rows:
+                    found[chunk_hash] = np.frombuffer(blob, dtype="float32")
+        return found
+
+    def put_embeddings(self, vectors: dict):
+        """Lưu dict chunk_hash -> vector vào kho"""
+        rows = [
+            (chunk_hash, np.asarray(vector, dtype="float32").tobytes())
+            for chunk_hash, vector in vectors.items()
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (chunk_hash, vector) VALUES (?, ?)",
+                rows
+            )
+            self._conn.commit()
+
+    # ---------- Cache OCR theo hash trang ----------
+    def get_ocr_text(self, page_key: str):
+        """Chữ đã OCR của trang (chuỗi, có thể rỗng), None nếu chưa OCR"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text FROM ocr_pages WHERE page_key = ?", (page_key,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def put_ocr_text(self, page_key: str, text: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ocr_pages (page_key, text) VALUES (?, ?)",
+                (page_key, text)
+            )
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            num_files = self._conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+            num_embeddings = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            num_ocr_pages = self._conn.execute("SELECT COUNT(*) FROM ocr_pages").fetchone()[0]
+        return {"files": num_files, "embeddings": num_embeddings, "ocr_pages": num_ocr_pages}
+
+
+class IngestJournal:
+    """
+    Nhật ký append-only cho bulk ingest (JSON Lines)
+    - {"type": "chunks", ...}: 1 lô chunk đã embedding xong (vector nằm trong IngestStore)
+    - {"type": "file", ...}  : 1 file PDF đã xử lý hết
+    Nếu tiến trình chết giữa chừng, lần khởi động sau replay nhật ký vào index
+    rồi commit 1 lần, không phải parse/embedding lại từ đầu
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.bytes_written = 0
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def _append(self, record: dict):
+        line = (json.dumps(record, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+        with open(self.path, "ab") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        self.bytes_written += len(line)
+
+    def append_chunks(self, ids, texts, metadatas):
+        self._append({"type": "chunks", "ids": ids, "texts": texts, "metadatas": metadatas})
+
+    def append_file(self, file_hash: str, filename: str, num_chunks: int):
+        self._append({"type": "file", "file_hash": file_hash, "filename": filename, "num_chunks": num_chunks})
+
+    def read(self):
+        """Đọc toàn bộ bản ghi; bỏ qua dòng cuối bị ghi dở (crash giữa lúc ghi)"""
+        records = []
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+        return records
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -1,20 +1,35 @@
+import time
+_IMPORT_STARTED = time.perf_counter()  # phase "import" (nạp thư viện) trong /health/ready
+
 import os
-import shutil
-from typing import List, Optional
+import json
+import threading
+from datetime import datetime
+from typing import List, Optional, Literal
 
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form, Query, Header
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from sqlalchemy import desc
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import text
+from sqlalchemy.orm import Session, selectinload
 
 # Import các module đã làm
-from app.database import engine, Base, get_db
-from app import models, schemas
-from app.rag_service import RAGService
+from app.database import engine, Base, get_db, SessionLocal
+from app import models, schemas, patient_search, patient_queries, patient_import, patient_export, metrics
+from app.rag_service import RAGService, RETRIEVAL_SERVER
+from app.ingest_jobs import IngestJobQueue, QueueFullError
+from app.retrieval_rpc import RemoteIngestJobs
+from app.patient_cache import create_patient_cache
+
+# Thời gian khởi động từng phase (giây), xem /health/ready
+STARTUP_TIMINGS = {"import": round(time.perf_counter() - _IMPORT_STARTED, 3)}
 
 # 1. Khởi tạo Database
 # Lệnh này sẽ tạo bảng nếu chưa có (nhưng bạn đã chạy SQL script rồi nên nó sẽ bỏ qua)
+_started = time.perf_counter()
 models.Base.metadata.create_all(bind=engine)
+STARTUP_TIMINGS["database"] = round(time.perf_counter() - _started, 3)
 
 # 2. Khởi tạo App FastAPI
 app = FastAPI(title="TCM Doctor Chatbot", description="API hỗ trợ chẩn đoán Đông Y")
@@ -28,13 +43,126 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Đo thời gian request + số câu SQL mỗi request (tắt bằng METRICS_ENABLED=0)
+metrics.install(app)
+
 # 4. Khởi tạo Bộ não AI (RAG)
-rag_service = RAGService()
+# Có RETRIEVAL_SERVER: model embedding + index nằm ở retrieval_server.py, worker này chỉ gọi sang
+# Mặc định khởi động nền lúc startup: API bệnh nhân phục vụ ngay, API cần AI trả 503 + Retry-After tới khi xong
+# (RAG_WARMUP_BACKGROUND=0: chờ khởi động xong ngay lúc import như cũ)
+RAG_WARMUP_BACKGROUND = os.getenv("RAG_WARMUP_BACKGROUND", "1") != "0"
+RAG_RETRY_AFTER_SECONDS = int(os.getenv("RAG_RETRY_AFTER_SECONDS", "10"))
+rag_service = RAGService(retrieval_server=RETRIEVAL_SERVER, warm_up=not RAG_WARMUP_BACKGROUND)
 
 # Tạo folder lưu PDF nếu chưa có
 PDF_DIR = os.path.join("storage", "pdfs")
 os.makedirs(PDF_DIR, exist_ok=True)
 
+# Hàng đợi ingest chạy nền cho /api/upload (giới hạn INGEST_QUEUE_MAX job chờ)
+# Chạy nhiều worker: hàng đợi nằm ở retrieval server, job tra cứu được từ mọi worker
+ingest_jobs = RemoteIngestJobs(rag_service.remote, PDF_DIR) if rag_service.remote \
+    else IngestJobQueue(rag_service, PDF_DIR)
+
+# Cache chi tiết bệnh nhân / tra CCCD (chạy nhiều worker: dùng chung trong retrieval server)
+patient_cache = create_patient_cache(rag_service.remote)
+
+# Giới hạn cứng số kết quả mỗi trang của API tìm kiếm / danh sách
+SEARCH_MAX_LIMIT = 100
+PATIENT_LIST_MAX_LIMIT = 500
+CHAT_BATCH_MAX_ITEMS = int(os.getenv("CHAT_BATCH_MAX_ITEMS", "100"))
+SIMILAR_CASES_MAX_K = 50
+
+
+def update_case_index(method: str, *args):
+    """Cập nhật chỉ mục ca bệnh sau khi đã commit DB; lỗi chỉ ghi log, không làm hỏng request"""
+    if not rag_service.case_index:
+        return
+    try:
+        getattr(rag_service.case_index, method)(*args)
+    except Exception as e:
+        print(f"⚠️ Không cập nhật được chỉ mục ca bệnh: {e}")
+
+
+def sync_case_index():
+    """Bắt kịp lượt khám thêm/xóa thẳng trong DB khi server tắt (chạy nền lúc khởi động)"""
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        report = rag_service.case_index.sync(db)
+        print(f"🩺 Đồng bộ chỉ mục ca bệnh: +{report['scanned']} lượt khám ({report['embedded']} embedding), "
+              f"-{report['removed']}, tổng {report['total']} ca trong {time.perf_counter() - started:.1f}s")
+    except Exception as e:
+        print(f"⚠️ Không đồng bộ được chỉ mục ca bệnh: {e}")
+    finally:
+        db.close()
+
+
+def start_rag_services():
+    """Phần chạy nền cần AI đã sẵn sàng: đồng bộ chỉ mục ca bệnh, theo dõi snapshot mới"""
+    if rag_service.case_index and not rag_service.remote:  # retrieval server tự đồng bộ lúc khởi động
+        # Lượt khám thêm/xóa trong lúc AI đang khởi động cũng được bắt kịp ở đây
+        threading.Thread(target=sync_case_index, name="case-index-sync", daemon=True).start()
+    # Tài liệu do pdf_watcher.py / load_pdfs.py học xong được nạp vào API đang chạy, không cần restart
+    rag_service.start_snapshot_watch()
+
+
+def warm_up_rag():
+    try:
+        rag_service.warm_up()
+    except Exception as e:
+        print(f"❌ Khởi động AI thất bại ở phase {rag_service.startup_phase}: {e}")
+        return
+    start_rag_services()
+
+
+# Bổ sung từ khóa tìm kiếm cho bệnh nhân chưa có (dữ liệu cũ / chèn thẳng bằng SQL): pending -> running -> done / failed
+SEARCH_INDEX_STATE = {"status": "pending", "backfilled": None, "error": None}
+
+
+def backfill_search_index():
+    """Chạy nền lúc khởi động; xong thì /api/search thấy mọi bệnh nhân (tiến độ ở /health/ready)"""
+    SEARCH_INDEX_STATE["status"] = "running"
+    started = time.perf_counter()
+    try:
+        with SessionLocal() as db:
+            backfilled = patient_search.backfill_index(db)
+    except Exception as e:
+        SEARCH_INDEX_STATE.update(status="failed", error=str(e)[:300])
+        print(f"❌ Không bổ sung được chỉ mục tìm kiếm (chạy python rebuild_search_index.py): {e}")
+        return
+    finally:
+        STARTUP_TIMINGS["search_index"] = round(time.perf_counter() - started, 3)
+    SEARCH_INDEX_STATE.update(status="done", backfilled=backfilled)
+    if backfilled:
+        print(f"🔎 Đã bổ sung chỉ mục tìm kiếm cho {backfilled} bệnh nhân "
+              f"trong {STARTUP_TIMINGS['search_index']:.1f}s")
+
+
+@app.on_event("startup")
+def start_search_index_backfill():
+    threading.Thread(target=backfill_search_index, name="search-index-backfill", daemon=True).start()
+
+
+@app.on_event("startup")
+def start_rag():
+    if rag_service.ready.is_set():
+        start_rag_services()
+    else:
+        threading.Thread(target=warm_up_rag, name="rag-warmup", daemon=True).start()
+
+
+def require_rag():
+    """Dependency của API cần AI: chưa khởi động xong -> 503 ngay (kèm Retry-After), không treo request"""
+    if rag_service.ready.is_set():
+        return
+    if rag_service.startup_status == "failed":
+        raise HTTPException(status_code=503, detail=f"Khởi động AI thất bại: {rag_service.startup_error}")
+    raise HTTPException(
+        status_code=503,
+        detail=f"AI đang khởi động ({rag_service.startup_phase or 'đang chờ'}), vui lòng thử lại sau",
+        headers={"Retry-After": str(RAG_RETRY_AFTER_SECONDS)}
+    )
+
 # ==========================================
 # CÁC API ENDPOINTS
 # ==========================================
@@ -44,37 +172,133 @@ def read_root():
     """API kiểm tra server sống hay chết"""
     return {"message": "Server đang chạy ngon lành! Truy cập /docs để xem hướng dẫn."}
 
+@app.get("/health/live")
+def health_live():
+    """Liveness: tiến trình còn phục vụ request (không kiểm tra DB / AI)"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+def health_ready():
+    """
+    Readiness: DB truy vấn được + đã bổ sung chỉ mục tìm kiếm + AI đã khởi động xong -> 200, không thì 503
+    (kèm Retry-After khi còn đang khởi động). Luôn kèm thời gian khởi động từng phase (giây)
+    """
+    database = "ok"
+    try:
+        with SessionLocal() as db:
+            db.execute(text("SELECT 1"))
+    except Exception as e:
+        database = f"error: {str(e)[:200]}"
+    ready = database == "ok" and SEARCH_INDEX_STATE["status"] == "done" and rag_service.ready.is_set()
+    body = {
+        "status": "ready" if ready else "not_ready",
+        "database": database,
+        "search_index": dict(SEARCH_INDEX_STATE),
+        "rag": {
+            "status": rag_service.startup_status,
+            "phase": rag_service.startup_phase,
+            "error": rag_service.startup_error,
+            "mode": "remote" if rag_service.remote else "local",
+        },
+        "timings": {**STARTUP_TIMINGS, "rag": dict(rag_service.startup_timings)},
+    }
+    if ready:
+        return body
+    failed = rag_service.startup_status == "failed" or SEARCH_INDEX_STATE["status"] == "failed"
+    headers = {"Retry-After": str(RAG_RETRY_AFTER_SECONDS)} if not failed else None
+    return JSONResponse(status_code=503, content=body, headers=headers)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """Histogram độ trễ theo giai đoạn (embed/search/llm/persist) + số truy vấn DB, định dạng Prometheus"""
+    if not metrics.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics đang tắt (METRICS_ENABLED=0)")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # --- 1. API Upload tài liệu PDF ---
-@app.post("/api/upload")
+@app.post("/api/upload", status_code=202, dependencies=[Depends(require_rag)])
 async def upload_pdf(file: UploadFile = File(...)):
-    """Upload file sách PDF để AI học"""
+    """
+    Upload file sách PDF để AI học
+    Chỉ lưu file + xếp job ingest chạy nền, trả về job_id ngay; theo dõi tiến độ qua /api/ingest/jobs/{job_id}
+    """
     try:
-        # Lưu file vào ổ cứng
-        file_path = os.path.join(PDF_DIR, file.filename)
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # Gọi RAG Service để học
-        num_chunks = rag_service.ingest_pdf(file_path)
-        
-        return {
-            "filename": file.filename,
-            "status": "Thành công",
-            "message": f"Đã học xong tài liệu. Chia thành {num_chunks} đoạn kiến thức."
-        }
+        # Ghi file (đọc từng khối) trong threadpool để không chặn event loop
+        job, coalesced = await run_in_threadpool(ingest_jobs.submit_upload, file.file, file.filename)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi upload: {str(e)}")
 
+    return {
+        **ingest_jobs.get(job.id),
+        "coalesced": coalesced,
+        "message": "Tài liệu này đang được học (gộp vào job có sẵn)" if coalesced
+                   else "Đã nhận tài liệu, đang xếp hàng để học"
+    }
+
+@app.get("/api/ingest/jobs", dependencies=[Depends(require_rag)])
+def list_ingest_jobs():
+    """Các job ingest gần đây (mới nhất trước) + thống kê hàng đợi"""
+    return {"jobs": ingest_jobs.list(), **ingest_jobs.stats()}
+
+@app.get("/api/ingest/jobs/{job_id}", dependencies=[Depends(require_rag)])
+def get_ingest_job(job_id: str):
+    """Trạng thái + tiến độ (trang, chunk đã xử lý) của 1 job ingest"""
+    job = ingest_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Không tìm thấy job")
+    return job
+
+@app.get("/api/documents", dependencies=[Depends(require_rag)])
+def list_documents():
+    """Các tài liệu đã học (mỗi tài liệu 1 segment) + thống kê segment/tombstone/compaction"""
+    if not rag_service.vector_db:
+        return {"documents": [], "segments": 0, "tombstones": 0, "chunks": 0,
+                "snapshot_reloads": rag_service.snapshot_reloads}
+    return {"documents": rag_service.documents(), "snapshot_reloads": rag_service.snapshot_reloads,
+            **rag_service.vector_db.stats()}
+
+@app.delete("/api/documents/{filename}", dependencies=[Depends(require_rag)])
+def delete_document(filename: str):
+    """
+    Xóa 1 tài liệu khỏi kho tri thức (ngừng tìm kiếm ngay, file segment được dọn nền)
+    Muốn thay bằng bản sửa: upload lại PDF cùng tên qua /api/upload, bản cũ tự được thay khi học xong
+    """
+    removed = rag_service.delete_document(filename)
+    if removed is None:
+        raise HTTPException(status_code=404, detail="Không tìm thấy tài liệu")
+    return {"document": filename, "chunks_removed": removed, "message": "Đã xóa tài liệu"}
+
+@app.get("/api/retrieval/stats")
+def retrieval_stats():
+    """Chế độ retrieval server: số kết nối/request, số query embedding và cỡ lô gom được"""
+    if not rag_service.remote:
+        return {"mode": "local"}
+    return {"mode": "remote", "address": RETRIEVAL_SERVER, **rag_service.remote.call("server_stats")}
+
+@app.post("/api/documents/compact", dependencies=[Depends(require_rag)])
+def compact_documents():
+    """Dọn ngay segment của tài liệu đã xóa/thay (bình thường tự chạy nền sau SEGMENT_COMPACTION_DELAY giây)"""
+    if not rag_service.vector_db:
+        return {"segments_removed": 0, "orphans_removed": 0, "bytes_reclaimed": 0}
+    return rag_service.vector_db.compact(force=True)
+
 # --- 2. API QUẢN LÝ BỆNH NHÂN & KHÁM BỆNH ---
 
 # A. Kiểm tra bệnh nhân tồn tại hay chưa
 @app.get("/api/patients/check", response_model=Optional[schemas.BenhNhanResponse])
-def check_patient(cccd: str, db: Session = Depends(get_db)):
-    """Kiểm tra xem bệnh nhân đã có trong hệ thống chưa (theo CCCD)"""
-    patient = db.query(models.BenhNhan).filter(models.BenhNhan.CCCD == cccd).first()
-    if patient:
-        return patient
-    return None
+def check_patient(cccd: str, if_none_match: Optional[str] = Header(None), db: Session = Depends(get_db)):
+    """Kiểm tra xem bệnh nhân đã có trong hệ thống chưa (theo CCCD), qua cache + ETag"""
+    entry = patient_cache.get_by_cccd(cccd, lambda: db.query(models.BenhNhan)
+                                      .options(selectinload(models.BenhNhan.luot_khams))
+                                      .filter(models.BenhNhan.CCCD == cccd).first())
+    return patient_cache.respond(entry, if_none_match)
+
+@app.get("/api/patients/cache")
+def patient_cache_stats():
+    """Thống kê cache chi tiết bệnh nhân: hit rate theo ID / CCCD, số 304, số lần vô hiệu"""
+    return patient_cache.stats()
 
 # B. Tạo Bệnh nhân mới (kèm Lượt khám đầu tiên)
 @app.post("/api/patients", response_model=schemas.BenhNhanResponse)
@@ -91,17 +315,82 @@ def create_patient(payload: schemas.BenhNhanCreate, db: Session = Depends(get_db
     db.add(new_patient)
     db.flush() # Để lấy ID và MaBenhNhan (computed)
     db.refresh(new_patient) # Lấy lại data từ DB (bao gồm MaBenhNhan)
+    patient_search.index_patient(db, new_patient)
 
     # 3. Tạo Lượt khám đầu tiên (nếu có)
+    new_visit = None
     if payload.LuotKhamDau:
         visit_data = payload.LuotKhamDau.model_dump()
         new_visit = models.LuotKham(BenhNhanID=new_patient.ID, **visit_data)
         db.add(new_visit)
     
     db.commit()
+    patient_cache.invalidate(cccds=[new_patient.CCCD])  # bỏ kết quả "chưa có" của /api/patients/check
     db.refresh(new_patient)
+    if new_visit is not None:
+        update_case_index("upsert_visits", [new_visit])
     return new_patient
 
+# B2. Nhập hàng loạt bệnh nhân + lượt khám (onboarding phòng khám mới)
+@app.post("/api/patients/import", response_model=schemas.ImportReport)
+async def import_patients(
+    file: UploadFile = File(...),
+    format: Optional[str] = Form(None),
+    dry_run: bool = Form(False),
+    db: Session = Depends(get_db)
+):
+    """
+    Nhập bệnh nhân + lượt khám từ file CSV / NDJSON (định dạng theo đuôi file hoặc field format)
+    - Đọc + kiểm tra từng dòng, ghi theo lô (1 lần tra CCCD + INSERT nhiều dòng + 1 commit mỗi lô)
+    - CCCD đã có trong DB: giữ nguyên thông tin, chỉ thêm lượt khám chưa có (nhập được file xuất since=)
+    - CCCD lặp lại trong file = thêm lượt khám cho bệnh nhân đó
+    - Trả về số dòng / bệnh nhân / lượt khám đã nhập, lỗi theo từng dòng, tốc độ (dòng/s)
+    - dry_run=true: chỉ kiểm tra, không ghi DB
+    """
+    try:
+        fmt = patient_import.detect_format(file.filename, format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        report = await run_in_threadpool(
+            patient_import.import_file, db, file.file, fmt, dry_run=dry_run,
+            on_commit=lambda cccds, patient_ids: patient_cache.invalidate(patient_ids, cccds)
+        )
+    except ValueError as e:  # file không phải UTF-8, chưa ghi gì
+        raise HTTPException(status_code=400, detail=str(e))
+    if report["visits_created"] and not dry_run and rag_service.case_index:
+        # sync() lập chỉ mục mọi lượt khám chưa có trong chỉ mục (so danh sách ID), embedding chạy nền
+        threading.Thread(target=sync_case_index, name="case-index-sync", daemon=True).start()
+    return report
+
+# B3. Xuất toàn bộ bệnh nhân + lượt khám (báo cáo, sao lưu) - khai báo trước /api/patients/{id}
+@app.get("/api/patients/export")
+def export_patients(format: Literal["ndjson", "csv"] = "ndjson", since: Optional[datetime] = None):
+    """
+    Stream toàn bộ bệnh nhân + lượt khám (NDJSON: mỗi bệnh nhân 1 dòng kèm LuotKham, CSV: mỗi lượt khám 1 dòng)
+    - Đọc bằng server-side cursor theo khối, RAM không tăng theo số bệnh nhân
+    - since: xuất tăng dần - bệnh nhân tạo từ thời điểm này + lượt khám mới của bệnh nhân cũ;
+      header X-Export-Started-At là giá trị since cho lần xuất sau
+    - File xuất nhập lại được bằng /api/patients/import
+    """
+    started_at = datetime.now()
+
+    def stream():
+        # Session riêng cho stream: dependency get_db đã đóng trước khi response được gửi
+        with SessionLocal() as db:
+            yield from patient_export.iter_export(db, format, since)
+
+    filename = f"patients-{started_at:%Y%m%d-%H%M%S}.{format}"
+    return StreamingResponse(
+        stream(),
+        media_type=patient_export.MEDIA_TYPES[format],
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "X-Export-Started-At": started_at.isoformat(timespec="seconds"),
+        }
+    )
+
 @app.put("/api/patients/{patient_id}", response_model=schemas.BenhNhanResponse)
 def update_patient(patient_id: int, payload: schemas.BenhNhanUpdate, db: Session = Depends(get_db)):
     """Cập nhật thông tin bệnh nhân"""
@@ -110,12 +399,17 @@ def update_patient(patient_id: int, payload: schemas.BenhNhanUpdate, db: Session
         raise HTTPException(status_code=404, detail="Không tìm thấy bệnh nhân")
     
     # Update data
+    old_cccd = patient.CCCD
     update_data = payload.model_dump(exclude_unset=True)
     for key, value in update_data.items():
         setattr(patient, key, value)
+    patient_search.index_patient(db, patient)
     
     db.commit()
+    patient_cache.invalidate([patient_id], [old_cccd, patient.CCCD])
     db.refresh(patient)
+    # Chỉ embedding lại lượt khám có chẩn đoán thay đổi (thường là không có)
+    update_case_index("sync_patient", db, patient_id)
     return patient
 
 @app.delete("/api/patients/{patient_id}")
@@ -131,9 +425,13 @@ def delete_patient(patient_id: int, db: Session = Depends(get_db)):
     # It does not have cascade="all, delete-orphan".
     # So we should manually delete visits first to avoid Foreign Key constraint error.
     db.query(models.LuotKham).filter(models.LuotKham.BenhNhanID == patient_id).delete()
+    patient_search.unindex_patient(db, patient_id)
     
+    cccd = patient.CCCD
     db.delete(patient)
     db.commit()
+    patient_cache.invalidate([patient_id], [cccd])
+    update_case_index("remove_patient", patient_id)
     return {"message": "Đã xóa bệnh nhân thành công"}
 
 # C. Thêm lượt khám mới cho Bệnh nhân cũ
@@ -148,41 +446,102 @@ def create_visit(benh_nhan_id: int, payload: schemas.LuotKhamCreate, db: Session
     new_visit = models.LuotKham(BenhNhanID=benh_nhan_id, **payload.model_dump())
     db.add(new_visit)
     db.commit()
+    patient_cache.invalidate([benh_nhan_id])  # lịch sử khám trong chi tiết bệnh nhân đã đổi
     db.refresh(new_visit)
+    update_case_index("upsert_visits", [new_visit])
     return new_visit
 
 # D. Lấy danh sách bệnh nhân (cho trang danh sách)
-@app.get("/api/patients", response_model=List[schemas.BenhNhanResponse])
-def get_patients(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    """Lấy danh sách bệnh nhân (có kèm lượt khám mới nhất)"""
-    patients = db.query(models.BenhNhan)\
-        .order_by(desc(models.BenhNhan.NgayTao))\
-        .offset(skip).limit(limit).all()
-    return patients
+@app.get("/api/patients", response_model=schemas.BenhNhanPage)
+def get_patients(
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=PATIENT_LIST_MAX_LIMIT),
+    db: Session = Depends(get_db)
+):
+    """
+    Lấy danh sách bệnh nhân (có kèm lượt khám mới nhất + số lượt khám)
+    Phân trang keyset: truyền next_cursor của trang trước vào cursor để lấy trang sau
+    """
+    try:
+        return patient_queries.patient_page(db, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 # E. Lấy chi tiết bệnh nhân + Lịch sử khám
 @app.get("/api/patients/{id}", response_model=schemas.BenhNhanResponse)
-def get_patient_detail(id: int, db: Session = Depends(get_db)):
-    patient = db.query(models.BenhNhan).filter(models.BenhNhan.ID == id).first()
-    if not patient:
+def get_patient_detail(id: int, if_none_match: Optional[str] = Header(None), db: Session = Depends(get_db)):
+    """Chi tiết bệnh nhân + toàn bộ lượt khám, qua cache (vô hiệu khi sửa / thêm lượt khám) + ETag"""
+    entry = patient_cache.get_by_id(id, lambda: db.query(models.BenhNhan)
+                                    .options(selectinload(models.BenhNhan.luot_khams))
+                                    .filter(models.BenhNhan.ID == id).first())
+    if entry is None:
          raise HTTPException(status_code=404, detail="Không tìm thấy bệnh nhân.")
-    return patient
+    return patient_cache.respond(entry, if_none_match)
+
+@app.get("/api/patients/{id}/visits", response_model=schemas.LuotKhamPage)
+def get_patient_visits(
+    id: int,
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=PATIENT_LIST_MAX_LIMIT),
+    db: Session = Depends(get_db)
+):
+    """Lịch sử khám của bệnh nhân theo trang (mới nhất trước, phân trang keyset)"""
+    try:
+        return patient_queries.visit_page(db, id, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# F. Ca bệnh tương tự trong lịch sử khám
+@app.get("/api/cases/similar", response_model=schemas.SimilarCasesResponse, dependencies=[Depends(require_rag)])
+def get_similar_cases(
+    q: str,
+    k: int = Query(5, ge=1, le=SIMILAR_CASES_MAX_K),
+    exclude_patient_id: Optional[int] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Các lượt khám trước đây có Triệu chứng / Bệnh danh / Chứng danh giống mô tả q nhất (kèm Bài thuốc đã dùng)
+    exclude_patient_id: bỏ các lượt khám của chính bệnh nhân đang khám
+    """
+    if not rag_service.case_index:
+        raise HTTPException(status_code=404, detail="Chỉ mục ca bệnh đang tắt (CASE_INDEX_ENABLED=0)")
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Thiếu mô tả triệu chứng")
+
+    started = time.perf_counter()
+    hits = rag_service.case_index.search(q, k, exclude_patient_id)
+    visits = db.query(models.LuotKham).filter(models.LuotKham.LuotKhamID.in_([h["visit_id"] for h in hits])).all() \
+        if hits else []
+    by_id = {visit.LuotKhamID: visit for visit in visits}
+    items = [
+        {**schemas.LuotKhamResponse.model_validate(by_id[h["visit_id"]]).model_dump(), "score": h["score"]}
+        for h in hits if h["visit_id"] in by_id
+    ]
+    return {
+        "items": items,
+        "total_cases": rag_service.case_index.count,
+        "seconds": round(time.perf_counter() - started, 4)
+    }
 
 # --- 5. API Chat với AI (Không lưu vào DB) ---
-@app.post("/api/chat")
-async def chat_with_ai(question: str = Form(...)):
+@app.post("/api/chat", dependencies=[Depends(require_rag)])
+async def chat_with_ai(question: str = Form(...), sources: Optional[List[str]] = Form(None)):
     """
     Chat với AI về Y học Đông Y
     Không lưu vào database, chỉ trả về câu trả lời + tài liệu tham khảo
+    sources (lặp lại được): chỉ tham khảo các tài liệu này (tên file PDF)
     """
     try:
-        result = rag_service.chat(question)
-        # result là dict có keys: answer, sources
+        # rag_service.chat là hàm đồng bộ (embedding + FAISS + Gemini) -> chạy trong threadpool
+        # để không chặn event loop (các API bệnh nhân vẫn phục vụ bình thường)
+        result = await run_in_threadpool(rag_service.chat, question, sources or None)
+        # result là dict có keys: answer, sources, context_tokens
         if isinstance(result, dict):
             return {
                 "question": question,
                 "answer": result.get("answer", ""),
                 "sources": result.get("sources", []),
+                "context_tokens": result.get("context_tokens"),
                 "status": "success"
             }
         else:
@@ -196,29 +555,83 @@ async def chat_with_ai(question: str = Form(...)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi AI: {str(e)}")
 
+@app.post("/api/chat/stream", dependencies=[Depends(require_rag)])
+async def chat_with_ai_stream(question: str = Form(...), sources: Optional[List[str]] = Form(None)):
+    """
+    Chat với AI dạng streaming (NDJSON - mỗi dòng là 1 JSON)
+    - Dòng đầu: {"type": "sources", "sources": [...]}
+    - Tiếp theo: {"type": "token", "content": "..."} cho từng đoạn câu trả lời
+    - Cuối cùng: {"type": "done"} hoặc {"type": "error", "detail": "..."}
+    """
+    async def event_stream():
+        try:
+            async for event in rag_service.astream_chat(question, sources or None):
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+        except Exception as e:
+            # Header đã gửi đi rồi nên không thể trả 500, báo lỗi bằng 1 frame cuối
+            yield json.dumps({"type": "error", "detail": f"Lỗi AI: {str(e)}"}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/api/chat/batch", response_model=schemas.ChatBatchResponse, dependencies=[Depends(require_rag)])
+async def chat_with_ai_batch(request: schemas.ChatBatchRequest):
+    """
+    Chat / chẩn đoán hàng loạt (vd: phân loại phiếu khám đầu ca)
+    - 1 lần embedding + 1 lần FAISS search cho cả lô, Gemini gọi song song có giới hạn
+    - Trả về kết quả hoặc lỗi theo từng câu hỏi (1 câu lỗi không làm hỏng cả lô)
+    """
+    if len(request.questions) > CHAT_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Tối đa {CHAT_BATCH_MAX_ITEMS} câu hỏi mỗi lô")
+
+    started = time.perf_counter()
+    try:
+        items = await rag_service.abatch(
+            request.questions, request.mode, request.concurrency, request.case_k, request.sources or None
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi AI: {str(e)}")
+
+    failed = sum(1 for item in items if item["status"] == "error")
+    return {
+        "items": items,
+        "succeeded": len(items) - failed,
+        "failed": failed,
+        "seconds": round(time.perf_counter() - started, 3)
+    }
+
+@app.get("/api/chat/cache", dependencies=[Depends(require_rag)])
+def chat_cache_stats():
+    """Thống kê semantic cache của chat (hits/misses, số câu đang lưu...)"""
+    if not rag_service.answer_cache:
+        return {"enabled": False}
+    return {"enabled": True, **rag_service.answer_cache.stats()}
+
 # --- 6. API Tìm kiếm bệnh nhân (Nâng cấp) ---
-# --- 6. API Tìm kiếm bệnh nhân (Nâng cấp) ---
-@app.get("/api/search", response_model=List[schemas.BenhNhanResponse])
-def search_patients(q: str, db: Session = Depends(get_db)):
-    """
-    Tìm kiếm bệnh nhân theo:
-    - Tên (HoTen)
-    - CCCD
-    - SĐT
-    - Địa chỉ
-    """
-    # Tìm kiếm trong bảng BenhNhan
-    patients = db.query(models.BenhNhan)\
-        .filter(
-            (models.BenhNhan.HoTen.contains(q)) |
-            (models.BenhNhan.CCCD.contains(q)) |
-            (models.BenhNhan.SDT.contains(q)) |
-            (models.BenhNhan.DiaChi.contains(q))
-        )\
-        .order_by(desc(models.BenhNhan.NgayTao))\
-        .all()
-        
-    return patients
+@app.get("/api/search", response_model=List[schemas.BenhNhanListItem])
+def search_patients(
+    q: str,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=SEARCH_MAX_LIMIT),
+    db: Session = Depends(get_db)
+):
+    """
+    Tìm kiếm bệnh nhân (không phân biệt dấu, xếp hạng, phân trang):
+    - Tên (HoTen), Địa chỉ (DiaChi): theo từ khóa / tiền tố, VD "nguyen van", "ngu a"
+    - CCCD, SĐT: theo tiền tố số, VD "0012", "0909"
+    - Mã bệnh nhân: VD "BN00012"
+    """
+    ids = patient_search.search_patient_ids(db, q, skip, limit)
+    if not ids:
+        return []
+
+    # Lấy đúng 1 trang bệnh nhân rồi giữ nguyên thứ tự xếp hạng
+    patients = db.query(models.BenhNhan).filter(models.BenhNhan.ID.in_(ids)).all()
+    by_id = {patient.ID: patient for patient in patients}
+    return patient_queries.list_items(db, [by_id[i] for i in ids if i in by_id])
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,213 @@
+"""
+Đo thời gian theo từng giai đoạn (embed / search / llm / persist...) và số truy vấn DB mỗi request
+- Histogram kiểu Prometheus, xuất dạng text tại /metrics (không cần thêm thư viện)
+- Header Server-Timing theo từng request, chỉ khi client gửi "X-Timing: 1"
+- METRICS_ENABLED=0: span() trả về context manager rỗng dùng chung, không đăng ký
+  middleware hay event SQLAlchemy nào -> gần như không tốn chi phí
+"""
+import os
+import time
+import bisect
+import threading
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+from dotenv import load_dotenv
+from sqlalchemy import event
+
+load_dotenv()
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+TIMING_REQUEST_HEADER = "x-timing"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 1500, 2000, 3000, 4000, 6000, 8000, 16000)
+
+_NULL_SPAN = nullcontext()
+
+# Thống kê của request hiện tại (None = ngoài request hoặc metrics tắt)
+_current_request = ContextVar("metrics_request", default=None)
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [số đếm từng bucket, tổng, số lần]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            if position < len(self.buckets):
+                series[0][position] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(labels, list(s[0]), s[1], s[2]) for labels, s in sorted(self._series.items())]
+        for labels, counts, total, count in snapshot:
+            base = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, labels)]
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_labels(base, bound)} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(base, '+Inf')} {count}")
+            suffix = _labels(base)
+            lines.append(f"{self.name}_sum{suffix} {total}")
+            lines.append(f"{self.name}_count{suffix} {count}")
+        return "\n".join(lines)
+
+
+def _labels(base, le=None) -> str:
+    pairs = base + ([f'le="{le}"'] if le is not None else [])
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+STAGE_SECONDS = Histogram(
+    "tcm_stage_seconds", "Thời gian từng giai đoạn của chat/ask/ingest", ("operation", "stage")
+)
+OPERATION_SECONDS = Histogram(
+    "tcm_operation_seconds", "Tổng thời gian mỗi lần chat/ask/ingest", ("operation",)
+)
+HTTP_SECONDS = Histogram(
+    "tcm_http_request_seconds", "Thời gian xử lý request HTTP", ("method", "route", "status")
+)
+DB_QUERIES = Histogram(
+    "tcm_db_queries_per_request", "Số câu SQL mỗi request dùng get_db", ("route",), COUNT_BUCKETS
+)
+DB_SECONDS = Histogram(
+    "tcm_db_seconds_per_request", "Tổng thời gian SQL mỗi request dùng get_db", ("route",)
+)
+CONTEXT_TOKENS = Histogram(
+    "tcm_context_tokens", "Số token context gửi Gemini mỗi lần (baseline = top-k nguyên văn, packed = sau khi ghép)",
+    ("operation", "kind"), TOKEN_BUCKETS
+)
+REGISTRY = [OPERATION_SECONDS, STAGE_SECONDS, HTTP_SECONDS, DB_QUERIES, DB_SECONDS, CONTEXT_TOKENS]
+
+
+class RequestStats:
+    """Số liệu gom trong 1 request (dùng chung giữa event loop và threadpool vì cùng 1 object)"""
+    __slots__ = ("stages", "db_queries", "db_seconds", "used_db")
+
+    def __init__(self):
+        self.stages = {}
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.used_db = False
+
+
+@contextmanager
+def _span(operation: str, stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, operation, stage)
+        stats = _current_request.get()
+        if stats is not None:
+            stats.stages[stage] = stats.stages.get(stage, 0.0) + elapsed
+
+
+def span(operation: str, stage: str):
+    """with span("chat", "embed"): ...  - đo 1 giai đoạn"""
+    return _span(operation, stage) if METRICS_ENABLED else _NULL_SPAN
+
+
+@contextmanager
+def _operation(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        OPERATION_SECONDS.observe(time.perf_counter() - started, name)
+
+
+def operation(name: str):
+    """with operation("chat"): ...  - đo tổng thời gian 1 lần chat/ask/ingest"""
+    return _operation(name) if METRICS_ENABLED else _NULL_SPAN
+
+
+def observe_context(operation: str, stats: dict):
+    """Ghi số token context trước/sau khi ghép (thống kê của ContextPacker.pack)"""
+    if METRICS_ENABLED and stats:
+        CONTEXT_TOKENS.observe(stats["baseline"], operation, "baseline")
+        CONTEXT_TOKENS.observe(stats["packed"], operation, "packed")
+
+
+def mark_db_session():
+    """Gọi từ get_db: đánh dấu request này có dùng DB để ghi histogram số truy vấn"""
+    stats = _current_request.get()
+    if stats is not None:
+        stats.used_db = True
+
+
+def instrument_engine(engine):
+    """Đếm số câu SQL + thời gian cho request hiện tại qua event của SQLAlchemy engine"""
+    if not METRICS_ENABLED:
+        return
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info["metrics_started"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop("metrics_started", None)
+        stats = _current_request.get()
+        if stats is not None and started is not None:
+            stats.db_queries += 1
+            stats.db_seconds += time.perf_counter() - started
+
+
+def _server_timing(stats: RequestStats, total: float) -> str:
+    parts = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in stats.stages.items()]
+    if stats.used_db:
+        parts.append(f'db;dur={stats.db_seconds * 1000:.1f};desc="{stats.db_queries} queries"')
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+def install(app):
+    """Đăng ký middleware đo request (không làm gì nếu METRICS_ENABLED=0)"""
+    if not METRICS_ENABLED:
+        return
+
+    @app.middleware("http")
+    async def metrics_middleware(request, call_next):
+        stats = RequestStats()
+        token = _current_request.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await call_next(request)
+        finally:
+            _current_request.reset(token)
+        elapsed = time.perf_counter() - started
+
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        HTTP_SECONDS.observe(elapsed, request.method, route, str(response.status_code))
+        if stats.used_db:
+            DB_QUERIES.observe(stats.db_queries, route)
+            DB_SECONDS.observe(stats.db_seconds, route)
+        # Streaming: header gửi trước khi sinh xong câu trả lời nên chỉ có phần retrieval
+        if request.headers.get(TIMING_REQUEST_HEADER) == "1":
+            response.headers["Server-Timing"] = _server_timing(stats, elapsed)
+        return response
+
+
+def render() -> str:
+    """Toàn bộ histogram theo định dạng text của Prometheus"""
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
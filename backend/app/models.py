@@ -2,7 +2,7 @@ from sqlalchemy import Column, Integer, String, Date, DateTime, Text
 from datetime import datetime
 from .database import Base
 
-from sqlalchemy import Column, Integer, String, Date, DateTime, Text, ForeignKey, Computed, Unicode, UnicodeText
+from sqlalchemy import Column, Integer, String, Date, DateTime, Text, ForeignKey, Computed, Unicode, UnicodeText, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .database import Base
@@ -23,7 +23,7 @@ class BenhNhan(Base):
     GioiTinh = Column(Unicode(10))
     CCCD = Column(String(20), unique=True, nullable=False)
     DiaChi = Column(Unicode(255))
-    SDT = Column(String(20)) # SĐT is numbers, String is fine but Unicode doesn't hurt.
+    SDT = Column(String(20), index=True) # SĐT is numbers, String is fine but Unicode doesn't hurt.
     NgheNghiep = Column(Unicode(100))
     MaBHYT = Column(String(25))
     LienHeKhanCap = Column(Unicode(255))
@@ -32,11 +32,16 @@ class BenhNhan(Base):
     TienSuBanThan = Column(UnicodeText)
     TienSuGiaDinh = Column(UnicodeText)
     
-    NgayTao = Column(DateTime, default=datetime.now)
+    NgayTao = Column(DateTime, nullable=False, default=datetime.now)
 
     # Relationship với LuotKham
     luot_khams = relationship("LuotKham", back_populates="benh_nhan")
 
+    # Phục vụ phân trang keyset: ORDER BY NgayTao DESC, ID DESC
+    __table_args__ = (
+        Index("IX_BenhNhan_NgayTao_ID", NgayTao.desc(), ID.desc()),
+    )
+
 class LuotKham(Base):
     __tablename__ = "LuotKham"
 
@@ -55,7 +60,20 @@ class LuotKham(Base):
 
     # V. THEO DÕI
     LoiDanBacSi = Column(Text)
-    NgayKham = Column(DateTime, default=datetime.now)
+    NgayKham = Column(DateTime, nullable=False, default=datetime.now)
 
     # Relationship ngược lại
-    benh_nhan = relationship("BenhNhan", back_populates="luot_khams")
\ No newline at end of file
+    benh_nhan = relationship("BenhNhan", back_populates="luot_khams")
+
+    # Lượt khám mới nhất / lịch sử khám của 1 bệnh nhân
+    __table_args__ = (
+        Index("IX_LuotKham_BenhNhanID_NgayKham", BenhNhanID, NgayKham.desc(), LuotKhamID.desc()),
+    )
+
+class BenhNhanTuKhoa(Base):
+    """Chỉ mục đảo phục vụ tìm kiếm bệnh nhân (từ khóa đã bỏ dấu, viết thường)"""
+    __tablename__ = "BenhNhanTuKhoa"
+
+    TuKhoa = Column(String(64), primary_key=True)
+    BenhNhanID = Column(Integer, ForeignKey("BenhNhan.ID"), primary_key=True, index=True)
+    TrongSo = Column(Integer, nullable=False, default=1)
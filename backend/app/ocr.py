@@ -0,0 +1,192 @@
+"""
+OCR cho PDF scan (sách Đông Y cũ phần lớn là ảnh chụp, không có text layer)
+- Trang nào đã có text layer thì dùng luôn, chỉ OCR những trang thiếu chữ
+- Rasterize (pdf2image/poppler) + Tesseract chạy trên process pool, mỗi tiến trình 1 trang
+- Tiền xử lý ảnh bằng OpenCV (xám -> lọc nhiễu -> nhị phân Otsu), tắt bằng OCR_PREPROCESS=0
+- Kết quả OCR cache theo hash nội dung trang + cấu hình OCR -> chạy lại không bao giờ OCR lại
+Cần cài Tesseract kèm dữ liệu tiếng Việt (tesseract-ocr-vie) và poppler; thiếu thì tự tắt OCR
+Hàm chạy trong tiến trình con phải đặt ở cấp module để pickle được (Windows dùng spawn)
+"""
+import os
+import json
+import hashlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from dotenv import load_dotenv
+from langchain_community.document_loaders import PyPDFLoader
+
+load_dotenv()
+
+OCR_MODE = os.getenv("OCR_MODE", "auto")  # auto: OCR trang không có text layer | off: tắt hẳn
+OCR_LANG = os.getenv("OCR_LANG", "vie")
+OCR_DPI = int(os.getenv("OCR_DPI", "300"))
+OCR_PREPROCESS = os.getenv("OCR_PREPROCESS", "1") != "0"
+OCR_TESSERACT_CONFIG = os.getenv("OCR_TESSERACT_CONFIG", "--oem 1 --psm 3")
+# Trang có ít hơn số ký tự này (sau khi bỏ khoảng trắng) coi như không có text layer
+OCR_MIN_TEXT_CHARS = int(os.getenv("OCR_MIN_TEXT_CHARS", "10"))
+TESSERACT_CMD = os.getenv("TESSERACT_CMD")  # Windows: đường dẫn tesseract.exe nếu không có trong PATH
+POPPLER_PATH = os.getenv("POPPLER_PATH")    # Windows: thư mục bin của poppler
+
+
+def default_workers():
+    return int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 1)))
+
+
+def ocr_options():
+    """Cấu hình ảnh hưởng tới kết quả OCR -> thuộc khóa cache (đổi DPI/ngôn ngữ thì OCR lại)"""
+    return {"lang": OCR_LANG, "dpi": OCR_DPI, "preprocess": OCR_PREPROCESS, "config": OCR_TESSERACT_CONFIG}
+
+
+@lru_cache(maxsize=1)
+def ocr_available() -> bool:
+    """Kiểm tra 1 lần: đủ thư viện, có Tesseract và dữ liệu ngôn ngữ OCR_LANG"""
+    if OCR_MODE == "off":
+        return False
+    try:
+        import pytesseract
+        import pdf2image  # noqa: F401
+        if OCR_PREPROCESS:
+            import cv2  # noqa: F401
+    except ImportError as e:
+        print(f"⚠️ Thiếu thư viện OCR ({e.name}), PDF scan sẽ không học được")
+        return False
+    if TESSERACT_CMD:
+        pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
+    try:
+        languages = pytesseract.get_languages(config="")
+    except Exception as e:
+        print(f"⚠️ Không chạy được Tesseract ({e}), PDF scan sẽ không học được")
+        return False
+    missing = [lang for lang in OCR_LANG.split("+") if lang not in languages]
+    if missing:
+        print(f"⚠️ Tesseract chưa có dữ liệu ngôn ngữ {', '.join(missing)} (cài tesseract-ocr-vie), tắt OCR")
+        return False
+    return True
+
+
+def needs_ocr(text: str) -> bool:
+    return len(text.strip()) < OCR_MIN_TEXT_CHARS
+
+
+def page_key(page, options) -> str:
+    """Hash nội dung 1 trang PDF (content stream + ảnh + khổ giấy/xoay) kèm cấu hình OCR"""
+    digest = hashlib.sha256(json.dumps(options, sort_keys=True).encode("utf-8"))
+    digest.update(f"{list(page.mediabox)}|{page.get('/Rotate', 0)}".encode("utf-8"))
+    contents = page.get_contents()
+    if contents is not None:
+        digest.update(contents.get_data())
+    resources = page.get("/Resources")
+    xobjects = resources.get_object().get("/XObject") if resources is not None else None
+    if xobjects is not None:
+        xobjects = xobjects.get_object()
+        for name in sorted(xobjects):
+            digest.update(name.encode("utf-8"))
+            digest.update(xobjects[name].get_object().get_data())
+    return digest.hexdigest()
+
+
+def preprocess_image(image):
+    """Ảnh scan -> ảnh xám, lọc nhiễu muối tiêu, nhị phân hóa Otsu (Tesseract đọc chữ rõ hơn)"""
+    import cv2
+    import numpy as np
+
+    gray = cv2.cvtColor(np.array(image.convert("RGB")), cv2.COLOR_RGB2GRAY)
+    gray = cv2.medianBlur(gray, 3)
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return binary
+
+
+def _init_worker():
+    # Mỗi tiến trình đã lo 1 trang -> Tesseract không cần tự chia luồng (tránh tranh CPU)
+    os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+    if TESSERACT_CMD:
+        import pytesseract
+        pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
+
+
+def ocr_page(file_path: str, page_number: int, options) -> str:
+    """Rasterize đúng 1 trang (page_number tính từ 1) rồi OCR; chạy trong tiến trình con"""
+    import pytesseract
+    from pdf2image import convert_from_path
+
+    images = convert_from_path(
+        file_path, dpi=options["dpi"], first_page=page_number, last_page=page_number,
+        poppler_path=POPPLER_PATH
+    )
+    if not images:
+        return ""
+    image = preprocess_image(images[0]) if options["preprocess"] else images[0]
+    return pytesseract.image_to_string(image, lang=options["lang"], config=options["config"]).strip()
+
+
+def iter_pdf_pages(file_path: str, cache=None, stats=None, workers: int = None):
+    """
+    Đọc PDF lần lượt từng trang như PyPDFLoader.lazy_load, nhưng trang không có text layer
+    thì lấy chữ từ cache OCR hoặc gửi sang process pool để OCR.
+    Giữ tối đa workers*2 trang đang chờ, trả về đúng thứ tự trang.
+    cache: đối tượng có get_ocr_text(key)/put_ocr_text(key, text) (IngestStore)
+    stats: dict được cộng dồn "ocr_pages" (số trang phải OCR) và "ocr_cache_hits"
+    """
+    loader = PyPDFLoader(file_path)
+    if not ocr_available():
+        yield from loader.lazy_load()
+        return
+
+    from pypdf import PdfReader
+
+    stats = stats if stats is not None else {}
+    stats.setdefault("ocr_pages", 0)
+    stats.setdefault("ocr_cache_hits", 0)
+    workers = workers or default_workers()
+    options = ocr_options()
+    reader = PdfReader(file_path)
+    pool = None
+    pending = deque()  # (trang, khóa cache, future, tự OCR hay dùng chung) - future None = đã có chữ
+    inflight = {}      # khóa cache -> future: trang trùng nội dung đang OCR thì đợi kết quả chung
+
+    def resolve(page, key, future, owner):
+        if future is not None:
+            text = future.result()
+            if owner:
+                inflight.pop(key, None)
+                if cache is not None:
+                    cache.put_ocr_text(key, text)
+                stats["ocr_pages"] += 1
+            else:
+                stats["ocr_cache_hits"] += 1
+            page.page_content = text
+            page.metadata["ocr"] = True
+        return page
+
+    try:
+        for page in loader.lazy_load():
+            if not needs_ocr(page.page_content):
+                pending.append((page, None, None, False))
+            else:
+                index = page.metadata.get("page", 0)
+                key = page_key(reader.pages[index], options)
+                text = cache.get_ocr_text(key) if cache is not None else None
+                if text is not None:
+                    stats["ocr_cache_hits"] += 1
+                    page.page_content = text
+                    page.metadata["ocr"] = True
+                    pending.append((page, None, None, False))
+                elif key in inflight:
+                    pending.append((page, key, inflight[key], False))
+                else:
+                    if pool is None:
+                        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+                    inflight[key] = pool.submit(ocr_page, file_path, index + 1, options)
+                    pending.append((page, key, inflight[key], True))
+
+            # Trang đầu hàng đã sẵn sàng, hoặc đã đủ số trang chờ -> trả ra (theo thứ tự)
+            while pending and (pending[0][2] is None or len(pending) > workers * 2):
+                yield resolve(*pending.popleft())
+
+        while pending:
+            yield resolve(*pending.popleft())
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
@@ -0,0 +1,233 @@
+"""
+Cache đọc-xuyên (read-through) cho chi tiết bệnh nhân (/api/patients/{id}) và /api/patients/check?cccd=
+- Khóa theo ID bệnh nhân (JSON đã serialize + ETag) và theo CCCD (-> ID, kể cả "chưa có" để form
+  nhập CCCD mới không hỏi DB liên tục)
+- Vô hiệu chính xác ngay sau commit: tạo/sửa/xóa bệnh nhân, thêm lượt khám, nhập hàng loạt
+- Không ghi đè bằng dữ liệu cũ: mỗi lần vô hiệu tăng epoch, request đã đọc DB trước đó thì không ghi vào cache
+- ETag + If-None-Match -> 304 (trình duyệt tự gửi lại ETag nhờ Cache-Control: no-cache, frontend không phải sửa)
+Backend (PATIENT_CACHE_BACKEND):
+- memory: LRU + TTL trong tiến trình (chạy 1 worker)
+- shared: nằm trong retrieval server, mọi API worker dùng chung và cùng thấy lần vô hiệu
+  (mặc định khi có RETRIEVAL_SERVER; cache riêng từng worker sẽ trả lịch sử cũ khi worker khác ghi)
+Backend khác chỉ cần get / set(key, value, epoch) / epoch / delete / clear / stats
+"""
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from fastapi import Response
+
+from app import schemas
+
+PATIENT_CACHE_ENABLED = os.getenv("PATIENT_CACHE_ENABLED", "1") != "0"
+PATIENT_CACHE_BACKEND = os.getenv("PATIENT_CACHE_BACKEND", "")  # "" = shared nếu có retrieval server, không thì memory
+PATIENT_CACHE_MAX_ENTRIES = int(os.getenv("PATIENT_CACHE_MAX_ENTRIES", "10000"))
+# Giới hạn an toàn khi DB bị sửa ngoài API (SQL tay, import_patients.py chạy ở tiến trình khác)
+PATIENT_CACHE_TTL_SECONDS = int(os.getenv("PATIENT_CACHE_TTL_SECONDS", "300"))
+
+
+class MemoryBackend:
+    name = "memory"
+
+    def __init__(self, max_entries: int = PATIENT_CACHE_MAX_ENTRIES, ttl_seconds: int = PATIENT_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (hết hạn lúc, giá trị)
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            if item[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return item[1]
+
+    def epoch(self) -> int:
+        return self._epoch
+
+    def set(self, key: str, value, epoch: int) -> bool:
+        """Chỉ ghi nếu chưa có lần vô hiệu nào kể từ epoch (lúc bắt đầu đọc DB)"""
+        with self._lock:
+            if epoch != self._epoch:
+                return False
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            return True
+
+    def delete(self, keys):
+        with self._lock:
+            self._epoch += 1
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+
+    def stats(self):
+        return {"entries": len(self._entries), "max_entries": self.max_entries,
+                "evictions": self.evictions, "ttl_seconds": self.ttl_seconds}
+
+
+class SharedBackend:
+    """MemoryBackend nằm trong retrieval server, gọi qua RetrievalClient"""
+    name = "shared"
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, key: str):
+        return self.client.call("patient_cache_get", key)
+
+    def epoch(self) -> int:
+        return self.client.call("patient_cache_epoch")
+
+    def set(self, key: str, value, epoch: int) -> bool:
+        return self.client.call("patient_cache_set", key, value, epoch)
+
+    def delete(self, keys):
+        self.client.call("patient_cache_delete", list(keys))
+
+    def clear(self):
+        self.client.call("patient_cache_clear")
+
+    def stats(self):
+        return self.client.call("patient_cache_stats")
+
+
+def _cccd_key(cccd: str) -> str:
+    # SQL Server so sánh CCCD bỏ qua khoảng trắng cuối + không phân biệt hoa thường
+    return f"cccd:{cccd.rstrip().lower()}"
+
+
+def _entry(body: str):
+    return {"body": body, "etag": '"' + hashlib.sha1(body.encode("utf-8")).hexdigest() + '"'}
+
+
+_NOT_FOUND = _entry("null")
+
+
+class PatientCache:
+    def __init__(self, backend=None):
+        self.backend = backend  # None = tắt cache (vẫn trả ETag / 304)
+        self.hits = {"id": 0, "cccd": 0}
+        self.misses = {"id": 0, "cccd": 0}
+        self.not_modified = 0
+        self.invalidations = 0
+        self.stale_writes_skipped = 0
+        self.errors = 0
+
+    # ---------- Gọi backend (lỗi backend = coi như miss, đọc DB) ----------
+    def _call(self, method: str, *args, default=None):
+        if self.backend is None:
+            return default
+        try:
+            return getattr(self.backend, method)(*args)
+        except Exception as e:
+            self.errors += 1
+            print(f"⚠️ Cache bệnh nhân lỗi ({method}): {e}")
+            return default
+
+    def _set(self, key: str, value, epoch):
+        if epoch is not None and self._call("set", key, value, epoch, default=True) is False:
+            self.stale_writes_skipped += 1
+
+    # ---------- Đọc ----------
+    def get_by_id(self, patient_id: int, load):
+        """{"body", "etag"} của bệnh nhân, None nếu không có; load() đọc BenhNhan từ DB khi miss"""
+        key = f"id:{patient_id}"
+        entry = self._call("get", key)
+        if entry is not None:
+            self.hits["id"] += 1
+            return entry
+        self.misses["id"] += 1
+        epoch = self._call("epoch")
+        patient = load()
+        if patient is None:
+            return None
+        entry = _entry(schemas.BenhNhanResponse.model_validate(patient).model_dump_json())
+        self._set(key, entry, epoch)
+        return entry
+
+    def get_by_cccd(self, cccd: str, load):
+        """{"body", "etag"} của bệnh nhân có CCCD này (body "null" nếu chưa có)"""
+        key = _cccd_key(cccd)
+        pointer = self._call("get", key)
+        if pointer is not None:
+            if pointer["id"] is None:
+                self.hits["cccd"] += 1
+                return _NOT_FOUND
+            entry = self._call("get", f"id:{pointer['id']}")
+            if entry is not None:
+                self.hits["cccd"] += 1
+                return entry
+        self.misses["cccd"] += 1
+        epoch = self._call("epoch")
+        patient = load()
+        self._set(key, {"id": patient.ID if patient else None}, epoch)
+        if patient is None:
+            return _NOT_FOUND
+        entry = _entry(schemas.BenhNhanResponse.model_validate(patient).model_dump_json())
+        self._set(f"id:{patient.ID}", entry, epoch)
+        return entry
+
+    # ---------- Vô hiệu (gọi SAU commit) ----------
+    def invalidate(self, patient_ids=(), cccds=()):
+        keys = [f"id:{patient_id}" for patient_id in patient_ids] + [_cccd_key(cccd) for cccd in cccds if cccd]
+        if keys:
+            self.invalidations += len(keys)
+            self._call("delete", keys)
+
+    def clear(self):
+        self._call("clear")
+
+    # ---------- HTTP ----------
+    def respond(self, entry, if_none_match: str = None) -> Response:
+        """JSON đã serialize + ETag; client gửi lại đúng ETag -> 304 không body"""
+        headers = {"ETag": entry["etag"], "Cache-Control": "no-cache"}
+        if if_none_match:
+            tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+            if entry["etag"] in tags or "*" in tags:
+                self.not_modified += 1
+                return Response(status_code=304, headers=headers)
+        return Response(content=entry["body"], media_type="application/json", headers=headers)
+
+    def stats(self):
+        hits, misses = sum(self.hits.values()), sum(self.misses.values())
+        return {
+            "enabled": self.backend is not None,
+            "backend": self.backend.name if self.backend is not None else None,
+            "hits": self.hits, "misses": self.misses,
+            "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+            "not_modified": self.not_modified,
+            "invalidations": self.invalidations,
+            "stale_writes_skipped": self.stale_writes_skipped,
+            "errors": self.errors,
+            **(self._call("stats", default={}) or {}),
+        }
+
+
+def create_patient_cache(retrieval_client=None) -> PatientCache:
+    """Chọn backend theo PATIENT_CACHE_BACKEND (retrieval_client: RAGService.remote khi chạy nhiều worker)"""
+    if not PATIENT_CACHE_ENABLED:
+        return PatientCache(None)
+    backend = PATIENT_CACHE_BACKEND or ("shared" if retrieval_client else "memory")
+    if backend == "memory":
+        return PatientCache(MemoryBackend())
+    if backend == "shared":
+        if retrieval_client is None:
+            raise ValueError("PATIENT_CACHE_BACKEND=shared cần RETRIEVAL_SERVER")
+        return PatientCache(SharedBackend(retrieval_client))
+    raise ValueError(f"PATIENT_CACHE_BACKEND không hợp lệ: {backend} (memory / shared)")
@@ -0,0 +1,115 @@
+"""
+Xuất toàn bộ bệnh nhân + lượt khám dạng stream (báo cáo, sao lưu) - RAM không đổi theo cỡ bảng
+- 1 truy vấn BenhNhan LEFT JOIN LuotKham sắp theo (ID, LuotKhamID), đọc bằng server-side cursor
+  (yield_per): không tạo ORM object, không lazy-load lượt khám từng bệnh nhân
+- Các dòng của cùng 1 bệnh nhân liền nhau -> chỉ giữ 1 bệnh nhân trong RAM, ghi ra theo khối
+- since: chỉ xuất bệnh nhân tạo từ thời điểm đó (kèm mọi lượt khám) và lượt khám mới của bệnh nhân cũ
+Định dạng khớp với nhập hàng loạt (patient_import): CSV mỗi lượt khám 1 dòng, NDJSON mỗi bệnh nhân 1 dòng;
+file since= nhập được vào DB đã có bệnh nhân cũ (importer chỉ thêm lượt khám chưa có của họ)
+"""
+import io
+import os
+import csv
+import json
+from datetime import datetime, date
+
+from sqlalchemy import select, or_
+from sqlalchemy.orm import Session
+
+from app import models, schemas
+
+# Số dòng đọc mỗi lần từ cursor và ghi ra mỗi khối
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "1000"))
+
+FORMATS = ("ndjson", "csv")
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+PATIENT_COLUMNS = ("ID", "MaBenhNhan", *schemas.BenhNhanBase.model_fields, "NgayTao")
+VISIT_COLUMNS = ("LuotKhamID", *schemas.LuotKhamBase.model_fields, "NgayKham")
+
+
+def _value(value):
+    return value.isoformat() if isinstance(value, (datetime, date)) else value
+
+
+def _rows(db: Session, since: datetime = None, chunk_size: int = EXPORT_CHUNK_SIZE, stats: dict = None):
+    """
+    Từng dòng (bệnh nhân, lượt khám hoặc None), đọc theo khối chunk_size từ server-side cursor
+    stats (nếu có) được cộng dồn "rows" / "visits" trong lúc stream
+    """
+    b, v = models.BenhNhan, models.LuotKham
+    columns = [getattr(b, name) for name in PATIENT_COLUMNS] + [getattr(v, name) for name in VISIT_COLUMNS]
+    query = select(*columns).outerjoin(v, v.BenhNhanID == b.ID).order_by(b.ID, v.LuotKhamID)
+    if since is not None:
+        query = query.where(or_(b.NgayTao >= since, v.NgayKham >= since))
+    result = db.execute(query.execution_options(yield_per=chunk_size))
+    split = len(PATIENT_COLUMNS)
+    for row in result:
+        patient = dict(zip(PATIENT_COLUMNS, map(_value, row[:split])))
+        visit = dict(zip(VISIT_COLUMNS, map(_value, row[split:]))) if row[split] is not None else None
+        if stats is not None:
+            stats["rows"] += 1
+            stats["visits"] += visit is not None
+        yield patient, visit
+
+
+def _patients(rows, stats: dict = None):
+    """Gom các dòng liền nhau của cùng 1 bệnh nhân: (bệnh nhân, [lượt khám])"""
+    current, visits = None, []
+    for patient, visit in rows:
+        if current is None or patient["ID"] != current["ID"]:
+            if current is not None:
+                yield current, visits
+                visits = []
+            current = patient
+            if stats is not None:
+                stats["patients"] += 1
+        if visit is not None:
+            visits.append(visit)
+    if current is not None:
+        yield current, visits
+
+
+def iter_ndjson(db: Session, since: datetime = None, chunk_size: int = EXPORT_CHUNK_SIZE, stats: dict = None):
+    lines = []
+    for patient, visits in _patients(_rows(db, since, chunk_size, stats), stats):
+        lines.append(json.dumps({**patient, "LuotKham": visits}, ensure_ascii=False))
+        if len(lines) >= chunk_size:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def iter_csv(db: Session, since: datetime = None, chunk_size: int = EXPORT_CHUNK_SIZE, stats: dict = None):
+    buffer = io.StringIO()
+    buffer.write("\ufeff")  # BOM: Excel đọc đúng tiếng Việt, nhập lại bằng patient_import vẫn được
+    writer = csv.writer(buffer)
+    writer.writerow(PATIENT_COLUMNS + VISIT_COLUMNS)
+    empty_visit = [None] * len(VISIT_COLUMNS)
+    count, last_id = 0, None
+    for patient, visit in _rows(db, since, chunk_size, stats):
+        writer.writerow([*patient.values(), *(visit.values() if visit else empty_visit)])
+        if stats is not None and patient["ID"] != last_id:
+            stats["patients"] += 1
+            last_id = patient["ID"]
+        count += 1
+        if count % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def new_stats():
+    return {"rows": 0, "patients": 0, "visits": 0}
+
+
+def iter_export(db: Session, fmt: str, since: datetime = None, chunk_size: int = EXPORT_CHUNK_SIZE,
+                stats: dict = None):
+    """Các khối text của file xuất; kiểm tra định dạng ngay (trước khi bắt đầu stream)"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Định dạng không hỗ trợ: {fmt} (chỉ {', '.join(FORMATS)})")
+    if fmt == "csv":
+        return iter_csv(db, since, chunk_size, stats)
+    return iter_ndjson(db, since, chunk_size, stats)
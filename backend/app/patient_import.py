@@ -0,0 +1,325 @@
+"""
+Nhập hàng loạt bệnh nhân + lượt khám từ CSV / NDJSON (onboarding phòng khám mới)
+- Đọc và kiểm tra từng dòng bằng schemas khi đang đọc file (không nạp cả file vào RAM)
+- Mỗi lô IMPORT_BATCH_SIZE dòng: 1 câu SELECT ... WHERE CCCD IN (...) để tìm bệnh nhân đã có,
+  INSERT nhiều dòng 1 lần (executemany, SQL Server dùng fast_executemany), commit 1 lần
+- CCCD lặp lại trong file = thêm lượt khám cho bệnh nhân đó (CSV: mỗi lượt khám 1 dòng)
+- CCCD đã có trong DB: không sửa thông tin bệnh nhân, chỉ thêm lượt khám chưa có (trùng NgayKham tới giây
+  + nội dung thì bỏ) -> nhập được file xuất tăng dần (patient_export since=) và nhập lại 1 file nhiều lần
+- Dòng lỗi được báo kèm số dòng, không làm hỏng cả lô; lô ghi DB lỗi thì chỉ lô đó bị rollback
+CSV: tiêu đề cột trùng tên trường của BenhNhan/LuotKham (HoTen, CCCD, ..., TrieuChung, BenhDanh, NgayKham...)
+NDJSON: mỗi dòng 1 BenhNhanImport, lượt khám trong "LuotKham" (danh sách) hoặc "LuotKhamDau"
+"""
+import io
+import os
+import csv
+import codecs
+import json
+import time
+from datetime import datetime
+
+from pydantic import ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from app import models, schemas, patient_search
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+# Số lỗi chi tiết tối đa trả về (vẫn đếm đủ trong "failed")
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))
+# Số byte đầu file đọc thử để phát hiện file không phải UTF-8 trước khi ghi lô nào
+ENCODING_SNIFF_BYTES = 64 * 1024
+ENCODING_HINT = "lưu lại file dạng \"CSV UTF-8\" (Excel: Save As -> CSV UTF-8) rồi nhập lại"
+
+FORMATS = ("csv", "ndjson")
+VISIT_FIELDS = tuple(schemas.LuotKhamImport.model_fields)
+VISIT_CONTENT_FIELDS = tuple(field for field in VISIT_FIELDS if field != "NgayKham")
+
+
+def _column_lengths(model):
+    return {column.name: column.type.length for column in model.__table__.columns
+            if getattr(column.type, "length", None)}
+
+
+# Kiểm tra độ dài trước khi ghi: SQL Server từ chối chuỗi quá dài -> hỏng cả lô thay vì 1 dòng
+PATIENT_LENGTHS = _column_lengths(models.BenhNhan)
+VISIT_LENGTHS = _column_lengths(models.LuotKham)
+
+
+def detect_format(filename: str, fmt: str = None) -> str:
+    """Định dạng theo tham số format, không có thì theo đuôi file"""
+    if fmt:
+        fmt = fmt.lower()
+        if fmt not in FORMATS:
+            raise ValueError(f"Định dạng không hỗ trợ: {fmt} (chỉ {', '.join(FORMATS)})")
+        return fmt
+    ext = os.path.splitext(filename or "")[1].lower()
+    if ext == ".csv":
+        return "csv"
+    if ext in (".ndjson", ".jsonl"):
+        return "ndjson"
+    raise ValueError("Không nhận ra định dạng file: dùng đuôi .csv / .ndjson hoặc truyền format")
+
+
+def _csv_records(stream):
+    reader = csv.DictReader(stream)
+    for row in reader:
+        # Ô trống = không có giá trị; cột lạ / thừa để schema bỏ qua
+        record = {key.strip(): (value.strip() or None) if isinstance(value, str) else value
+                  for key, value in row.items() if key}
+        visit = {field: record.pop(field) for field in VISIT_FIELDS if field in record}
+        if any(value is not None for value in visit.values()):
+            record["LuotKham"] = [visit]
+        yield reader.line_num, record
+
+
+def _ndjson_records(stream):
+    for line_no, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_no, e
+            continue
+        if isinstance(record, dict) and "LuotKhamDau" in record:
+            first = record.pop("LuotKhamDau")
+            if first:
+                record["LuotKham"] = [first, *(record.get("LuotKham") or [])]
+        yield line_no, record
+
+
+def _length_errors(item) -> str:
+    problems = [
+        f"{prefix}{field}: dài quá {limit} ký tự"
+        for prefix, values, lengths in [("", item.model_dump(exclude={"LuotKham"}), PATIENT_LENGTHS)] + [
+            (f"LuotKham.{i}.", visit.model_dump(), VISIT_LENGTHS) for i, visit in enumerate(item.LuotKham)
+        ]
+        for field, limit in lengths.items()
+        if isinstance(values.get(field), str) and len(values[field]) > limit
+    ]
+    return "; ".join(problems)
+
+
+def _error_message(exc: Exception) -> str:
+    if isinstance(exc, ValidationError):
+        return "; ".join(
+            f"{'.'.join(str(part) for part in e['loc'])}: {e['msg']}" if e["loc"] else e["msg"] for e in exc.errors()
+        )
+    if isinstance(exc, json.JSONDecodeError):
+        return f"JSON không hợp lệ: {exc.msg}"
+    return str(exc)
+
+
+class PatientImporter:
+    def __init__(self, db: Session, batch_size: int = IMPORT_BATCH_SIZE, dry_run: bool = False, on_commit=None):
+        self.db = db
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.on_commit = on_commit  # on_commit(CCCD mới, ID bệnh nhân có thay đổi) sau mỗi lô, VD vô hiệu cache
+        self.imported = {}  # CCCD -> ID bệnh nhân tạo trong lần nhập này (dòng sau cùng CCCD thêm lượt khám)
+        self.report = {
+            "rows": 0, "patients_created": 0, "visits_created": 0, "skipped_existing": 0,
+            "visits_skipped_duplicate": 0, "failed": 0, "errors": [], "dry_run": dry_run,
+        }
+
+    def _note(self, line: int, cccd, message: str):
+        if len(self.report["errors"]) < IMPORT_MAX_ERRORS:
+            self.report["errors"].append({"line": line, "CCCD": cccd, "error": message})
+
+    def _fail(self, line: int, cccd, message: str):
+        self.report["failed"] += 1
+        self._note(line, cccd, message)
+
+    def run(self, records):
+        started = time.perf_counter()
+        batch = []
+        line = 0
+        try:
+            for line, record in records:
+                self.report["rows"] += 1
+                if isinstance(record, Exception):
+                    self._fail(line, None, _error_message(record))
+                    continue
+                try:
+                    item = schemas.BenhNhanImport.model_validate(record)
+                except ValidationError as e:
+                    self._fail(line, record.get("CCCD") if isinstance(record, dict) else None, _error_message(e))
+                    continue
+                item.CCCD = item.CCCD.strip()
+                problem = "CCCD: trống" if not item.CCCD else _length_errors(item)
+                if problem:
+                    self._fail(line, item.CCCD or None, problem)
+                    continue
+                batch.append((line, item))
+                if len(batch) >= self.batch_size:
+                    self._flush(batch)
+                    batch = []
+                    elapsed = time.perf_counter() - started
+                    print(f"   ... {self.report['rows']} dòng, {self.report['rows'] / elapsed:.0f} dòng/s")
+        except UnicodeDecodeError as e:
+            # Đoạn sau của file không phải UTF-8: không đọc tiếp được, các dòng đã đọc vẫn được ghi
+            self._fail(line + 1, None, f"Không đọc được file từ khoảng dòng {line + 1}: không phải UTF-8 "
+                                       f"(byte {e.object[e.start:e.start + 1]!r}) - {ENCODING_HINT}")
+        if batch:
+            self._flush(batch)
+
+        self.report["errors"].sort(key=lambda error: error["line"])  # dòng trùng CCCD chỉ phát hiện lúc ghi lô
+        elapsed = time.perf_counter() - started
+        self.report["seconds"] = round(elapsed, 3)
+        self.report["rows_per_sec"] = round(self.report["rows"] / elapsed, 1) if elapsed else 0.0
+        print(f"✅ Nhập {self.report['rows']} dòng trong {elapsed:.1f}s ({self.report['rows_per_sec']:.0f} dòng/s): "
+              f"+{self.report['patients_created']} bệnh nhân, +{self.report['visits_created']} lượt khám, "
+              f"bỏ {self.report['skipped_existing']} CCCD đã có, {self.report['visits_skipped_duplicate']} lượt khám "
+              f"trùng, {self.report['failed']} dòng lỗi"
+              + (" (chạy thử, không ghi DB)" if self.dry_run else ""))
+        return self.report
+
+    def _existing_patients(self, cccds):
+        """CCCD -> ID của bệnh nhân đã có trong DB"""
+        if not cccds:
+            return {}
+        rows = self.db.execute(
+            select(models.BenhNhan.ID, models.BenhNhan.CCCD).where(models.BenhNhan.CCCD.in_(cccds))
+        )
+        return {row.CCCD: row.ID for row in rows}
+
+    @staticmethod
+    def _visit_key(patient_id, visit: dict):
+        """Khóa chống trùng lượt khám: bệnh nhân + NgayKham (tới giây, DATETIME SQL Server làm tròn ms) + nội dung"""
+        return (patient_id, visit["NgayKham"].replace(microsecond=0),
+                *(visit[field] for field in VISIT_CONTENT_FIELDS))
+
+    def _known_visits(self, batch, existing):
+        """Khóa các lượt khám đã có trong DB của bệnh nhân cũ, chỉ từ NgayKham nhỏ nhất trong lô trở đi"""
+        dates = [visit.NgayKham for _, item in batch if item.CCCD in existing
+                 for visit in item.LuotKham if visit.NgayKham is not None]
+        if not dates:
+            return set()
+        v = models.LuotKham
+        rows = self.db.execute(
+            select(v.BenhNhanID, *(getattr(v, field) for field in VISIT_FIELDS))
+            .where(v.BenhNhanID.in_(set(existing.values())), v.NgayKham >= min(dates).replace(microsecond=0))
+        )
+        return {self._visit_key(row.BenhNhanID, row._mapping) for row in rows}
+
+    def _flush(self, batch):
+        # 1 lần tra CCCD cho cả lô (CCCD đã tạo ở lô trước của lần nhập này thì không cần tra)
+        existing = self._existing_patients({item.CCCD for _, item in batch} - self.imported.keys())
+        known = self._known_visits(batch, existing)
+        new_patients = {}  # CCCD -> bệnh nhân tạo mới trong lô này
+        visits = []  # (CCCD, lượt khám)
+        accepted = []  # (dòng, CCCD) được ghi trong lô, để báo lỗi nếu lô ghi DB thất bại
+        duplicates = 0
+        for line, item in batch:
+            if item.CCCD in existing:
+                # Bệnh nhân cũ: giữ nguyên thông tin, chỉ thêm lượt khám chưa có (không có NgayKham = lượt mới)
+                fresh = []
+                for visit in item.LuotKham:
+                    key = self._visit_key(existing[item.CCCD], visit.model_dump()) if visit.NgayKham else None
+                    if key in known:
+                        duplicates += 1
+                        continue
+                    if key is not None:
+                        known.add(key)  # cùng lượt khám lặp lại trong file
+                    fresh.append(visit)
+                if not fresh:
+                    self.report["skipped_existing"] += 1  # bỏ qua có chủ đích, không tính là lỗi
+                    self._note(line, item.CCCD, "Bệnh nhân với CCCD này đã tồn tại"
+                               + (" và các lượt khám đã có" if item.LuotKham else ""))
+                    continue
+                visits.extend((item.CCCD, visit) for visit in fresh)
+                accepted.append((line, item.CCCD))
+                continue
+            duplicate = item.CCCD in new_patients or item.CCCD in self.imported
+            if duplicate and not item.LuotKham:
+                self._fail(line, item.CCCD, "CCCD lặp lại trong file và không có lượt khám để thêm")
+                continue
+            if not duplicate:
+                new_patients[item.CCCD] = item
+            visits.extend((item.CCCD, visit) for visit in item.LuotKham)
+            accepted.append((line, item.CCCD))
+
+        if self.dry_run:
+            self.imported.update(dict.fromkeys(new_patients))
+            self.report["patients_created"] += len(new_patients)
+            self.report["visits_created"] += len(visits)
+            self.report["visits_skipped_duplicate"] += duplicates
+            return
+
+        now = datetime.now()
+        try:
+            new_ids = {}
+            if new_patients:
+                self.db.execute(insert(models.BenhNhan), [
+                    {**item.model_dump(exclude={"LuotKham"}), "NgayTao": item.NgayTao or now}
+                    for item in new_patients.values()
+                ])
+                created = self.db.execute(
+                    select(models.BenhNhan.ID, models.BenhNhan.CCCD, models.BenhNhan.HoTen, models.BenhNhan.DiaChi)
+                    .where(models.BenhNhan.CCCD.in_(new_patients.keys()))
+                ).all()
+                new_ids = {row.CCCD: row.ID for row in created}
+                keywords = [
+                    {"TuKhoa": token, "BenhNhanID": row.ID, "TrongSo": weight}
+                    for row in created
+                    for token, weight in patient_search.patient_tokens(row).items()
+                ]
+                if keywords:
+                    self.db.execute(insert(models.BenhNhanTuKhoa), keywords)
+            if visits:
+                patient_ids = {**existing, **self.imported, **new_ids}
+                self.db.execute(insert(models.LuotKham), [
+                    {**visit.model_dump(), "BenhNhanID": patient_ids[cccd], "NgayKham": visit.NgayKham or now}
+                    for cccd, visit in visits
+                ])
+            self.db.commit()
+        except SQLAlchemyError as e:
+            # VD: request khác vừa tạo cùng CCCD -> cả lô rollback, các lô khác không ảnh hưởng
+            self.db.rollback()
+            message = f"Lỗi ghi DB (cả lô {len(batch)} dòng bị bỏ): {str(getattr(e, 'orig', None) or e)[:300]}"
+            for line, cccd in accepted:
+                self._fail(line, cccd, message)
+            return
+
+        self.imported.update(new_ids)
+        if self.on_commit:
+            self.on_commit(list(new_patients), {patient_ids[cccd] for cccd, _ in visits} if visits else set())
+        self.report["patients_created"] += len(new_patients)
+        self.report["visits_created"] += len(visits)
+        self.report["visits_skipped_duplicate"] += duplicates
+
+
+def check_encoding(fileobj):
+    """
+    Đọc thử đầu file (rồi tua lại): không phải UTF-8, VD CSV Excel lưu Windows-1258 / CP1252
+    -> ValueError trước khi ghi lô nào; lỗi ở đoạn sau được báo như lỗi dòng trong run()
+    """
+    if not fileobj.seekable():
+        return
+    start = fileobj.tell()
+    head = fileobj.read(ENCODING_SNIFF_BYTES)
+    fileobj.seek(start)
+    try:
+        # final=False: ký tự nhiều byte bị cắt ở cuối đoạn đọc thử không tính là lỗi
+        codecs.getincrementaldecoder("utf-8-sig")().decode(head, final=len(head) < ENCODING_SNIFF_BYTES)
+    except UnicodeDecodeError as e:
+        raise ValueError(f"File không phải UTF-8 (byte {e.object[e.start:e.start + 1]!r} ở vị trí {e.start}): "
+                         f"{ENCODING_HINT}")
+
+
+def import_file(db: Session, fileobj, fmt: str, batch_size: int = IMPORT_BATCH_SIZE, dry_run: bool = False,
+                on_commit=None):
+    """
+    Nhập từ file nhị phân (upload / open(..., 'rb')), đọc tuần tự; trả về báo cáo ImportReport
+    File không phải UTF-8 -> ValueError (check_encoding) trước khi ghi gì vào DB
+    """
+    check_encoding(fileobj)
+    stream = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")  # utf-8-sig: CSV xuất từ Excel có BOM
+    try:
+        records = _csv_records(stream) if fmt == "csv" else _ndjson_records(stream)
+        return PatientImporter(db, batch_size, dry_run, on_commit).run(records)
+    finally:
+        stream.detach()  # không đóng file của người gọi
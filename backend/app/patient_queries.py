@@ -0,0 +1,103 @@
+"""
+Truy vấn danh sách bệnh nhân / lượt khám
+- Danh sách chỉ kèm lượt khám mới nhất + số lượt khám, lấy bằng 1 truy vấn window function
+  cho cả trang (không lazy-load luot_khams từng bệnh nhân -> hết N+1)
+- Phân trang keyset (cursor) trên (NgayTao, ID) / (NgayKham, LuotKhamID): trang sâu vẫn nhanh
+"""
+import json
+import base64
+from datetime import datetime
+
+from sqlalchemy import select, func, desc, or_, and_
+from sqlalchemy.orm import Session, aliased
+
+from app import models, schemas
+
+
+def encode_cursor(timestamp: datetime, row_id: int) -> str:
+    raw = json.dumps([timestamp.isoformat() if timestamp else None, row_id])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str):
+    """Trả về (timestamp, id); cursor không hợp lệ -> ValueError"""
+    try:
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return (datetime.fromisoformat(timestamp) if timestamp else None), int(row_id)
+    except Exception:
+        raise ValueError("Cursor không hợp lệ")
+
+
+def _after(time_column, id_column, cursor: str):
+    """
+    Điều kiện keyset cho thứ tự (time DESC, id DESC): lấy các dòng đứng sau cursor
+    NgayTao / NgayKham là NOT NULL nên không cần nhánh IS NULL (nhánh OR đó làm mất index seek)
+    """
+    timestamp, row_id = decode_cursor(cursor)
+    if timestamp is None:
+        raise ValueError("Cursor không hợp lệ")
+    return or_(
+        time_column < timestamp,
+        and_(time_column == timestamp, id_column < row_id),
+    )
+
+
+def latest_visits(db: Session, patient_ids):
+    """BenhNhanID -> (lượt khám mới nhất, tổng số lượt khám) cho cả trang, 1 truy vấn"""
+    if not patient_ids:
+        return {}
+    v = models.LuotKham
+    ranked = select(
+        v,
+        func.row_number().over(
+            partition_by=v.BenhNhanID, order_by=(desc(v.NgayKham), desc(v.LuotKhamID))
+        ).label("rn"),
+        func.count().over(partition_by=v.BenhNhanID).label("cnt"),
+    ).where(v.BenhNhanID.in_(patient_ids)).subquery()
+    visit = aliased(v, ranked)
+    rows = db.query(visit, ranked.c.cnt).filter(ranked.c.rn == 1).all()
+    return {row[0].BenhNhanID: (row[0], row[1]) for row in rows}
+
+
+def list_items(db: Session, patients):
+    """Chuyển danh sách BenhNhan thành BenhNhanListItem (kèm lượt khám mới nhất)"""
+    latest = latest_visits(db, [patient.ID for patient in patients])
+    items = []
+    for patient in patients:
+        item = schemas.BenhNhanListItem.model_validate(patient)
+        if patient.ID in latest:
+            visit, count = latest[patient.ID]
+            item.LuotKhamMoiNhat = schemas.LuotKhamResponse.model_validate(visit)
+            item.SoLuotKham = count
+        items.append(item)
+    return items
+
+
+def patient_page(db: Session, cursor: str = None, limit: int = 100):
+    """1 trang bệnh nhân mới nhất trước, keyset trên (NgayTao, ID)"""
+    b = models.BenhNhan
+    query = db.query(b)
+    if cursor:
+        query = query.filter(_after(b.NgayTao, b.ID, cursor))
+    patients = query.order_by(desc(b.NgayTao), desc(b.ID)).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(patients) > limit:
+        patients = patients[:limit]
+        next_cursor = encode_cursor(patients[-1].NgayTao, patients[-1].ID)
+    return {"items": list_items(db, patients), "next_cursor": next_cursor}
+
+
+def visit_page(db: Session, patient_id: int, cursor: str = None, limit: int = 20):
+    """1 trang lịch sử khám của bệnh nhân, mới nhất trước, keyset trên (NgayKham, LuotKhamID)"""
+    v = models.LuotKham
+    query = db.query(v).filter(v.BenhNhanID == patient_id)
+    if cursor:
+        query = query.filter(_after(v.NgayKham, v.LuotKhamID, cursor))
+    visits = query.order_by(desc(v.NgayKham), desc(v.LuotKhamID)).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(visits) > limit:
+        visits = visits[:limit]
+        next_cursor = encode_cursor(visits[-1].NgayKham, visits[-1].LuotKhamID)
+    return {"items": visits, "next_cursor": next_cursor}
@@ -0,0 +1,184 @@
+"""
+Tìm kiếm bệnh nhân bằng chỉ mục đảo (inverted index) do ứng dụng tự duy trì
+- Bảng BenhNhanTuKhoa: (TuKhoa, BenhNhanID, TrongSo) - từ khóa đã bỏ dấu, viết thường
+- Tìm theo tiền tố từ khóa (LIKE 'ngu%') -> SQL Server seek trên index, không quét cả bảng
+- Mọi từ trong câu tìm đều phải khớp; xếp hạng theo tổng trọng số (HoTen > DiaChi)
+- Câu tìm toàn số -> đường tắt: tiền tố CCCD / SĐT (đều có index)
+"""
+import re
+import unicodedata
+
+from sqlalchemy import select, union_all, literal, func, case, desc, exists, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app import models
+
+# Trọng số theo trường dữ liệu
+FIELD_WEIGHTS = {"HoTen": 3, "DiaChi": 1}
+
+MAX_TOKEN_LENGTH = 64
+MAX_QUERY_TOKENS = 6
+MIN_PREFIX_LENGTH = 2  # từ 1 ký tự chỉ khớp chính xác, tránh quét quá rộng
+MIN_DIGITS_PREFIX = 3
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_MA_BENH_NHAN_RE = re.compile(r"^bn0*(\d+)$")
+
+
+def normalize(text: str) -> str:
+    """Bỏ dấu tiếng Việt + viết thường: 'Nguyễn Đức' -> 'nguyen duc'"""
+    text = (text or "").replace("đ", "d").replace("Đ", "D")
+    text = unicodedata.normalize("NFD", text)
+    text = "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+    return text.lower()
+
+
+def tokenize(text: str):
+    return [token[:MAX_TOKEN_LENGTH] for token in _TOKEN_RE.findall(normalize(text))]
+
+
+def patient_tokens(patient) -> dict:
+    """Từ khóa -> trọng số (cộng dồn nếu 1 từ xuất hiện ở nhiều trường)"""
+    weights = {}
+    for field, weight in FIELD_WEIGHTS.items():
+        for token in set(tokenize(getattr(patient, field, None))):
+            weights[token] = weights.get(token, 0) + weight
+    return weights
+
+
+def index_patient(db: Session, patient):
+    """Ghi lại từ khóa của 1 bệnh nhân (gọi sau khi tạo/sửa, trước commit)"""
+    db.query(models.BenhNhanTuKhoa).filter(models.BenhNhanTuKhoa.BenhNhanID == patient.ID).delete()
+    db.add_all([
+        models.BenhNhanTuKhoa(TuKhoa=token, BenhNhanID=patient.ID, TrongSo=weight)
+        for token, weight in patient_tokens(patient).items()
+    ])
+
+
+def unindex_patient(db: Session, patient_id: int):
+    db.query(models.BenhNhanTuKhoa).filter(models.BenhNhanTuKhoa.BenhNhanID == patient_id).delete()
+
+
+def rebuild_index(db: Session, batch_size: int = 1000):
+    """Xây lại toàn bộ chỉ mục từ bảng BenhNhan (theo lô, keyset trên ID)"""
+    db.query(models.BenhNhanTuKhoa).delete()
+    db.commit()
+    last_id, total = 0, 0
+    while True:
+        patients = db.query(models.BenhNhan.ID, models.BenhNhan.HoTen, models.BenhNhan.DiaChi)\
+            .filter(models.BenhNhan.ID > last_id)\
+            .order_by(models.BenhNhan.ID)\
+            .limit(batch_size).all()
+        if not patients:
+            break
+        rows = [
+            {"TuKhoa": token, "BenhNhanID": patient.ID, "TrongSo": weight}
+            for patient in patients
+            for token, weight in patient_tokens(patient).items()
+        ]
+        if rows:
+            db.bulk_insert_mappings(models.BenhNhanTuKhoa, rows)
+        db.commit()
+        last_id = patients[-1].ID
+        total += len(patients)
+    return total
+
+
+def backfill_index(db: Session, batch_size: int = 1000):
+    """
+    Lập chỉ mục cho bệnh nhân chưa có từ khóa nào (dữ liệu có từ trước khi có chỉ mục, chèn thẳng bằng SQL)
+    API gọi lúc khởi động: bệnh nhân đã có từ khóa không bị đụng tới, lần sau chỉ là 1 truy vấn kiểm tra
+    Trả về số bệnh nhân đã bổ sung
+    """
+    b, t = models.BenhNhan, models.BenhNhanTuKhoa
+    last_id, total = 0, 0
+    while True:
+        patients = db.query(b.ID, b.HoTen, b.DiaChi)\
+            .filter(b.ID > last_id, ~exists().where(t.BenhNhanID == b.ID))\
+            .order_by(b.ID)\
+            .limit(batch_size).all()
+        if not patients:
+            return total
+        last_id = patients[-1].ID
+        rows = [
+            {"TuKhoa": token, "BenhNhanID": patient.ID, "TrongSo": weight}
+            for patient in patients
+            for token, weight in patient_tokens(patient).items()
+        ]
+        if not rows:
+            continue
+        try:
+            db.execute(insert(t), rows)
+            db.commit()
+            total += len(patients)
+        except IntegrityError:
+            # Worker khác / API vừa lập chỉ mục 1 phần lô này -> ghi lại từng bệnh nhân còn thiếu
+            db.rollback()
+            for patient in patients:
+                if db.query(exists().where(t.BenhNhanID == patient.ID)).scalar():
+                    continue
+                try:
+                    db.execute(insert(t), [row for row in rows if row["BenhNhanID"] == patient.ID])
+                    db.commit()
+                    total += 1
+                except IntegrityError:
+                    db.rollback()
+
+
+def _ranked_ids_by_tokens(db: Session, tokens, skip: int, limit: int):
+    """Mỗi từ trong câu tìm -> 1 nhánh seek theo tiền tố; bệnh nhân phải khớp đủ mọi từ"""
+    t = models.BenhNhanTuKhoa
+    branches = []
+    for position, token in enumerate(tokens):
+        condition = t.TuKhoa.like(token + "%") if len(token) >= MIN_PREFIX_LENGTH else t.TuKhoa == token
+        # Khớp trọn từ được điểm gấp đôi khớp tiền tố
+        score = case((t.TuKhoa == token, t.TrongSo * 2), else_=t.TrongSo)
+        branches.append(
+            select(t.BenhNhanID.label("BenhNhanID"), literal(position).label("q"), score.label("score"))
+            .where(condition)
+        )
+    matches = union_all(*branches).subquery()
+    # Mỗi từ trong câu tìm chỉ tính từ khóa khớp tốt nhất ("ng" khớp nhiều từ khóa không được cộng dồn điểm)
+    per_token = select(matches.c.BenhNhanID, matches.c.q, func.max(matches.c.score).label("score"))\
+        .group_by(matches.c.BenhNhanID, matches.c.q)\
+        .subquery()
+
+    b = models.BenhNhan
+    stmt = select(per_token.c.BenhNhanID)\
+        .join(b, b.ID == per_token.c.BenhNhanID)\
+        .group_by(per_token.c.BenhNhanID, b.NgayTao)\
+        .having(func.count(func.distinct(per_token.c.q)) == len(tokens))\
+        .order_by(desc(func.sum(per_token.c.score)), desc(b.NgayTao), desc(per_token.c.BenhNhanID))\
+        .offset(skip).limit(limit)
+    return [row[0] for row in db.execute(stmt)]
+
+
+def _ranked_ids_by_digits(db: Session, digits: str, skip: int, limit: int):
+    """Đường tắt cho CCCD / SĐT: tìm theo tiền tố trên cột có index, khớp chính xác xếp trước"""
+    b = models.BenhNhan
+    exact = case((b.CCCD == digits, 0), (b.SDT == digits, 0), else_=1)
+    stmt = select(b.ID)\
+        .where(b.CCCD.like(digits + "%") | b.SDT.like(digits + "%"))\
+        .order_by(exact, desc(b.NgayTao), desc(b.ID))\
+        .offset(skip).limit(limit)
+    return [row[0] for row in db.execute(stmt)]
+
+
+def search_patient_ids(db: Session, q: str, skip: int = 0, limit: int = 20):
+    """Trả về danh sách ID bệnh nhân đã xếp hạng cho câu tìm q"""
+    q = (q or "").strip()
+    compact = re.sub(r"[\s.\-]", "", q)
+
+    # Mã bệnh nhân BNxxxxx -> tra thẳng theo ID
+    ma = _MA_BENH_NHAN_RE.match(compact.lower())
+    if ma:
+        return [int(ma.group(1))] if skip == 0 else []
+
+    if compact.isdigit() and len(compact) >= MIN_DIGITS_PREFIX:
+        return _ranked_ids_by_digits(db, compact, skip, limit)
+
+    tokens = list(dict.fromkeys(tokenize(q)))[:MAX_QUERY_TOKENS]
+    if not tokens:
+        return []
+    return _ranked_ids_by_tokens(db, tokens, skip, limit)
@@ -1,15 +1,28 @@
 import os
+import time
+import asyncio
+import threading
+from contextlib import contextmanager
 from dotenv import load_dotenv
 
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_text_splitters.character import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_community.vectorstores import FAISS
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_classic.chains.combine_documents import create_stuff_documents_chain
-from langchain_classic.chains import create_retrieval_chain
 from langchain_core.output_parsers import StrOutputParser
+from starlette.concurrency import run_in_threadpool
+
+from app import metrics
+from app.semantic_cache import SemanticCache
+from app.context_packer import ContextPacker
+from app.case_index import CaseIndex
+from app.ingest_store import IngestStore, IngestJournal, hash_file, hash_chunk
+from app.ingest_pipeline import iter_parsed, iter_page_chunks
+from app.embedding_factory import embedding_params_from_env, create_embeddings
+from app.index_factory import index_params_from_env
+from app.vector_store import migrate_langchain_index
+from app.segment_store import SegmentStore, document_name, MANIFEST_FILE
+from app.writer_lock import WriterLock
+from app.retrieval_rpc import RetrievalClient, RemoteEmbeddings, RemoteVectorStore, RemoteCaseIndex
 
 # Load biến môi trường
 load_dotenv()
@@ -17,45 +30,330 @@ load_dotenv()
 # Cấu hình đường dẫn tuyệt đối để tránh lỗi path
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 VECTOR_DB_PATH = os.path.join(BASE_DIR, "storage", "vector_db")
-INDEX_NAME = "tcm_index"
+INDEX_NAME = "tcm_index"  # định dạng cũ (FAISS.save_local), tự chuyển sang STORE_PATH khi khởi động
+STORE_PATH = os.path.join(VECTOR_DB_PATH, "tcm_store")
+
+# Load index bằng mmap (dùng chung page cache giữa các tiến trình); đặt 0 để đọc hết vào RAM
+VECTOR_DB_MMAP = os.getenv("VECTOR_DB_MMAP", "1") != "0"
+# Số giây chờ trước khi dọn hẳn segment của tài liệu đã xóa/thay (tiến trình khác có thể còn đọc)
+SEGMENT_COMPACTION_DELAY = int(os.getenv("SEGMENT_COMPACTION_DELAY", "60"))
+# Chu kỳ (giây) kiểm tra snapshot mới do tiến trình khác (pdf_watcher.py, load_pdfs.py) publish; 0 = tắt
+VECTOR_DB_RELOAD_INTERVAL = float(os.getenv("VECTOR_DB_RELOAD_INTERVAL", "2"))
+# Khóa ghi kho vector dùng chung giữa các tiến trình
+WRITER_LOCK_PATH = os.path.join(VECTOR_DB_PATH, "writer.lock")
+
+SEMANTIC_CACHE_PATH = os.path.join(VECTOR_DB_PATH, "semantic_cache.sqlite3")
+INGEST_STORE_PATH = os.path.join(VECTOR_DB_PATH, "ingest_store.sqlite3")
+INGEST_JOURNAL_PATH = os.path.join(VECTOR_DB_PATH, "ingest_journal.jsonl")
+CASE_INDEX_PATH = os.path.join(VECTOR_DB_PATH, "case_index.sqlite3")
+
+# Địa chỉ retrieval server dùng chung cho nhiều API worker (VD: storage/retrieval.sock, 127.0.0.1:8765)
+# Trống = mỗi tiến trình tự load model embedding + index như trước
+RETRIEVAL_SERVER = os.getenv("RETRIEVAL_SERVER", "")
+RETRIEVAL_KEY_PATH = os.path.join(BASE_DIR, "storage", "retrieval.key")
+
+# Số chunk gom lại trước mỗi lần embedding khi bulk ingest
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))
+# Upload / watcher: đọc PDF từng trang, RAM không phụ thuộc cỡ sách (0 = đọc cả file như bulk ingest)
+INGEST_STREAMING = os.getenv("INGEST_STREAMING", "1") != "0"
+
+NO_KNOWLEDGE_ANSWER = "Xin lỗi, tôi chưa được học tài liệu nào. Vui lòng upload PDF trước."
+NO_KNOWLEDGE_ASK_ANSWER = "Xin lỗi, tôi chưa được học tài liệu nào cả. Vui lòng upload sách PDF trước."
+
+# Batch chat/chẩn đoán: số lời gọi Gemini chạy song song tối đa
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "8"))
+BATCH_MODES = ("chat", "ask")
+
+# Chẩn đoán (ask): số ca bệnh tương tự trong lịch sử khám đưa kèm vào prompt (0 = không đưa)
+CASE_CONTEXT_K = int(os.getenv("CASE_CONTEXT_K", "0"))
 
 class RAGService:
-    def __init__(self):
-        # 1. Khởi tạo model Embeddings Local (Miễn phí, không giới hạn)
-        # Sử dụng model hỗ trợ đa ngôn ngữ (bao gồm tiếng Việt)
-        print("📥 Đang tải/load model embedding local (lần đầu sẽ hơi lâu)...")
-        # Sử dụng model paraphrase-multilingual-MiniLM-L12-v2 hỗ trợ tiếng Việt tốt
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
-        )
+    def __init__(self, retrieval_server: str = None, warm_up: bool = True):
+        """
+        retrieval_server: địa chỉ retrieval server (retrieval_server.py) -> không load model embedding/index
+        ở tiến trình này, embedding + tìm kiếm + chỉ mục ca bệnh gọi sang server (API chạy nhiều worker)
+        warm_up=False: chỉ tạo khung, phần nặng (model, LLM, index, tự học PDF) chạy sau bằng warm_up()
+        (API gọi ở luồng nền để phục vụ ngay các API bệnh nhân, xem ready / /health/ready)
+        """
+        self.remote = RetrievalClient(retrieval_server, RETRIEVAL_KEY_PATH) if retrieval_server else None
+        self.embedding_params = embedding_params_from_env()
+        # Loại FAISS index (flat/hnsw/ivf_flat/ivf_pq) + nprobe/efSearch, đọc từ .env
+        self.index_params = index_params_from_env()
+        self.embeddings = None
+        self.llm = None
         self.vector_db = None
-        
-        # 2. Khởi tạo LLM với Gemini 2.5 Flash
-        self.llm = ChatGoogleGenerativeAI(
-            model="gemini-2.5-flash",
-            temperature=0.3,
-            google_api_key=os.getenv("GOOGLE_API_KEY")
-        )
-        
-        # 3. Load bộ nhớ cũ nếu đã từng học
-        self._load_db()
+        self.answer_cache = None
+        self.context_packer = None
+        self.case_index = None
+        self.snapshot_reloads = 0
+        self._reload_lock = threading.Lock()
+        self._manifest_mtime = None
+        self._snapshot_thread = None
 
-    def _load_db(self):
-        """Hàm load Vector DB từ ổ cứng lên RAM"""
-        if os.path.exists(os.path.join(VECTOR_DB_PATH, INDEX_NAME)):
-            try:
-                self.vector_db = FAISS.load_local(
-                    os.path.join(VECTOR_DB_PATH, INDEX_NAME), 
-                    self.embeddings,
-                    allow_dangerous_deserialization=True
+        # Trạng thái khởi động: pending -> starting -> ready / failed, thời gian từng phase (giây)
+        self.ready = threading.Event()
+        self.startup_status = "pending"
+        self.startup_phase = None
+        self.startup_error = None
+        self.startup_timings = {}
+        if warm_up:
+            self.warm_up()
+
+    @contextmanager
+    def _phase(self, name: str):
+        self.startup_phase = name
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.startup_timings[name] = round(time.perf_counter() - started, 3)
+
+    def warm_up(self):
+        """Khởi tạo phần nặng theo từng phase; lỗi -> startup_status = "failed" và ném lại lỗi"""
+        self.startup_status = "starting"
+        started = time.perf_counter()
+        try:
+            self._warm_up()
+        except Exception as e:
+            self.startup_status = "failed"
+            self.startup_error = str(e)
+            raise
+        self.startup_timings["total"] = round(time.perf_counter() - started, 3)
+        self.startup_phase = None
+        self.startup_status = "ready"
+        self.ready.set()
+        print("⏱️ Khởi động AI xong trong {total:.1f}s (".format(**self.startup_timings)
+              + ", ".join(f"{name} {seconds:.1f}s" for name, seconds in self.startup_timings.items()
+                          if name != "total") + ")")
+
+    def _warm_up(self):
+        if self.remote:
+            with self._phase("retrieval_server"):
+                info = self.remote.wait_ready()
+            print(f"🔌 Dùng retrieval server {self.remote.address_text} ({self.remote.count} đoạn tri thức)")
+            self.embeddings = RemoteEmbeddings(self.remote)
+            self.vector_db = RemoteVectorStore(self.remote, info["dim"])
+        else:
+            with self._phase("embeddings"):
+                # 1. Khởi tạo model Embeddings Local (Miễn phí, không giới hạn)
+                # Sử dụng model hỗ trợ đa ngôn ngữ (bao gồm tiếng Việt)
+                print("📥 Đang tải/load model embedding local (lần đầu sẽ hơi lâu)...")
+                # Sử dụng model paraphrase-multilingual-MiniLM-L12-v2 hỗ trợ tiếng Việt tốt
+                # Backend torch/onnx/onnx_int8 chọn bằng EMBEDDING_BACKEND (xem embedding_factory.py)
+                self.embeddings = create_embeddings(self.embedding_params)
+
+        with self._phase("stores"):
+            # Manifest file đã học + kho embedding theo hash chunk (ingest không lặp)
+            self.ingest_store = IngestStore(INGEST_STORE_PATH)
+            self.journal = IngestJournal(INGEST_JOURNAL_PATH)
+            # Mỗi lúc chỉ 1 đợt ghi index, kể cả giữa các tiến trình (API / watcher / load_pdfs.py)
+            self.writer_lock = WriterLock(WRITER_LOCK_PATH)
+
+            # Semantic cache cho chat (tắt bằng SEMANTIC_CACHE_ENABLED=0)
+            if os.getenv("SEMANTIC_CACHE_ENABLED", "1") != "0":
+                self.answer_cache = SemanticCache(
+                    SEMANTIC_CACHE_PATH,
+                    threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92")),
+                    max_entries=int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1000")),
+                    ttl_seconds=int(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
                 )
-                print("✅ Đã load dữ liệu tri thức cũ")
-            except Exception as e:
-                print(f"❌ Lỗi load DB: {e}")
+
+            # Ghép context trong budget token: nối chunk chồng nhau, bỏ chunk trùng (tắt bằng CONTEXT_PACKING_ENABLED=0)
+            if os.getenv("CONTEXT_PACKING_ENABLED", "1") != "0":
+                self.context_packer = ContextPacker(
+                    token_budget=int(os.getenv("CONTEXT_TOKEN_BUDGET", "2000")),
+                    fetch_k=int(os.getenv("CONTEXT_FETCH_K", "5")),
+                    dedup_threshold=float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.85"))
+                )
+
+        with self._phase("case_index"):
+            # Chỉ mục ca bệnh tương tự trên lịch sử khám (tắt bằng CASE_INDEX_ENABLED=0)
+            if self.remote:
+                self.case_index = RemoteCaseIndex(self.remote) if info["case_index"] else None
+            elif os.getenv("CASE_INDEX_ENABLED", "1") != "0":
+                self.case_index = CaseIndex(CASE_INDEX_PATH, self.embeddings, batch_size=EMBED_BATCH_SIZE)
+
+        with self._phase("llm"):
+            # 2. Khởi tạo LLM với Gemini 2.5 Flash
+            self.llm = ChatGoogleGenerativeAI(
+                model="gemini-2.5-flash",
+                temperature=0.3,
+                google_api_key=os.getenv("GOOGLE_API_KEY")
+            )
+
+        # 3. Load bộ nhớ cũ nếu đã từng học (chế độ retrieval server: server đã load)
+        if self.remote:
+            self.remote.on_version_change = self._sync_cache_version
         else:
-            print("📚 Chưa có dữ liệu tri thức - Đang tự động load PDF...")
-            self._auto_load_pdfs()
+            with self._phase("vector_db"):
+                self._load_db()
+                self._check_embedding_dim()
+            if not SegmentStore.exists(STORE_PATH) and not os.path.exists(os.path.join(VECTOR_DB_PATH, INDEX_NAME)):
+                with self._phase("auto_ingest"):
+                    print("📚 Chưa có dữ liệu tri thức - Đang tự động load PDF...")
+                    self._auto_load_pdfs()
+        self._sync_cache_version()
+
+    def _check_embedding_dim(self, store=None):
+        """Đổi backend/model embedding mà khác số chiều với index đã có -> dừng luôn, không tìm kiếm sai"""
+        store = self.vector_db if store is None else store
+        if store is None or store.dim is None:
+            return
+        dim = len(self.embeddings.embed_query("kiểm tra số chiều"))
+        if dim != store.dim:
+            raise ValueError(
+                f"Embedding {self.embedding_params['backend']}/{self.embedding_params['model']} có {dim} chiều "
+                f"nhưng index đã có {store.dim} chiều - đổi lại EMBEDDING_MODEL hoặc học lại tài liệu"
+            )
+
+    def _corpus_version(self):
+        """Version của kho tri thức (số chunk + thời điểm commit gần nhất)"""
+        return self.vector_db.version() if self.vector_db else "empty"
+
+    def _sync_cache_version(self):
+        """Tri thức thay đổi thì semantic cache tự vô hiệu"""
+        if self.answer_cache:
+            self.answer_cache.set_corpus_version(self._corpus_version())
+
+    def _load_db(self):
+        """
+        Hàm load Vector DB từ ổ cứng
+        Index được mmap, nội dung chunk chỉ đọc khi trúng kết quả -> khởi động nhanh, ít RAM
+        Mỗi tài liệu 1 segment (segment_store.py); kho 1 khối cũ tự chia segment lúc load
+        """
+        legacy_path = os.path.join(VECTOR_DB_PATH, INDEX_NAME)
+        try:
+            if SegmentStore.exists(STORE_PATH):
+                self.vector_db = self._open_store()
+                mode = "mmap" if self.vector_db.mmapped else "RAM"
+                print(f"✅ Đã load dữ liệu tri thức cũ ({self.vector_db.count} đoạn, "
+                      f"{len(self.vector_db.segments)} tài liệu, index: {mode})")
+            elif os.path.exists(legacy_path):
+                with self.writer_lock:
+                    if not SegmentStore.exists(STORE_PATH):
+                        print("🔄 Đang chuyển index cũ (tcm_index) sang định dạng mmap...")
+                        migrate_langchain_index(legacy_path, STORE_PATH, self.embeddings)
+                    self.vector_db = self._open_store()
+                print(f"✅ Đã chuyển {self.vector_db.count} đoạn sang {STORE_PATH}")
+        except Exception as e:
+            print(f"❌ Lỗi load DB: {e}")
+        self._manifest_mtime = self._stat_manifest()
+
+        # Lần ingest trước bị dừng giữa chừng -> replay nhật ký rồi commit
+        # (tiến trình khác đang giữ khóa ghi thì nhật ký là của nó, không đụng vào)
+        if self.journal.exists() and self.writer_lock.acquire(blocking=False):
+            try:
+                self.reload_snapshot()
+                if self.journal.exists():
+                    self._replay_journal()
+            finally:
+                self.writer_lock.release()
+
+    def _open_store(self, previous=None):
+        if SegmentStore.exists(STORE_PATH):
+            return SegmentStore.load(STORE_PATH, VECTOR_DB_MMAP, self.index_params, SEGMENT_COMPACTION_DELAY,
+                                     writer_lock=self.writer_lock, previous=previous)
+        return SegmentStore(STORE_PATH, VECTOR_DB_MMAP, self.index_params, SEGMENT_COMPACTION_DELAY,
+                            writer_lock=self.writer_lock)
+
+    @staticmethod
+    def _stat_manifest():
+        try:
+            return os.stat(os.path.join(STORE_PATH, MANIFEST_FILE)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def reload_snapshot(self) -> bool:
+        """
+        Tiến trình khác vừa publish snapshot mới (manifest.json đổi version) -> load snapshot mới
+        (segment không đổi được dùng lại) rồi đổi tham chiếu self.vector_db (read-copy-update):
+        câu hỏi đang chạy vẫn tìm trên snapshot cũ tới khi xong, không phải chờ khóa nào
+        Trả về True nếu đã đổi sang snapshot mới
+        """
+        if self.remote:
+            return False  # retrieval server tự nạp snapshot mới
+        mtime = self._stat_manifest()
+        if mtime is None or mtime == self._manifest_mtime:
+            return False
+        with self._reload_lock:
+            mtime = self._stat_manifest()
+            if mtime == self._manifest_mtime:
+                return False
+            current = self.vector_db
+            if current is not None and current.building:
+                return False  # tiến trình này đang ghi: nó chính là tác giả của manifest
+            version = SegmentStore.published_version(STORE_PATH)
+            if current is not None and version == current.version_no:
+                self._manifest_mtime = mtime  # chỉ compaction dọn tombstone, tập tài liệu không đổi
+                return False
+
+            started = time.perf_counter()
+            snapshot = self._open_store(previous=current)
+            if current is None or current.dim != snapshot.dim:
+                self._check_embedding_dim(snapshot)
+            self.vector_db = snapshot
+            self._manifest_mtime = mtime
+            self.snapshot_reloads += 1
+        self._sync_cache_version()
+        print(f"🔄 Đã nạp snapshot kho tri thức v{snapshot.version_no} ({snapshot.count} đoạn, "
+              f"{len(snapshot.segments)} tài liệu) trong {time.perf_counter() - started:.2f}s")
+        return True
+
+    def start_snapshot_watch(self, interval: float = VECTOR_DB_RELOAD_INTERVAL):
+        """Luồng nền kiểm tra snapshot mới mỗi interval giây (API server gọi lúc khởi động)"""
+        if self.remote or interval <= 0 or self._snapshot_thread is not None:
+            return
+
+        def watch():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.reload_snapshot()
+                except Exception as e:
+                    print(f"⚠️ Không nạp được snapshot mới: {e}")
+
+        self._snapshot_thread = threading.Thread(target=watch, name="snapshot-watch", daemon=True)
+        self._snapshot_thread.start()
+
+    @contextmanager
+    def _writing(self):
+        """Giữ khóa ghi (chờ tiến trình khác ghi xong), rồi ghi tiếp trên snapshot mới nhất"""
+        with self.writer_lock:
+            self.reload_snapshot()
+            try:
+                yield
+            finally:
+                self._manifest_mtime = self._stat_manifest()  # manifest do chính tiến trình này ghi
+
+    def _replay_journal(self):
+        """Đưa các lô chunk trong nhật ký (chưa kịp commit) vào index, commit 1 lần"""
+        print("♻️ Phát hiện nhật ký ingest dang dở - đang khôi phục...")
+        records = self.journal.read()
+        pending = {"ids": [], "texts": [], "metadatas": []}
+        files = []
+        for record in records:
+            if record["type"] == "chunks":
+                for chunk_id, text, metadata in zip(record["ids"], record["texts"], record["metadatas"]):
+                    if not self._is_indexed(chunk_id, document_name(metadata)):
+                        pending["ids"].append(chunk_id)
+                        pending["texts"].append(text)
+                        pending["metadatas"].append(metadata)
+            elif record["type"] == "file":
+                files.append(record)
+
+        if pending["ids"]:
+            vectors = self._embed(pending["ids"], pending["texts"])[0]
+            self._index_chunks(pending["ids"], pending["texts"], pending["metadatas"], vectors)
+            self._commit()
+        for record in files:
+            self.ingest_store.record_file(record["file_hash"], record["filename"], record["num_chunks"])
+
+        self.journal.clear()
+        print(f"✅ Đã khôi phục {len(pending['ids'])} đoạn, {len(files)} file từ nhật ký")
     
+    def _list_pdfs(self, pdf_dir: str):
+        return [os.path.join(pdf_dir, f) for f in os.listdir(pdf_dir) if f.endswith('.pdf')]
+
     def _auto_load_pdfs(self):
         """Tự động load tất cả PDF có sẵn vào vector database"""
         pdf_dir = os.path.join(BASE_DIR, "storage", "pdfs")
@@ -63,93 +361,311 @@ class RAGService:
             print("❌ Không tìm thấy thư mục storage/pdfs")
             return
         
-        pdf_files = [f for f in os.listdir(pdf_dir) if f.endswith('.pdf')]
+        pdf_files = self._list_pdfs(pdf_dir)
         if not pdf_files:
             print("📁 Không có file PDF nào trong storage/pdfs")
             return
         
         print(f"🔍 Tìm thấy {len(pdf_files)} file PDF, đang tự động nạp...")
-        total_chunks = 0
-        for pdf_file in pdf_files:
-            pdf_path = os.path.join(pdf_dir, pdf_file)
-            try:
-                chunks = self.ingest_pdf(pdf_path)
-                total_chunks += chunks
-                print(f"  ✅ {pdf_file}: {chunks} chunks")
-            except Exception as e:
-                print(f"  ❌ {pdf_file}: Lỗi - {str(e)}")
-        
-        print(f"🎉 Đã auto-load {total_chunks} chunks từ {len(pdf_files)} PDFs!")
+        report = self.ingest_pdfs(pdf_files)  # parse song song theo INGEST_WORKERS
+        print(f"🎉 Đã auto-load {report['chunks_added']} chunks từ {len(pdf_files)} PDFs!")
 
-    def ingest_pdf(self, file_path: str):
+    def _is_indexed(self, chunk_hash: str, document: str) -> bool:
+        return self.vector_db is not None and self.vector_db.has_chunk(chunk_hash, document)
+
+    def _dedupe_chunks(self, chunks):
         """
-        Hàm đọc file PDF và nạp vào bộ nhớ
-        Sử dụng PyPDFLoader đơn giản và ổn định
+        Bỏ chunk trùng nội dung trong cùng tài liệu (trong lô hoặc đã có trong segment đang học);
+        trả về (ids, texts, metadatas). Chunk trùng giữa 2 tài liệu vẫn giữ ở cả 2 segment
+        (không embedding lại - vector lấy từ kho embedding) để xóa 1 tài liệu không làm hụt tài liệu kia
         """
-        print(f"📖 Đang xử lý file: {file_path}")
-        
+        texts, metadatas, ids = [], [], []
+        seen = set()
+        for chunk in chunks:
+            chunk_hash = hash_chunk(chunk.page_content)
+            key = (document_name(chunk.metadata), chunk_hash)
+            if key in seen or self._is_indexed(chunk_hash, key[0]):
+                continue
+            seen.add(key)
+            texts.append(chunk.page_content)
+            metadatas.append(chunk.metadata)
+            ids.append(chunk_hash)
+        return ids, texts, metadatas
+
+    def _embed(self, ids, texts):
+        """
+        Lấy vector theo hash chunk: có trong kho thì dùng lại, chưa có thì embedding cả lô 1 lần
+        Trả về (danh sách vector theo đúng thứ tự ids, số chunk phải embedding, số byte đã ghi)
+        """
+        vectors = self.ingest_store.get_embeddings(ids)
+        missing = [i for i, chunk_hash in enumerate(ids) if chunk_hash not in vectors]
+        bytes_written = 0
+        if missing:
+            with metrics.span("ingest", "embed"):
+                new_vectors = self.embeddings.embed_documents([texts[i] for i in missing])
+            new_vectors = {ids[i]: vector for i, vector in zip(missing, new_vectors)}
+            with metrics.span("ingest", "persist"):
+                self.ingest_store.put_embeddings(new_vectors)
+            vectors.update(new_vectors)
+            bytes_written = sum(len(v) * 4 for v in new_vectors.values())
+        return [vectors[chunk_hash] for chunk_hash in ids], len(missing), bytes_written
+
+    def _index_chunks(self, ids, texts, metadatas, vectors):
+        """Thêm chunk (đã có vector) vào segment đang học của tài liệu - chưa ghi xuống ổ cứng"""
+        if self.vector_db is None:
+            self.vector_db = self._open_store()
+        self.vector_db.add(ids, texts, metadatas, vectors)
+
+    def _commit(self):
+        """
+        Ghi các segment mới xuống ổ cứng + manifest (1 lần cho cả đợt ingest); trả về số byte đã ghi
+        Segment đủ lớn tự chuyển sang VECTOR_INDEX_TYPE; tài liệu học lại thì bản cũ thành tombstone
+        """
+        replaced = self.vector_db.pending_replacements()
+        bytes_written = self.vector_db.save()
+        for document in replaced:
+            # Bản cũ không còn trong kho -> upload lại đúng nội dung cũ phải được học lại
+            self.ingest_store.forget_document(document)
+            print(f"♻️ Đã thay tài liệu {document} (bản cũ sẽ được dọn nền)")
+        self._sync_cache_version()
+        return bytes_written
+
+    def documents(self):
+        """Danh sách tài liệu đã học (mỗi tài liệu 1 segment)"""
+        return self.vector_db.documents() if self.vector_db else []
+
+    def delete_document(self, document: str):
+        """
+        Xóa 1 tài liệu khỏi kho tri thức: segment thành tombstone (ngừng tìm kiếm ngay), dọn nền sau
+        Trả về số chunk đã bỏ, None nếu không có tài liệu này
+        """
+        if self.remote:
+            return self.remote.call("delete_document", document)
+        with self._writing():
+            if self.vector_db is None:
+                return None
+            removed = self.vector_db.delete_document(document)
+            if removed is None:
+                return None
+            self.ingest_store.forget_document(os.path.basename(document))
+            self._sync_cache_version()
+        print(f"🗑️ Đã xóa tài liệu {document} ({removed} đoạn)")
+        return removed
+
+    def _new_report(self, num_files: int):
+        return {
+            "files": num_files, "files_ingested": 0, "files_skipped": 0, "files_failed": 0,
+            "pages": 0, "chunks": 0, "chunks_processed": 0, "chunks_added": 0, "chunks_embedded": 0,
+            "bytes_written": 0, "ocr_pages": 0, "ocr_cache_hits": 0,
+        }
+
+    def _known_file(self, file_path: str, report):
+        """Hash file; trả về None nếu nội dung đã học (hoặc không đọc được) -> bỏ qua"""
         try:
-            # Dùng PyPDFLoader - đơn giản, ổn định
-            loader = PyPDFLoader(file_path)
-            docs = loader.load()
-            
-            if not docs or len(docs) == 0:
-                print("❌ Không thể đọc nội dung PDF")
-                return 0
-            
-            print(f"📄 Đã đọc {len(docs)} trang từ PDF")
-            
-            # DEBUG: Check if docs have actual text content
-            total_text_length = sum(len(doc.page_content.strip()) for doc in docs)
-            print(f"🔍 DEBUG: Tổng độ dài text: {total_text_length} ký tự")
-            
-            if total_text_length < 10:
-                print("⚠️ PDF có thể là scan/image, không có text layer. Cần OCR!")
-                return 0
-            
-            # Cắt nhỏ văn bản (Chunking)
-            splitter = RecursiveCharacterTextSplitter(
-                chunk_size=1000, 
-                chunk_overlap=200
+            file_hash = hash_file(file_path)
+        except OSError as e:
+            print(f"❌ Không đọc được file {file_path}: {e}")
+            report["files_failed"] += 1
+            return None
+        known = self.ingest_store.get_file(file_hash)
+        if known:
+            print(f"⏭️ {os.path.basename(file_path)}: nội dung không đổi (đã học {known['num_chunks']} đoạn từ {known['filename']}), bỏ qua")
+            report["files_skipped"] += 1
+            return None
+        return file_hash
+
+    def _ingest_batch(self, chunks, report):
+        """Chống trùng -> embedding -> ghi nhật ký -> thêm vào index (tìm kiếm được ngay) -> spill xuống ổ cứng"""
+        ids, texts, metadatas = self._dedupe_chunks(chunks)
+        if ids:
+            vectors, embedded, bytes_written = self._embed(ids, texts)
+            with metrics.span("ingest", "persist"):
+                self.journal.append_chunks(ids, texts, metadatas)
+            with metrics.span("ingest", "index"):
+                self._index_chunks(ids, texts, metadatas, vectors)
+                # Nội dung chunk xuống ổ cứng ngay, RAM chỉ giữ cỡ 1 lô
+                bytes_written += self.vector_db.spill()
+            report["chunks_embedded"] += embedded
+            report["bytes_written"] += bytes_written
+        report["chunks_added"] += len(ids)
+        report["chunks_processed"] += len(chunks)
+
+    def _finish_ingest(self, report, started: float):
+        """Commit index 1 lần, ghi manifest các file đã xong, xóa nhật ký, tính tốc độ"""
+        if report["chunks_added"]:
+            with metrics.span("ingest", "persist"):
+                report["bytes_written"] += self._commit()
+        report["bytes_written"] += self.journal.bytes_written
+
+        # Commit xong mới ghi manifest và xóa nhật ký
+        for record in self.journal.read() if self.journal.exists() else []:
+            if record["type"] == "file":
+                self.ingest_store.record_file(record["file_hash"], record["filename"], record["num_chunks"])
+        self.journal.clear()
+
+        elapsed = time.perf_counter() - started
+        report["seconds"] = round(elapsed, 3)
+        report["pages_per_sec"] = round(report["pages"] / elapsed, 2) if elapsed else 0.0
+        report["chunks_per_sec"] = round(report["chunks"] / elapsed, 2) if elapsed else 0.0
+        ocr_total = report["ocr_pages"] + report["ocr_cache_hits"]
+        report["ocr_pages_per_sec"] = round(report["ocr_pages"] / elapsed, 2) if elapsed else 0.0
+        report["ocr_cache_hit_rate"] = round(report["ocr_cache_hits"] / ocr_total, 4) if ocr_total else 0.0
+        if ocr_total:
+            print(
+                f"🔎 OCR: {report['ocr_pages']} trang OCR ({report['ocr_pages_per_sec']} trang/s), "
+                f"{report['ocr_cache_hits']} trang lấy từ cache (hit rate {report['ocr_cache_hit_rate']:.0%})"
             )
-            chunks = splitter.split_documents(docs)
-            
-            print(f"🔍 DEBUG: Số chunks sau split: {len(chunks) if chunks else 0}")
-            
-            if not chunks or len(chunks) == 0:
-                print("❌ Không có nội dung sau chunking")
-                return 0
-
-            # Lưu vào Vector DB (FAISS)
-            if self.vector_db:
-                self.vector_db.add_documents(chunks)
-            else:
-                self.vector_db = FAISS.from_documents(chunks, self.embeddings)
-                
-            # Lưu xuống ổ cứng
-            if not os.path.exists(VECTOR_DB_PATH):
-                os.makedirs(VECTOR_DB_PATH)
-                
-            self.vector_db.save_local(os.path.join(VECTOR_DB_PATH, INDEX_NAME))
-            print(f"✅ Đã học xong {len(chunks)} đoạn kiến thức")
-            return len(chunks)
-            
+        print(
+            f"📊 Ingest: {report['pages']} trang, {report['chunks_added']}/{report['chunks']} chunk mới "
+            f"({report['chunks_embedded']} embedding) trong {report['seconds']}s | "
+            f"{report['pages_per_sec']} trang/s, {report['chunks_per_sec']} chunk/s, "
+            f"{report['bytes_written'] / (1024 * 1024):.2f} MB đã ghi"
+        )
+        return report
+
+    def ingest_pdfs(self, file_paths, batch_size: int = EMBED_BATCH_SIZE, workers: int = None, progress=None):
+        """
+        Bulk ingest nhiều PDF: gom chunk, embedding theo lô lớn, chỉ commit index 1 lần ở cuối
+        - Parse + chunk chạy song song trên process pool (workers, mặc định INGEST_WORKERS/số CPU)
+        - Embedding chạy ở tiến trình này, tiêu thụ kết quả từ hàng đợi có giới hạn
+        Mỗi lô đã embedding được ghi vào nhật ký append-only -> chết giữa chừng vẫn resume được
+        progress(report): gọi sau mỗi file parse xong và mỗi lô embedding (hàng đợi job hiển thị tiến độ)
+        Trả về báo cáo: số file/trang/chunk, pages/sec, chunks/sec, bytes đã ghi
+        """
+        with self._writing(), metrics.operation("ingest"):
+            started = time.perf_counter()
+            report = self._new_report(len(file_paths))
+            self.journal.bytes_written = 0
+            pending_chunks = []
+            pending_files = []  # (file_hash, filename, số chunk) chờ lô hiện tại ghi xong
+
+            def flush(limit=None):
+                """Xử lý lô đầu tiên (tối đa limit chunk); file chỉ được ghi nhận khi hết chunk chờ"""
+                limit = len(pending_chunks) if limit is None else limit
+                batch = pending_chunks[:limit]
+                del pending_chunks[:limit]
+                self._ingest_batch(batch, report)
+                if not pending_chunks:
+                    for file_hash, filename, num_chunks in pending_files:
+                        self.journal.append_file(file_hash, filename, num_chunks)
+                    pending_files.clear()
+                if progress:
+                    progress(report)
+
+            # File có nội dung không đổi thì bỏ qua ngay, không đưa vào pool
+            file_hashes = {}
+            for file_path in file_paths:
+                file_hash = self._known_file(file_path, report)
+                if file_hash:
+                    file_hashes[file_path] = file_hash
+
+            ocr_files = []  # file có trang scan: OCR theo trang sau khi pool parse xong
+            for file_path, num_pages, chunks, error in iter_parsed(list(file_hashes), workers=workers):
+                filename = os.path.basename(file_path)
+                if chunks is None:
+                    ocr_files.append(file_path)
+                    continue
+                report["pages"] += num_pages
+                if error or not chunks:
+                    if error:
+                        print(f"❌ Lỗi khi xử lý PDF {filename}: {error}")
+                    report["files_failed"] += 1
+                    continue
+
+                print(f"📖 {filename}: {num_pages} trang, {len(chunks)} chunk")
+                report["chunks"] += len(chunks)
+                pending_chunks.extend(chunks)
+                pending_files.append((file_hashes[file_path], filename, len(chunks)))
+                report["files_ingested"] += 1
+                if progress:
+                    progress(report)
+                while len(pending_chunks) >= batch_size:
+                    flush(batch_size)
+
+            flush()
+            for file_path in ocr_files:
+                self._ingest_file_stream(file_path, file_hashes[file_path], report, batch_size, progress)
+            report.pop("pages_total", None)  # chỉ có nghĩa khi ingest 1 file
+            return self._finish_ingest(report, started)
+
+    def ingest_pdf_stream(self, file_path: str, batch_size: int = EMBED_BATCH_SIZE, progress=None):
+        """
+        Ingest 1 PDF kiểu streaming: đọc từng trang (trang scan thì OCR), cắt chunk dần (overlap liền qua ranh giới trang),
+        cứ đủ batch_size chunk là embedding + thêm vào index -> RAM tối đa cỡ 1 lô dù sách dày bao nhiêu,
+        và các chunk đầu đã tìm kiếm được trong lúc phần sau của sách còn đang xử lý.
+        Commit index 1 lần ở cuối; nhật ký giúp resume nếu chết giữa chừng. Báo cáo giống ingest_pdfs
+        """
+        with self._writing(), metrics.operation("ingest"):
+            started = time.perf_counter()
+            report = self._new_report(1)
+            self.journal.bytes_written = 0
+            file_hash = self._known_file(file_path, report)
+            if not file_hash:
+                return self._finish_ingest(report, started)
+
+            self._ingest_file_stream(file_path, file_hash, report, batch_size, progress)
+            return self._finish_ingest(report, started)
+
+    def _ingest_file_stream(self, file_path: str, file_hash: str, report, batch_size: int, progress=None):
+        """Đọc 1 file từng trang (OCR trang scan), embedding theo lô batch_size; cộng dồn vào report"""
+        filename = os.path.basename(file_path)
+        pages_before, chunks_before = report["pages"], report["chunks"]
+        pending_chunks = []
+        try:
+            for pages, total_pages, chunks in iter_page_chunks(file_path, ocr_cache=self.ingest_store, ocr_stats=report):
+                report["pages"] = pages_before + pages
+                if total_pages:
+                    report["pages_total"] = pages_before + total_pages
+                report["chunks"] += len(chunks)
+                pending_chunks.extend(chunks)
+                while len(pending_chunks) >= batch_size:
+                    self._ingest_batch(pending_chunks[:batch_size], report)
+                    del pending_chunks[:batch_size]
+                if progress:
+                    progress(report)  # sau mỗi trang (trang OCR chậm, lô đầy lâu)
+            if pending_chunks:
+                self._ingest_batch(pending_chunks, report)
         except Exception as e:
-            print(f"❌ Lỗi khi xử lý PDF: {e}")
-            return 0
+            # Các lô đã thêm vẫn được commit, file không được ghi nhận -> lần sau học lại (chunk trùng tự bỏ qua)
+            print(f"❌ Lỗi khi xử lý PDF {filename}: {e}")
+            report["files_failed"] += 1
+            return
+
+        num_chunks = report["chunks"] - chunks_before
+        if num_chunks:
+            print(f"📖 {filename}: {report['pages'] - pages_before} trang, {num_chunks} chunk")
+            self.journal.append_file(file_hash, filename, num_chunks)
+            report["files_ingested"] += 1
+        else:
+            print(f"⚠️ {filename}: không có text layer (PDF scan?). Cần OCR (cài Tesseract + tesseract-ocr-vie)!")
+            report["files_failed"] += 1
+        if progress:
+            progress(report)
 
-    def ask(self, symptoms: str, use_vision: bool = False):
+    def ingest_pdf(self, file_path: str):
         """
-        Hàm chẩn đoán bệnh
-        
-        Args:
-            symptoms: Triệu chứng của bệnh nhân
-            use_vision: Có sử dụng vision model không (cho ảnh)
+        Hàm đọc file PDF và nạp vào bộ nhớ
+        File đã học (cùng nội dung) sẽ được bỏ qua, chunk trùng không vào index 2 lần
+        Trả về số đoạn kiến thức mới
         """
-        if not self.vector_db:
-            return "Xin lỗi, tôi chưa được học tài liệu nào cả. Vui lòng upload sách PDF trước."
+        if INGEST_STREAMING:
+            report = self.ingest_pdf_stream(file_path)
+        else:
+            report = self.ingest_pdfs([file_path])
+        print(f"✅ Đã học xong {report['chunks_added']} đoạn kiến thức")
+        return report["chunks_added"]
 
-        # 2. Tạo Prompt (Nhân cách bác sĩ Đông Y)
+    def _ask_chain(self, with_cases: bool = False):
+        """
+        Tạo chain chẩn đoán: Prompt (nhân cách bác sĩ Đông Y) + Gemini + tài liệu tìm được
+        with_cases: thêm mục ca bệnh tương tự đã điều trị tại phòng khám (biến {cases})
+        """
+        cases_section = """
+            <Ca bệnh tương tự đã điều trị tại phòng khám>
+            {cases}
+            </Ca bệnh tương tự đã điều trị tại phòng khám>
+            Các ca trên chỉ để tham khảo kinh nghiệm điều trị, chẩn đoán vẫn phải dựa trên y văn.
+            """ if with_cases else ""
         prompt = ChatPromptTemplate.from_template("""
             Bạn là một Bác sĩ Đông Y (Lương y) thâm niên, uy tín và tận tâm.
             Nhiệm vụ của bạn là hỗ trợ chẩn đoán dựa trên tài liệu y văn được cung cấp dưới đây.
@@ -157,7 +673,7 @@ class RAGService:
             <Tài liệu tham khảo>
             {context}
             </Tài liệu tham khảo>
-            
+            """ + cases_section + """
             Bệnh nhân mô tả triệu chứng: "{input}"
             
             Hãy đưa ra câu trả lời chi tiết theo cấu trúc sau:
@@ -168,38 +684,137 @@ class RAGService:
 
             Nếu tài liệu không có thông tin về triệu chứng này, hãy nói trung thực: "Xin lỗi, trong các sách tôi đã học chưa có thông tin về triệu chứng này."
         """)
+        return create_stuff_documents_chain(self.llm, prompt)
 
-        # 3. Tạo chuỗi xử lý (Chain)
-        # Retriever tìm 5 đoạn văn bản giống nhất trong sách
-        retriever = self.vector_db.as_retriever(search_kwargs={"k": 5})
-        
-        # Kết hợp LLM + Prompt + Retriever
-        chain = create_retrieval_chain(
-            retriever, 
-            create_stuff_documents_chain(self.llm, prompt)
+    def _search_k(self, k: int) -> int:
+        """Số chunk lấy từ FAISS: nhiều hơn k khi có ContextPacker để lấp đầy budget token"""
+        return self.context_packer.search_k(k) if self.context_packer else k
+
+    def _pack_context(self, candidates, k: int, operation: str):
+        """
+        Ghép context từ các chunk tìm được (theo thứ tự liên quan)
+        Trả về (danh sách Document gửi cho Gemini, thống kê token hoặc None nếu tắt ghép)
+        """
+        if self.context_packer is None:
+            return candidates[:k], None
+        with metrics.span(operation, "pack"):
+            docs, stats = self.context_packer.pack(candidates, k)
+        metrics.observe_context(operation, stats)
+        print(f"📦 Context: {stats['packed']} token (top-{k} nguyên văn: {stats['baseline']}, tiết kiệm {stats['saved']}), "
+              f"{stats['chunks_used']}/{stats['candidates']} chunk, nối {stats['merged']}, bỏ trùng {stats['duplicates_dropped']}")
+        return docs, stats
+
+    def similar_cases(self, query_vector, k: int, exclude_patient_id: int = None):
+        """Các ca bệnh tương tự trong lịch sử khám (rỗng nếu tắt chỉ mục hoặc k = 0)"""
+        if not self.case_index or k <= 0:
+            return []
+        return self.case_index.search_by_vector(query_vector, k, exclude_patient_id)
+
+    @staticmethod
+    def _format_cases(cases) -> str:
+        return "\n".join(
+            f"- Ca {i} (độ tương đồng {case['score']:.2f}): {case['text']}. "
+            f"Bài thuốc đã dùng: {case['bai_thuoc'] or 'không ghi'}"
+            for i, case in enumerate(cases, 1)
         )
+
+    def _ask_inputs(self, symptoms: str, relevant_docs, cases):
+        """Chọn chain + dữ liệu đầu vào cho chẩn đoán (có/không kèm ca bệnh tương tự)"""
+        inputs = {"input": symptoms, "context": relevant_docs}
+        if cases:
+            inputs["cases"] = self._format_cases(cases)
+        return self._ask_chain(with_cases=bool(cases)), inputs
+
+    def ask(self, symptoms: str, use_vision: bool = False, case_k: int = None, sources=None):
+        """
+        Hàm chẩn đoán bệnh
         
-        # 4. Chạy và trả về kết quả
-        res = chain.invoke({"input": symptoms})
-        return res["answer"]
+        Args:
+            symptoms: Triệu chứng của bệnh nhân
+            use_vision: Có sử dụng vision model không (cho ảnh)
+            case_k: Số ca bệnh tương tự trong lịch sử khám đưa vào prompt (None = CASE_CONTEXT_K)
+            sources: Chỉ tìm trong các tài liệu này (tên file), None = mọi tài liệu
+        """
+        if not self.vector_db:
+            return NO_KNOWLEDGE_ASK_ANSWER
+
+        case_k = CASE_CONTEXT_K if case_k is None else case_k
+        with metrics.operation("ask"):
+            # Tìm 5 đoạn văn bản giống nhất trong sách
+            with metrics.span("ask", "embed"):
+                query_vector = self.embeddings.embed_query(symptoms)
+            with metrics.span("ask", "search"):
+                candidates = self.vector_db.similarity_search_by_vector(query_vector, k=self._search_k(5), sources=sources)
+                # Dùng lại vector câu hỏi cho chỉ mục ca bệnh (không embedding lần 2)
+                cases = self.similar_cases(query_vector, case_k)
+            relevant_docs, _ = self._pack_context(candidates, 5, "ask")
+
+            # Kết hợp LLM + Prompt + tài liệu tìm được, chạy và trả về kết quả
+            chain, inputs = self._ask_inputs(symptoms, relevant_docs, cases)
+            with metrics.span("ask", "llm"):
+                return chain.invoke(inputs)
     
-    def chat(self, user_input: str):
+    def _retrieve(self, user_input: str, k: int = 5, operation: str = "chat", sources=None):
         """
-        Hàm chat với người dùng, tham khảo kiến thức từ Vector DB
-        Trả về câu trả lời + tài liệu tham khảo
+        Embedding câu hỏi 1 lần, dùng chung cho semantic cache và FAISS (chạy đồng bộ)
+        Trả về (cached, relevant_docs, query_vector) - trúng cache thì relevant_docs = None
+        sources: chỉ tìm trong các tài liệu này (không dùng semantic cache vì cache không phân biệt nguồn)
         """
-        if not self.vector_db:
-            return {
-                "answer": "Xin lỗi, tôi chưa được học tài liệu nào. Vui lòng upload PDF trước.",
-                "sources": []
-            }
-        
-        # 1. Tìm kiếm tài liệu liên quan
-        retriever = self.vector_db.as_retriever(search_kwargs={"k": 5})
-        relevant_docs = retriever.invoke(user_input)  # Updated method
-        context = "\n\n".join([doc.page_content for doc in relevant_docs])
-        
-        # 2. Tạo prompt
+        with metrics.span(operation, "embed"):
+            query_vector = self.embeddings.embed_query(user_input)
+        if self.answer_cache and sources is None:
+            with metrics.span(operation, "cache"):
+                cached = self.answer_cache.lookup(query_vector)
+            if cached:
+                print(f"⚡ Trúng semantic cache (similarity={cached['similarity']:.3f})")
+                return cached, None, query_vector
+
+        with metrics.span(operation, "search"):
+            relevant_docs = self.vector_db.similarity_search_by_vector(query_vector, k=self._search_k(k), sources=sources)
+        return None, relevant_docs, query_vector
+
+    def _retrieve_batch(self, questions, k: int = 5, use_cache: bool = True, sources=None, case_k: int = 0):
+        """
+        Phiên bản nhiều câu hỏi của _retrieve: embedding tất cả trong 1 lần forward,
+        tra semantic cache từng câu, rồi 1 lần FAISS search cho các câu chưa có trong cache.
+        Trả về list (cached, relevant_docs, query_vector, thống kê token context, ca bệnh tương tự)
+        theo đúng thứ tự câu hỏi; relevant_docs đã được ghép context (_pack_context)
+        case_k > 0: tìm luôn ca bệnh tương tự ở đây (đang trong threadpool, không chặn event loop)
+        """
+        with metrics.span("batch", "embed"):
+            query_vectors = self.embeddings.embed_documents(list(questions))
+        results = [None] * len(questions)
+        misses = []
+        with metrics.span("batch", "cache"):
+            for i, query_vector in enumerate(query_vectors):
+                cached = self.answer_cache.lookup(query_vector) \
+                    if (use_cache and self.answer_cache and sources is None) else None
+                if cached:
+                    results[i] = (cached, None, query_vector, None, [])
+                else:
+                    misses.append(i)
+
+        if misses:
+            with metrics.span("batch", "search"):
+                docs_per_query = self.vector_db.similarity_search_batch_by_vectors(
+                    [query_vectors[i] for i in misses], k=self._search_k(k), sources=sources
+                )
+                cases_per_query = [self.similar_cases(query_vectors[i], case_k) for i in misses]
+            for i, candidates, cases in zip(misses, docs_per_query, cases_per_query):
+                relevant_docs, context_stats = self._pack_context(candidates, k, "batch")
+                results[i] = (None, relevant_docs, query_vectors[i], context_stats, cases)
+        return results
+
+    def _remember(self, user_input: str, query_vector, answer: str, sources, version: str):
+        """
+        Lưu câu trả lời vừa sinh vào semantic cache
+        version: _corpus_version() lúc retrieval - tri thức đổi trong lúc Gemini đang trả lời thì không lưu
+        """
+        if self.answer_cache and answer:
+            self.answer_cache.put(user_input, query_vector, answer, sources, version=version)
+
+    def _chat_chain(self, context: str):
+        """Tạo chain Prompt -> Gemini -> String cho chế độ chat"""
         prompt = ChatPromptTemplate.from_template("""
             Bạn là Bác sĩ Đông Y chuyên nghiệp với kiến thức sâu rộng.
             
@@ -216,28 +831,187 @@ class RAGService:
             
             Nếu tài liệu HOÀN TOÀN không liên quan đến câu hỏi, hãy nói: "Xin lỗi, tôi chưa có thông tin về vấn đề này trong tài liệu."
         """)
-        
-        # 3. Chain
-        chain = (
+
+        return (
             {"context": lambda x: context, "input": lambda x: x}
             | prompt
             | self.llm
             | StrOutputParser()
         )
-        
-        answer = chain.invoke(user_input)
-        
-        # 4. Extract sources from metadata
+
+    @staticmethod
+    def _extract_sources(docs):
+        """Lấy danh sách tên file nguồn (không trùng) từ metadata"""
         sources = []
-        for doc in relevant_docs:
+        for doc in docs:
             if hasattr(doc, 'metadata') and 'source' in doc.metadata:
                 source_path = doc.metadata['source']
                 # Get filename from path
                 filename = os.path.basename(source_path)
                 if filename not in sources:
                     sources.append(filename)
+        return sources
+
+    def chat(self, user_input: str, sources=None):
+        """
+        Hàm chat với người dùng, tham khảo kiến thức từ Vector DB
+        Trả về câu trả lời + tài liệu tham khảo
+        sources: chỉ tham khảo các tài liệu này (tên file), None = mọi tài liệu
+        """
+        if not self.vector_db:
+            return {
+                "answer": NO_KNOWLEDGE_ANSWER,
+                "sources": []
+            }
         
-        return {
-            "answer": answer,
-            "sources": sources
-        }
\ No newline at end of file
+        with metrics.operation("chat"):
+            # 1. Tìm kiếm tài liệu liên quan (hoặc lấy luôn từ semantic cache)
+            version = self._corpus_version()
+            cached, candidates, query_vector = self._retrieve(user_input, sources=sources)
+            if cached:
+                return {
+                    "answer": cached["answer"],
+                    "sources": cached["sources"],
+                    "context_tokens": None
+                }
+            relevant_docs, context_stats = self._pack_context(candidates, 5, "chat")
+            context = "\n\n".join([doc.page_content for doc in relevant_docs])
+
+            # 2. Prompt + Chain
+            with metrics.span("chat", "llm"):
+                answer = self._chat_chain(context).invoke(user_input)
+
+            # 3. Extract sources from metadata
+            doc_sources = self._extract_sources(relevant_docs)
+            if sources is None:
+                with metrics.span("chat", "persist"):
+                    self._remember(user_input, query_vector, answer, doc_sources, version)
+            return {
+                "answer": answer,
+                "sources": doc_sources,
+                "context_tokens": context_stats
+            }
+
+    async def astream_chat(self, user_input: str, sources=None):
+        """
+        Phiên bản streaming của chat() - async generator trả về từng sự kiện (dict):
+        - {"type": "sources", "sources": [...], "context_tokens": {...}}  : frame đầu tiên, ngay sau retrieval
+        - {"type": "token", "content": "..."}    : từng đoạn token từ Gemini
+        - {"type": "done"}                       : kết thúc
+
+        Retrieval (embedding + FAISS, code đồng bộ nặng CPU) chạy trong threadpool
+        để không chặn event loop; Gemini được gọi qua astream nên cũng không chặn.
+        """
+        if not self.vector_db:
+            yield {"type": "sources", "sources": []}
+            yield {"type": "token", "content": NO_KNOWLEDGE_ANSWER}
+            yield {"type": "done"}
+            return
+
+        version = self._corpus_version()
+        cached, candidates, query_vector = await run_in_threadpool(
+            self._retrieve, user_input, 5, "chat_stream", sources
+        )
+        if cached:
+            yield {"type": "sources", "sources": cached["sources"], "context_tokens": None}
+            yield {"type": "token", "content": cached["answer"]}
+            yield {"type": "done"}
+            return
+
+        relevant_docs, context_stats = await run_in_threadpool(self._pack_context, candidates, 5, "chat_stream")
+        context = "\n\n".join([doc.page_content for doc in relevant_docs])
+        doc_sources = self._extract_sources(relevant_docs)
+        yield {"type": "sources", "sources": doc_sources, "context_tokens": context_stats}
+
+        parts = []
+        with metrics.span("chat_stream", "llm"):
+            async for chunk in self._chat_chain(context).astream(user_input):
+                if chunk:
+                    parts.append(chunk)
+                    yield {"type": "token", "content": chunk}
+
+        if sources is None:
+            with metrics.span("chat_stream", "persist"):
+                await run_in_threadpool(self._remember, user_input, query_vector, "".join(parts), doc_sources,
+                                        version)
+        yield {"type": "done"}
+
+    async def abatch(self, questions, mode: str = "chat", concurrency: int = None, case_k: int = None,
+                     sources=None):
+        """
+        Xử lý nhiều câu hỏi (chat) / mô tả triệu chứng (ask) trong 1 lần:
+        - Retrieval gộp: 1 lần embedding + 1 lần FAISS search (+ ca bệnh tương tự) cho cả lô (trong threadpool)
+        - Gọi Gemini song song, tối đa `concurrency` lời gọi cùng lúc
+        - Lỗi của từng câu không làm hỏng cả lô: trả về kết quả/lỗi theo từng phần tử
+        - ask: kèm case_k ca bệnh tương tự vào prompt (None = CASE_CONTEXT_K)
+        - sources: chỉ tìm trong các tài liệu này (tên file), None = mọi tài liệu
+        """
+        if mode not in BATCH_MODES:
+            raise ValueError(f"mode phải là một trong {BATCH_MODES}")
+        case_k = (CASE_CONTEXT_K if case_k is None else case_k) if mode == "ask" else 0
+        concurrency = max(1, concurrency or BATCH_LLM_CONCURRENCY)
+        questions = list(questions)
+        results = [
+            {"index": i, "question": q, "status": "success", "answer": None, "sources": [], "error": None,
+             "context_tokens": None}
+            for i, q in enumerate(questions)
+        ]
+
+        def fail(i, message):
+            results[i].update(status="error", error=message)
+
+        valid = [i for i, q in enumerate(questions) if q and q.strip()]
+        for i in set(range(len(questions))) - set(valid):
+            fail(i, "Câu hỏi trống")
+
+        if not self.vector_db:
+            for i in valid:
+                results[i]["answer"] = NO_KNOWLEDGE_ANSWER if mode == "chat" else NO_KNOWLEDGE_ASK_ANSWER
+            return results
+        if not valid:
+            return results
+
+        # Chẩn đoán (ask) không dùng semantic cache, giống ask() đơn lẻ
+        version = self._corpus_version()
+        try:
+            retrieved = await run_in_threadpool(
+                self._retrieve_batch, [questions[i] for i in valid], 5, mode == "chat", sources, case_k
+            )
+        except Exception as e:
+            for i in valid:
+                fail(i, f"Lỗi tìm kiếm tài liệu: {e}")
+            return results
+
+        semaphore = asyncio.Semaphore(concurrency)
+        to_remember = []
+
+        async def answer_one(i, cached, relevant_docs, query_vector, context_stats, cases):
+            if cached:
+                results[i].update(answer=cached["answer"], sources=cached["sources"])
+                return
+            doc_sources = self._extract_sources(relevant_docs)
+            results[i]["context_tokens"] = context_stats
+            try:
+                async with semaphore:
+                    with metrics.span("batch", "llm"):
+                        if mode == "chat":
+                            context = "\n\n".join([doc.page_content for doc in relevant_docs])
+                            answer = await self._chat_chain(context).ainvoke(questions[i])
+                        else:
+                            chain, inputs = self._ask_inputs(questions[i], relevant_docs, cases)
+                            answer = await chain.ainvoke(inputs)
+            except Exception as e:
+                fail(i, f"Lỗi AI: {e}")
+                return
+            results[i].update(answer=answer, sources=doc_sources)
+            if mode == "chat" and sources is None:
+                to_remember.append((questions[i], query_vector, answer, doc_sources, version))
+
+        await asyncio.gather(*[
+            answer_one(i, *item) for i, item in zip(valid, retrieved)
+        ])
+
+        with metrics.span("batch", "persist"):
+            for item in to_remember:
+                await run_in_threadpool(self._remember, *item)
+        return results
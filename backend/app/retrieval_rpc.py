@@ -0,0 +1,461 @@
+"""
+Retrieval server dùng chung cho nhiều API worker (uvicorn --workers N)
+- 1 tiến trình (retrieval_server.py) giữ model embedding, kho vector, chỉ mục ca bệnh, hàng đợi ingest
+  và cache chi tiết bệnh nhân dùng chung (lần vô hiệu ở worker này các worker khác thấy ngay)
+- API worker chỉ giữ LLM client + semantic cache + context packer: RAM gần như không tăng khi thêm worker
+- Giao tiếp qua socket cục bộ (Unix socket / named pipe trên Windows / TCP 127.0.0.1) bằng
+  multiprocessing.connection, xác thực bằng authkey (storage/retrieval.key, tự tạo lần đầu)
+- embed_query của các request đồng thời được gom thành 1 lần embed_documents (QueryBatcher)
+Mỗi phản hồi kèm version kho tri thức -> semantic cache ở worker tự vô hiệu khi tri thức đổi.
+"""
+import os
+import time
+import queue
+import types
+import socket
+import secrets
+import threading
+from concurrent.futures import Future
+from multiprocessing.connection import Listener, Client, AuthenticationError
+
+from langchain_core.embeddings import Embeddings
+
+from app.ingest_jobs import QueueFullError, save_upload
+from app.patient_cache import MemoryBackend
+
+# Thời gian chờ gom thêm query vào 1 lô embedding (ms) và cỡ lô tối đa
+# 0: không chờ, lô tự hình thành từ các query đến trong lúc model đang chạy lô trước
+EMBED_BATCH_WAIT_MS = float(os.getenv("EMBED_BATCH_WAIT_MS", "0"))
+EMBED_BATCH_MAX = int(os.getenv("EMBED_BATCH_MAX", "64"))
+# Worker khởi động trước retrieval server thì chờ tối đa bấy nhiêu giây
+RETRIEVAL_CONNECT_TIMEOUT = float(os.getenv("RETRIEVAL_CONNECT_TIMEOUT", "120"))
+
+
+class RetrievalServerError(Exception):
+    """Retrieval server lỗi hoặc mất kết nối"""
+
+
+# Lỗi phía server được ném lại đúng loại ở worker (API trả 429/400... như chạy 1 tiến trình)
+_REMOTE_ERRORS = {"QueueFullError": QueueFullError, "ValueError": ValueError}
+
+
+def parse_address(address: str):
+    """'127.0.0.1:8765' -> TCP, '\\\\.\\pipe\\tên' -> named pipe (Windows), còn lại là đường dẫn Unix socket"""
+    if address.startswith("\\\\.\\pipe\\"):
+        return address, "AF_PIPE"
+    host, sep, port = address.rpartition(":")
+    if sep and host and port.isdigit():
+        return (host, int(port)), "AF_INET"
+    return os.path.abspath(address), "AF_UNIX"
+
+
+def load_authkey(key_path: str, create: bool = False) -> bytes:
+    """Authkey lấy từ RETRIEVAL_SERVER_AUTHKEY, không có thì từ file key (server tạo lần đầu, quyền 600)"""
+    if os.getenv("RETRIEVAL_SERVER_AUTHKEY"):
+        return os.getenv("RETRIEVAL_SERVER_AUTHKEY").encode("utf-8")
+    if create and not os.path.exists(key_path):
+        os.makedirs(os.path.dirname(key_path), exist_ok=True)
+        fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(secrets.token_hex(32).encode("ascii"))
+    with open(key_path, "rb") as f:
+        return f.read().strip()
+
+
+# ==========================================
+# PHÍA SERVER
+# ==========================================
+
+class QueryBatcher:
+    """
+    Gom embed_query của nhiều request đồng thời thành 1 lần embed_documents
+    Lô sau tự lớn lên khi tải cao (query đến trong lúc model đang chạy lô trước được gom hết),
+    tải thấp thì chỉ chờ thêm tối đa max_wait_ms
+    """
+    def __init__(self, embeddings, max_batch: int = EMBED_BATCH_MAX, max_wait_ms: float = EMBED_BATCH_WAIT_MS):
+        self.embeddings = embeddings
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.batches = 0
+        self.queries = 0
+        self.largest = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="query-batcher", daemon=True)
+        self._thread.start()
+
+    def embed(self, text: str):
+        future = Future()
+        self._queue.put((text, future))
+        return future.result()
+
+    def _collect(self):
+        items = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(items) < self.max_batch:
+            try:
+                items.append(self._queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            try:
+                vectors = self.embeddings.embed_documents([text for text, _ in items])
+            except Exception as e:
+                for _, future in items:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.queries += len(items)
+            self.largest = max(self.largest, len(items))
+            for (_, future), vector in zip(items, vectors):
+                future.set_result(list(vector))
+
+    def stats(self):
+        return {
+            "embed_queries": self.queries,
+            "embed_batches": self.batches,
+            "avg_batch": round(self.queries / self.batches, 2) if self.batches else 0.0,
+            "max_batch": self.largest,
+        }
+
+
+class RetrievalServer:
+    def __init__(self, rag, ingest_jobs, address: str, authkey: bytes):
+        self.rag = rag
+        self.ingest_jobs = ingest_jobs
+        self.address, self.family = parse_address(address)
+        self.authkey = authkey
+        self.batcher = QueryBatcher(rag.embeddings)
+        self.patient_cache = MemoryBackend()  # cache bệnh nhân dùng chung (PATIENT_CACHE_BACKEND=shared)
+        self.started_at = time.time()
+        self.connections = 0
+        self.requests = 0
+        self._listener = None
+        self.handlers = {
+            "info": self._info,
+            "embed_query": self.batcher.embed,
+            "embed_documents": lambda texts: [list(v) for v in rag.embeddings.embed_documents(texts)],
+            "search": self._search,
+            "search_with_score": self._search_with_score,
+            "documents": rag.documents,
+            "store_stats": self._store_stats,
+            "compact": self._compact,
+            "delete_document": rag.delete_document,
+            "case_search_by_vector": lambda *args: rag.case_index.search_by_vector(*args),
+            "case_search": lambda *args: rag.case_index.search(*args),
+            "case_upsert": self._case_upsert,
+            "case_sync_patient": self._case_sync_patient,
+            "case_remove_patient": lambda patient_id: rag.case_index.remove_patient(patient_id),
+            "case_sync": self._case_sync,
+            "case_stats": lambda: rag.case_index.stats(),
+            "jobs_full": ingest_jobs.is_full,
+            "jobs_submit": self._jobs_submit,
+            "jobs_get": ingest_jobs.get,
+            "jobs_list": ingest_jobs.list,
+            "jobs_stats": ingest_jobs.stats,
+            "patient_cache_get": self.patient_cache.get,
+            "patient_cache_set": self.patient_cache.set,
+            "patient_cache_epoch": self.patient_cache.epoch,
+            "patient_cache_delete": self.patient_cache.delete,
+            "patient_cache_clear": self.patient_cache.clear,
+            "patient_cache_stats": self.patient_cache.stats,
+            "server_stats": self.stats,
+        }
+
+    # ---------- Thao tác ----------
+    def _info(self):
+        store = self.rag.vector_db
+        return {"dim": store.dim if store else None, "case_index": self.rag.case_index is not None}
+
+    def _search(self, vectors, k: int, sources=None):
+        store = self.rag.vector_db  # đọc tham chiếu 1 lần: snapshot có thể được đổi giữa chừng
+        if not store:
+            return [[] for _ in vectors]
+        return store.similarity_search_batch_by_vectors(vectors, k=k, sources=sources)
+
+    def _search_with_score(self, vector, k: int, sources=None):
+        store = self.rag.vector_db
+        return store.similarity_search_with_score_by_vector(vector, k, sources) if store else []
+
+    def _store_stats(self):
+        store = self.rag.vector_db
+        stats = store.stats() if store else {"segments": 0, "tombstones": 0, "chunks": 0}
+        return {**stats, "snapshot_reloads": self.rag.snapshot_reloads}
+
+    def _compact(self, force: bool = False):
+        store = self.rag.vector_db
+        return store.compact(force=force) if store else {"segments_removed": 0, "orphans_removed": 0,
+                                                          "bytes_reclaimed": 0}
+
+    def _case_upsert(self, visit_ids, reembed: bool = False):
+        """Worker chỉ gửi ID lượt khám, server đọc lại từ DB (không gửi object ORM qua socket)"""
+        from app.database import SessionLocal
+        from app import models
+        with SessionLocal() as db:
+            visits = db.query(models.LuotKham).filter(models.LuotKham.LuotKhamID.in_(visit_ids)).all()
+            return self.rag.case_index.upsert_visits(visits, reembed)
+
+    def _case_sync_patient(self, patient_id: int):
+        from app.database import SessionLocal
+        with SessionLocal() as db:
+            return self.rag.case_index.sync_patient(db, patient_id)
+
+    def _case_sync(self):
+        from app.database import SessionLocal
+        with SessionLocal() as db:
+            return self.rag.case_index.sync(db)
+
+    def _jobs_submit(self, tmp_path: str, filename: str, file_hash: str):
+        job, coalesced = self.ingest_jobs.submit_file(tmp_path, filename, file_hash)
+        return job.id, coalesced
+
+    def _meta(self):
+        store = self.rag.vector_db
+        return {"version": self.rag._corpus_version(), "count": store.count if store else 0}
+
+    def stats(self):
+        return {
+            "connections": self.connections,
+            "requests": self.requests,
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            **self.batcher.stats(),
+        }
+
+    # ---------- Vòng phục vụ ----------
+    def _remove_stale_socket(self):
+        """Socket còn sót lại từ lần chạy trước bị kill thì xóa; đang có server khác nghe thì dừng"""
+        if self.family != "AF_UNIX" or not os.path.exists(self.address):
+            return
+        probe = socket.socket(socket.AF_UNIX)
+        try:
+            probe.connect(self.address)
+        except OSError:
+            os.remove(self.address)
+            return
+        finally:
+            probe.close()
+        raise RuntimeError(f"Đã có retrieval server khác đang chạy tại {self.address}")
+
+    def bind(self):
+        if self._listener is None:
+            self._remove_stale_socket()
+            self._listener = Listener(self.address, family=self.family, authkey=self.authkey)
+            print(f"🔌 Retrieval server đang nghe tại {self.address}")
+
+    def serve_forever(self):
+        self.bind()
+        while True:
+            try:
+                conn = self._listener.accept()
+            except (AuthenticationError, EOFError, OSError) as e:
+                print(f"⚠️ Từ chối kết nối: {e}")
+                continue
+            self.connections += 1
+            threading.Thread(target=self._serve, args=(conn,), name="retrieval-conn", daemon=True).start()
+
+    def _serve(self, conn):
+        """Mỗi kết nối (1 luồng của 1 worker) 1 luồng: request tuần tự, trả lời theo thứ tự"""
+        with conn:
+            while True:
+                try:
+                    op, args, kwargs = conn.recv()
+                except (EOFError, OSError):
+                    return
+                self.requests += 1
+                try:
+                    handler = self.handlers.get(op)
+                    if handler is None:
+                        raise ValueError(f"Retrieval server không hỗ trợ thao tác {op}")
+                    reply = ("ok", handler(*args, **kwargs), self._meta())
+                except Exception as e:
+                    reply = ("error", {"type": type(e).__name__, "message": str(e)}, self._meta())
+                try:
+                    conn.send(reply)
+                except (EOFError, OSError):
+                    return
+
+    def close(self):
+        if self._listener is not None:
+            self._listener.close()
+
+
+# ==========================================
+# PHÍA API WORKER
+# ==========================================
+
+class RetrievalClient:
+    """Pool kết nối tới retrieval server (mỗi luồng gọi dùng 1 kết nối riêng, dùng lại sau đó)"""
+    def __init__(self, address: str, key_path: str):
+        self.address_text = address
+        self.address, self.family = parse_address(address)
+        self.key_path = key_path
+        self.version = None
+        self.count = 0
+        self.on_version_change = None
+        self._pool = queue.LifoQueue()
+
+    def _connect(self):
+        return Client(self.address, family=self.family, authkey=load_authkey(self.key_path))
+
+    def wait_ready(self, timeout: float = RETRIEVAL_CONNECT_TIMEOUT):
+        """Chờ retrieval server sẵn sàng (worker có thể khởi động trước server); trả về info của server"""
+        deadline = time.monotonic() + timeout
+        waiting = False
+        while True:
+            try:
+                return self.call("info")
+            except (RetrievalServerError, OSError) as e:
+                if time.monotonic() >= deadline:
+                    raise RetrievalServerError(f"Không kết nối được retrieval server {self.address_text}: {e}")
+                if not waiting:
+                    print(f"⏳ Đang chờ retrieval server {self.address_text}...")
+                    waiting = True
+                time.sleep(0.5)
+
+    def call(self, op: str, *args, **kwargs):
+        try:
+            conn, pooled = self._pool.get_nowait(), True
+        except queue.Empty:
+            conn, pooled = self._connect(), False
+        try:
+            conn.send((op, args, kwargs))
+            kind, payload, meta = conn.recv()
+        except (EOFError, OSError) as e:
+            conn.close()
+            if pooled:
+                # Kết nối cũ trong pool đã chết (server restart) -> thử lại 1 lần bằng kết nối mới
+                return self.call(op, *args, **kwargs)
+            raise RetrievalServerError(f"Mất kết nối retrieval server: {e}")
+        self._pool.put(conn)
+        self._update_meta(meta)
+        if kind == "error":
+            raise _REMOTE_ERRORS.get(payload["type"], RetrievalServerError)(payload["message"])
+        return payload
+
+    def _update_meta(self, meta):
+        self.count = meta["count"]
+        if meta["version"] != self.version:
+            self.version = meta["version"]
+            if self.on_version_change:
+                self.on_version_change()
+
+
+class RemoteEmbeddings(Embeddings):
+    """Embedding chạy ở retrieval server (query được gom lô với request của worker khác)"""
+    def __init__(self, client: RetrievalClient):
+        self.client = client
+
+    def embed_documents(self, texts):
+        return self.client.call("embed_documents", list(texts))
+
+    def embed_query(self, text):
+        return self.client.call("embed_query", text)
+
+
+class RemoteVectorStore:
+    """Giao diện tìm kiếm giống SegmentStore, kho thật nằm ở retrieval server"""
+    def __init__(self, client: RetrievalClient, dim: int = None):
+        self.client = client
+        self.dim = dim
+
+    def __bool__(self):
+        if not self.client.count:
+            self.client.call("info")  # kho trống ở lần gọi trước -> hỏi lại (server có thể vừa học xong)
+        return self.client.count > 0
+
+    @property
+    def count(self) -> int:
+        return self.client.count
+
+    def version(self) -> str:
+        return self.client.version or "empty"
+
+    def similarity_search_with_score_by_vector(self, embedding, k: int = 5, sources=None):
+        return self.client.call("search_with_score", list(embedding), k, sources)
+
+    def similarity_search_by_vector(self, embedding, k: int = 5, sources=None):
+        return self.client.call("search", [list(embedding)], k, sources)[0]
+
+    def similarity_search_batch_by_vectors(self, embeddings, k: int = 5, sources=None):
+        if len(embeddings) == 0:
+            return []
+        return self.client.call("search", [list(v) for v in embeddings], k, sources)
+
+    def documents(self):
+        return self.client.call("documents")
+
+    def stats(self):
+        return self.client.call("store_stats")
+
+    def compact(self, force: bool = False):
+        return self.client.call("compact", force)
+
+
+class RemoteCaseIndex:
+    """Chỉ mục ca bệnh ở retrieval server: mọi worker thấy cùng 1 chỉ mục, cập nhật ngay sau khi ghi DB"""
+    def __init__(self, client: RetrievalClient):
+        self.client = client
+
+    @property
+    def count(self) -> int:
+        return self.client.call("case_stats")["cases"]
+
+    def search_by_vector(self, query_vector, k: int = 5, exclude_patient_id: int = None):
+        return self.client.call("case_search_by_vector", list(query_vector), k, exclude_patient_id)
+
+    def search(self, text: str, k: int = 5, exclude_patient_id: int = None):
+        return self.client.call("case_search", text, k, exclude_patient_id)
+
+    def upsert_visits(self, visits, reembed: bool = False):
+        return self.client.call("case_upsert", [visit.LuotKhamID for visit in visits], reembed)
+
+    def sync_patient(self, db, patient_id: int):
+        return self.client.call("case_sync_patient", patient_id)
+
+    def remove_patient(self, patient_id: int):
+        return self.client.call("case_remove_patient", patient_id)
+
+    def sync(self, db):
+        return self.client.call("case_sync")
+
+    def stats(self):
+        return self.client.call("case_stats")
+
+
+class RemoteIngestJobs:
+    """Hàng đợi ingest ở retrieval server: worker chỉ ghi file upload, job/tiến độ tra cứu được từ mọi worker"""
+    def __init__(self, client: RetrievalClient, pdf_dir: str):
+        self.client = client
+        self.pdf_dir = pdf_dir
+
+    def submit_upload(self, fileobj, filename: str):
+        if self.client.call("jobs_full"):
+            raise QueueFullError("Hàng đợi ingest đã đầy, vui lòng thử lại sau")
+        tmp_path, file_hash = save_upload(fileobj, self.pdf_dir)
+        try:
+            job_id, coalesced = self.client.call("jobs_submit", os.path.abspath(tmp_path), filename, file_hash)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return types.SimpleNamespace(id=job_id), coalesced
+
+    def get(self, job_id: str):
+        return self.client.call("jobs_get", job_id)
+
+    def list(self):
+        return self.client.call("jobs_list")
+
+    def stats(self):
+        return self.client.call("jobs_stats")
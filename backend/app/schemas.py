@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional, List
+from pydantic import BaseModel, Field
+from typing import Optional, List, Dict, Literal
 from datetime import date, datetime
 
 # --- SCHEMAS CHO LƯỢT KHÁM ---
@@ -54,4 +54,80 @@ class BenhNhanResponse(BenhNhanBase):
     luot_khams: List[LuotKhamResponse] = []
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+# --- SCHEMAS CHO DANH SÁCH (gọn: chỉ kèm lượt khám mới nhất) ---
+class BenhNhanListItem(BenhNhanBase):
+    ID: int
+    MaBenhNhan: Optional[str] = None
+    NgayTao: datetime
+    SoLuotKham: int = 0
+    LuotKhamMoiNhat: Optional[LuotKhamResponse] = None
+
+    class Config:
+        from_attributes = True
+
+class BenhNhanPage(BaseModel):
+    items: List[BenhNhanListItem]
+    next_cursor: Optional[str] = None  # None = hết dữ liệu
+
+class LuotKhamPage(BaseModel):
+    items: List[LuotKhamResponse]
+    next_cursor: Optional[str] = None
+
+# --- SCHEMAS CHO NHẬP HÀNG LOẠT (CSV / NDJSON) ---
+class LuotKhamImport(LuotKhamCreate):
+    NgayKham: Optional[datetime] = None  # None = thời điểm nhập
+
+class BenhNhanImport(BenhNhanBase):
+    NgayTao: Optional[datetime] = None
+    LuotKham: List[LuotKhamImport] = []
+
+class ImportRowError(BaseModel):
+    line: int  # số dòng trong file (CSV tính cả dòng tiêu đề)
+    CCCD: Optional[str] = None
+    error: str
+
+class ImportReport(BaseModel):
+    rows: int
+    patients_created: int
+    visits_created: int
+    skipped_existing: int  # số dòng có CCCD đã có trong DB và không có lượt khám mới (bỏ qua, không tính là lỗi)
+    visits_skipped_duplicate: int = 0  # lượt khám của bệnh nhân cũ đã có trong DB (trùng NgayKham + nội dung)
+    failed: int
+    errors: List[ImportRowError] = []  # tối đa IMPORT_MAX_ERRORS lỗi đầu tiên
+    dry_run: bool = False
+    seconds: float
+    rows_per_sec: float
+
+# --- SCHEMAS CHO CA BỆNH TƯƠNG TỰ ---
+class SimilarCase(LuotKhamResponse):
+    score: float  # cosine giữa triệu chứng cần tìm và chẩn đoán của lượt khám
+
+class SimilarCasesResponse(BaseModel):
+    items: List[SimilarCase]
+    total_cases: int  # số lượt khám đang có trong chỉ mục
+    seconds: float
+
+# --- SCHEMAS CHO CHAT/CHẨN ĐOÁN HÀNG LOẠT ---
+class ChatBatchRequest(BaseModel):
+    questions: List[str] = Field(..., min_length=1)
+    mode: Literal["chat", "ask"] = "chat"  # chat = hỏi đáp, ask = chẩn đoán theo triệu chứng
+    concurrency: Optional[int] = Field(None, ge=1, le=64)  # None = BATCH_LLM_CONCURRENCY
+    case_k: Optional[int] = Field(None, ge=0, le=10)  # ask: số ca bệnh tương tự đưa vào prompt (None = CASE_CONTEXT_K)
+    sources: Optional[List[str]] = None  # chỉ tìm trong các tài liệu này (tên file PDF), None = mọi tài liệu
+
+class ChatBatchItem(BaseModel):
+    index: int
+    question: str
+    status: Literal["success", "error"]
+    answer: Optional[str] = None
+    sources: List[str] = []
+    error: Optional[str] = None
+    context_tokens: Optional[Dict[str, int]] = None  # baseline/packed/saved... (None = trúng cache)
+
+class ChatBatchResponse(BaseModel):
+    items: List[ChatBatchItem]
+    succeeded: int
+    failed: int
+    seconds: float
@@ -0,0 +1,488 @@
+"""
+Kho vector chia segment theo tài liệu (mỗi file PDF 1 segment) + manifest
+Cấu trúc thư mục (storage/vector_db/tcm_store):
+- segments/seg-<n>/ : 1 VectorStore (index mmap + chunks.bin...) chỉ chứa chunk của 1 tài liệu
+- manifest.json     : điểm commit - danh sách segment đang dùng + tombstone (segment đã xóa, chờ dọn)
+Tài liệu nhận diện theo tên file (metadata "source").
+- Học lại 1 file cùng tên (sách sửa lại) -> segment mới, segment cũ thành tombstone khi commit:
+  chỉ tốn thời gian embedding của đúng cuốn đó (chunk không đổi lấy lại từ kho embedding)
+- Xóa tài liệu -> tombstone trong manifest (ngừng tìm kiếm ngay), thư mục segment được dọn
+  nền sau compaction_delay giây (tiến trình khác có thể còn đang mmap file cũ)
+- Tìm kiếm lọc theo nguồn chỉ quét segment của các tài liệu được chọn, kết quả các segment
+  gộp theo khoảng cách L2 (cùng metric với mọi loại index)
+Định dạng cũ (1 VectorStore cho cả kho) tự chuyển sang segment lúc load, không phải embedding lại.
+Nhiều tiến trình (API, pdf_watcher.py, load_pdfs.py) dùng chung 1 kho:
+- Ghi (ingest/xóa/compaction/convert) giữ writer lock (writer_lock.py), luôn ghi trên manifest mới nhất
+- Mỗi lần ghi manifest là publish 1 snapshot có version; tiến trình đọc load snapshot mới
+  (dùng lại segment đã mở, segment không bao giờ bị sửa sau khi commit) rồi đổi tham chiếu
+"""
+import os
+import glob
+import json
+import time
+import shutil
+import threading
+from contextlib import nullcontext
+
+import numpy as np
+
+from app.vector_store import VectorStore, _write_atomic, META_FILE, CHUNKS_FILE, OFFSETS_FILE, HASHES_FILE
+from app.index_factory import index_params_from_env, index_type_of, min_train_size, convert_index, tune_index, \
+    all_vectors
+
+MANIFEST_FILE = "manifest.json"
+SEGMENTS_DIR = "segments"
+# Thư mục segment không có trong manifest (ingest bị dừng giữa chừng) cũ hơn ngưỡng này thì dọn
+ORPHAN_SECONDS = 3600
+MIGRATE_BATCH_SIZE = 1000
+
+
+def document_name(metadata) -> str:
+    """Tên tài liệu của 1 chunk = tên file nguồn"""
+    return os.path.basename((metadata or {}).get("source") or "") or "unknown"
+
+
+def _dir_bytes(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class SegmentStore:
+    def __init__(self, path: str, use_mmap: bool = True, index_params: dict = None, compaction_delay: int = 60,
+                 writer_lock=None):
+        self.path = path
+        self.writer_lock = writer_lock  # WriterLock dùng chung giữa các tiến trình (None = chỉ 1 tiến trình ghi)
+        self.use_mmap = use_mmap
+        self.index_params = index_params or index_params_from_env()
+        self.compaction_delay = compaction_delay
+        self.dim = None
+        self.version_no = 0     # tăng khi tập tài liệu tìm kiếm được thay đổi
+        self.next_segment = 1
+        self.entries = {}       # segment id -> {"id", "document", "count", "created_at"}
+        self.segments = {}      # segment id -> VectorStore đã commit
+        self.tombstones = []    # [{"id", "document", "count", "deleted_at"}] chờ compaction
+        self.building = {}      # tài liệu -> (segment id, VectorStore) đang ingest, chưa commit
+        self.compactions = 0
+        self.bytes_reclaimed = 0
+        self._lock = threading.RLock()
+        self._compaction_timer = None
+
+    # ---------- Mở / đọc ----------
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.exists(os.path.join(path, MANIFEST_FILE)) or VectorStore.exists(path)
+
+    @classmethod
+    def load(cls, path: str, use_mmap: bool = True, index_params: dict = None, compaction_delay: int = 60,
+             writer_lock=None, previous=None):
+        """
+        Mở snapshot mới nhất của kho
+        previous: snapshot đang dùng -> segment cùng id + cùng generation index thì dùng lại, không mở lại file
+        """
+        store = cls(path, use_mmap, index_params, compaction_delay, writer_lock)
+        if not os.path.exists(os.path.join(path, MANIFEST_FILE)) and VectorStore.exists(path):
+            with writer_lock or nullcontext():
+                # Tiến trình khác có thể vừa chuyển xong trong lúc chờ khóa
+                if not os.path.exists(os.path.join(path, MANIFEST_FILE)):
+                    store._migrate_legacy()
+        if os.path.exists(os.path.join(path, MANIFEST_FILE)) and not store.entries:
+            store._read_manifest(previous)
+            if VectorStore.exists(path):
+                with writer_lock or nullcontext():
+                    store._remove_legacy_files()
+        if store.tombstones:
+            store.schedule_compaction()
+        return store
+
+    @staticmethod
+    def published_version(path: str):
+        """Version của snapshot đang publish trên ổ cứng (None nếu chưa có manifest)"""
+        try:
+            with open(os.path.join(path, MANIFEST_FILE), "r", encoding="utf-8") as f:
+                return json.load(f)["version"]
+        except FileNotFoundError:
+            return None
+
+    def _segment_path(self, segment_id: str) -> str:
+        return os.path.join(self.path, SEGMENTS_DIR, segment_id)
+
+    def _load_manifest(self):
+        with open(os.path.join(self.path, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _read_manifest(self, previous=None):
+        manifest = self._load_manifest()
+        self.dim = manifest["dim"]
+        self.version_no = manifest["version"]
+        self.next_segment = manifest["next_segment"]
+        self.tombstones = manifest["tombstones"]
+        reusable = previous.segments if previous is not None and previous.use_mmap == self.use_mmap else {}
+        for entry in manifest["segments"]:
+            segment_path = self._segment_path(entry["id"])
+            segment = reusable.get(entry["id"])
+            if segment is None or segment.generation != self._segment_generation(segment_path):
+                segment = VectorStore.load(segment_path, use_mmap=self.use_mmap)
+                tune_index(segment.index, self.index_params)
+            self.entries[entry["id"]] = entry
+            self.segments[entry["id"]] = segment
+
+    @staticmethod
+    def _segment_generation(segment_path: str) -> int:
+        """Generation index trong meta.json của segment (convert_index.py đổi index -> generation tăng)"""
+        with open(os.path.join(segment_path, META_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)["generation"]
+
+    def _write_manifest(self, manifest: dict = None) -> int:
+        """Ghi manifest atomically (gọi khi đang giữ lock) = publish snapshot; trả về số byte đã ghi"""
+        if manifest is None:
+            manifest = {
+                "version": self.version_no,
+                "dim": self.dim,
+                "next_segment": self.next_segment,
+                "segments": sorted(self.entries.values(), key=lambda e: e["id"]),
+                "tombstones": self.tombstones,
+            }
+        data = json.dumps(manifest, ensure_ascii=False, indent=1).encode("utf-8")
+        os.makedirs(self.path, exist_ok=True)
+        _write_atomic(os.path.join(self.path, MANIFEST_FILE), data)
+        return len(data)
+
+    def _migrate_legacy(self):
+        """Kho 1 khối cũ -> mỗi tài liệu 1 segment (dùng lại vector trong index, không embedding lại)"""
+        legacy = VectorStore.load(self.path, use_mmap=False)
+        print(f"🔄 Đang chia kho vector cũ ({legacy.count} đoạn) thành segment theo tài liệu...")
+        if index_type_of(legacy.index) == "ivf_pq":
+            print("⚠️ Index cũ là IVF-PQ (đã nén) - vector chuyển sang segment chỉ là xấp xỉ")
+        vectors = all_vectors(legacy.index)
+        batch = []
+
+        def flush():
+            positions = [position for position, _, _, _ in batch]
+            self.add([b[1] for b in batch], [b[2] for b in batch], [b[3] for b in batch], vectors[positions])
+            self.spill()
+            batch.clear()
+
+        for position, (chunk_hash, text, metadata) in enumerate(legacy.iter_records()):
+            batch.append((position, chunk_hash, text, metadata))
+            if len(batch) >= MIGRATE_BATCH_SIZE:
+                flush()
+        if batch:
+            flush()
+        self.save()
+        self._remove_legacy_files()
+        print(f"✅ Đã chia thành {len(self.segments)} segment")
+
+    def _remove_legacy_files(self):
+        """Xóa file của định dạng cũ sau khi manifest đã ghi xong"""
+        legacy_files = [META_FILE, CHUNKS_FILE, OFFSETS_FILE, HASHES_FILE]
+        paths = [os.path.join(self.path, name) for name in legacy_files]
+        paths += glob.glob(os.path.join(self.path, "index.*.faiss"))
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    # ---------- Thông tin ----------
+    @property
+    def count(self) -> int:
+        """Số chunk tìm kiếm được (đã commit + đang ingest)"""
+        with self._lock:
+            return sum(e["count"] for e in self.entries.values()) + \
+                sum(store._total() for _, store in self.building.values())
+
+    @property
+    def mmapped(self) -> bool:
+        return any(segment.mmapped for segment in self.segments.values())
+
+    def documents(self):
+        """Danh sách tài liệu đang tìm kiếm được (+ tài liệu đang học dở)"""
+        with self._lock:
+            items = [
+                {"document": e["document"], "segment": e["id"], "chunks": e["count"],
+                 "created_at": e["created_at"], "status": "ready"}
+                for e in self.entries.values()
+            ]
+            items += [
+                {"document": document, "segment": segment_id, "chunks": store._total(),
+                 "created_at": None, "status": "ingesting"}
+                for document, (segment_id, store) in self.building.items()
+            ]
+        return sorted(items, key=lambda item: item["document"])
+
+    def stats(self):
+        with self._lock:
+            return {
+                "segments": len(self.entries),
+                "tombstones": len(self.tombstones),
+                "chunks": self.count,
+                "version": self.version_no,
+                "compactions": self.compactions,
+                "bytes_reclaimed": self.bytes_reclaimed,
+            }
+
+    def version(self) -> str:
+        """Dấu hiệu thay đổi của kho (dùng cho semantic cache)"""
+        return f"{self.version_no}-{self.count}" if self.entries else "empty"
+
+    def _live_ids(self, document: str):
+        return [segment_id for segment_id, e in self.entries.items() if e["document"] == document]
+
+    # ---------- Tìm kiếm ----------
+    def _targets(self, sources=None):
+        """Các segment cần quét: tất cả, hoặc chỉ segment của các tài liệu trong sources"""
+        wanted = None if sources is None else {os.path.basename(source) for source in sources}
+        with self._lock:
+            targets = [
+                self.segments[segment_id] for segment_id, e in self.entries.items()
+                if wanted is None or e["document"] in wanted
+            ]
+            targets += [
+                store for document, (_, store) in self.building.items()
+                if wanted is None or document in wanted
+            ]
+        return targets
+
+    def _search(self, queries, k: int, sources=None):
+        """Top-k mỗi segment rồi gộp theo khoảng cách; trả về list [(score, segment, vị trí)] theo từng query"""
+        hits = [[] for _ in range(len(queries))]
+        for segment in self._targets(sources):
+            result = segment.search(queries, k)
+            if result is None:
+                continue
+            scores, positions = result
+            for row, (row_scores, row_positions) in enumerate(zip(scores, positions)):
+                hits[row].extend(
+                    (float(score), segment, int(position))
+                    for score, position in zip(row_scores, row_positions) if position >= 0
+                )
+        return [sorted(row, key=lambda hit: hit[0])[:k] for row in hits]
+
+    @staticmethod
+    def _documents_for(hits):
+        """Đọc nội dung các chunk trúng (gom theo segment, giữ thứ tự xếp hạng)"""
+        by_segment = {}
+        for i, (_, segment, position) in enumerate(hits):
+            by_segment.setdefault(id(segment), (segment, []))[1].append((i, position))
+        docs = [None] * len(hits)
+        for segment, items in by_segment.values():
+            for (i, _), doc in zip(items, segment.get_documents([position for _, position in items])):
+                docs[i] = doc
+        return docs
+
+    def similarity_search_with_score_by_vector(self, embedding, k: int = 5, sources=None):
+        hits = self._search(np.asarray(embedding, dtype="float32").reshape(1, -1), k, sources)[0]
+        return list(zip(self._documents_for(hits), [score for score, _, _ in hits]))
+
+    def similarity_search_by_vector(self, embedding, k: int = 5, sources=None):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, sources)]
+
+    def similarity_search_batch_by_vectors(self, embeddings, k: int = 5, sources=None):
+        """Nhiều query: mỗi segment 1 lần index.search cho cả ma trận query"""
+        if len(embeddings) == 0:
+            return []
+        queries = np.ascontiguousarray(embeddings, dtype="float32").reshape(len(embeddings), -1)
+        return [self._documents_for(hits) for hits in self._search(queries, k, sources)]
+
+    # ---------- Ghi (chỉ luồng ingest dùng) ----------
+    def has_chunk(self, chunk_hash: str, document: str) -> bool:
+        """Chống trùng trong segment đang học của tài liệu (không so với tài liệu khác:
+        xóa/thay 1 tài liệu không được làm mất chunk của tài liệu khác)"""
+        with self._lock:
+            building = self.building.get(document)
+        return building is not None and building[1].has_chunk(chunk_hash)
+
+    def _building_segment(self, document: str) -> VectorStore:
+        with self._lock:
+            if document not in self.building:
+                segment_id = f"seg-{self.next_segment:06d}"
+                self.next_segment += 1
+                self.building[document] = (segment_id, VectorStore(self._segment_path(segment_id), self.use_mmap))
+            return self.building[document][1]
+
+    def add(self, ids, texts, metadatas, vectors):
+        """Thêm chunk vào segment đang học của từng tài liệu (tìm kiếm được ngay, bền vững sau save())"""
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        if self.dim is not None and vectors.shape[1] != self.dim:
+            raise ValueError(f"Vector có {vectors.shape[1]} chiều nhưng kho đã có {self.dim} chiều")
+        self.dim = vectors.shape[1]
+        groups = {}
+        for i, metadata in enumerate(metadatas):
+            groups.setdefault(document_name(metadata), []).append(i)
+        for document, rows in groups.items():
+            self._building_segment(document).add(
+                [ids[i] for i in rows], [texts[i] for i in rows], [metadatas[i] for i in rows], vectors[rows]
+            )
+
+    def spill(self) -> int:
+        with self._lock:
+            building = [store for _, store in self.building.values()]
+        return sum(store.spill() for store in building)
+
+    def pending_replacements(self):
+        """Tài liệu đang học mà đã có bản cũ -> bản cũ sẽ thành tombstone khi save()"""
+        with self._lock:
+            return sorted(document for document in self.building if self._live_ids(document))
+
+    def _prepare_index(self, segment: VectorStore):
+        """Segment đủ vector để train thì dùng loại index đã cấu hình (VECTOR_INDEX_TYPE), không thì flat"""
+        target = self.index_params["type"]
+        if target == "flat" or index_type_of(segment.index) != "flat":
+            return
+        if segment.index.ntotal < min_train_size(self.index_params):
+            return
+        print(f"🔧 Chuyển index flat ({segment.index.ntotal} vector) sang {target}...")
+        segment.index = convert_index(segment.index, self.index_params)
+
+    def save(self) -> int:
+        """
+        Commit các segment đang học: ghi từng segment, rồi ghi manifest (điểm commit) -
+        bản cũ của cùng tài liệu thành tombstone. Trả về số byte đã ghi
+        """
+        with self._lock:
+            building = dict(self.building)
+        bytes_written = 0
+        for segment_id, segment in building.values():
+            self._prepare_index(segment)
+            bytes_written += segment.save()
+            tune_index(segment.index, self.index_params)
+
+        with self._lock:
+            replaced = False
+            now = time.time()
+            for document, (segment_id, segment) in building.items():
+                for old_id in self._live_ids(document):
+                    self._tombstone(old_id, now)
+                    replaced = True
+                self.entries[segment_id] = {"id": segment_id, "document": document, "count": segment.count,
+                                            "created_at": now}
+                self.segments[segment_id] = segment
+                del self.building[document]
+            if building or not os.path.exists(os.path.join(self.path, MANIFEST_FILE)):
+                self.version_no += 1
+                bytes_written += self._write_manifest()
+        if replaced:
+            self.schedule_compaction()
+        return bytes_written
+
+    def _tombstone(self, segment_id: str, now: float):
+        entry = self.entries.pop(segment_id)
+        self.segments.pop(segment_id)
+        self.tombstones.append({**entry, "deleted_at": now})
+
+    def delete_document(self, document: str):
+        """Xóa tài liệu khỏi kho (tombstone, ngừng tìm kiếm ngay); trả về số chunk đã bỏ, None nếu không có"""
+        document = os.path.basename(document)
+        with self._lock:
+            segment_ids = self._live_ids(document)
+            if not segment_ids:
+                return None
+            removed = sum(self.entries[segment_id]["count"] for segment_id in segment_ids)
+            now = time.time()
+            for segment_id in segment_ids:
+                self._tombstone(segment_id, now)
+            self.version_no += 1
+            self._write_manifest()
+        self.schedule_compaction()
+        return removed
+
+    def convert(self, params: dict):
+        """
+        Chuyển index của mọi segment đủ lớn sang loại trong params (convert_index.py, đang giữ writer lock)
+        Publish version mới để API đang chạy nạp lại các segment đã đổi index
+        """
+        self.index_params = params
+        converted = 0
+        for segment in list(self.segments.values()):
+            if params["type"] == "flat" or segment.index.ntotal >= min_train_size(params):
+                segment.replace_index(convert_index(segment.index, params))
+                tune_index(segment.index, params)
+                converted += 1
+        if converted:
+            with self._lock:
+                self.version_no += 1
+                self._write_manifest()
+        return converted
+
+    # ---------- Compaction (dọn segment đã xóa / bị thay) ----------
+    def compact(self, force: bool = False):
+        """
+        Xóa hẳn thư mục của tombstone đã quá compaction_delay (force: không chờ) + segment mồ côi
+        Giữ writer lock và sửa manifest mới nhất trên ổ cứng (snapshot này có thể đã cũ so với tiến trình khác)
+        Trả về None nếu tiến trình khác đang ghi (không force thì không chờ, lần hẹn sau làm tiếp)
+        """
+        if self.writer_lock is not None and not self.writer_lock.acquire(blocking=force):
+            return None
+        try:
+            return self._compact(force)
+        finally:
+            if self.writer_lock is not None:
+                self.writer_lock.release()
+
+    def _compact(self, force: bool):
+        now = time.time()
+        with self._lock:
+            manifest = self._load_manifest() if os.path.exists(os.path.join(self.path, MANIFEST_FILE)) else None
+            tombstones = manifest["tombstones"] if manifest else self.tombstones
+            due = [t for t in tombstones if force or now - t["deleted_at"] >= self.compaction_delay]
+            due_ids = {t["id"] for t in due}
+            self.tombstones = [t for t in self.tombstones if t["id"] not in due_ids]
+            if due:
+                # Chỉ bỏ tombstone, không đổi version: tập tài liệu tìm kiếm được vẫn như cũ
+                manifest["tombstones"] = [t for t in tombstones if t["id"] not in due_ids]
+                self._write_manifest(manifest)
+            referenced = set(self.entries) | {t["id"] for t in self.tombstones} | \
+                {segment_id for segment_id, _ in self.building.values()}
+            if manifest:
+                referenced |= {e["id"] for e in manifest["segments"]} | {t["id"] for t in manifest["tombstones"]}
+
+        reclaimed = 0
+        for tombstone in due:
+            path = self._segment_path(tombstone["id"])
+            reclaimed += _dir_bytes(path)
+            shutil.rmtree(path, ignore_errors=True)
+
+        segments_dir = os.path.join(self.path, SEGMENTS_DIR)
+        orphans = 0
+        for name in os.listdir(segments_dir) if os.path.isdir(segments_dir) else []:
+            path = os.path.join(segments_dir, name)
+            if name in referenced or name in due_ids:
+                continue
+            if now - os.path.getmtime(path) >= ORPHAN_SECONDS:
+                reclaimed += _dir_bytes(path)
+                shutil.rmtree(path, ignore_errors=True)
+                orphans += 1
+
+        with self._lock:
+            self.compactions += 1
+            self.bytes_reclaimed += reclaimed
+        if due or orphans:
+            print(f"🧹 Compaction: dọn {len(due)} segment đã xóa/thay, {orphans} segment dở dang, "
+                  f"giải phóng {reclaimed / (1024 * 1024):.2f} MB")
+        return {"segments_removed": len(due), "orphans_removed": orphans, "bytes_reclaimed": reclaimed}
+
+    def schedule_compaction(self):
+        """Hẹn compaction chạy nền sau compaction_delay giây (đã hẹn thì thôi)"""
+        with self._lock:
+            if self._compaction_timer is not None:
+                return
+            self._compaction_timer = threading.Timer(self.compaction_delay, self._compact_in_background)
+            self._compaction_timer.daemon = True
+            self._compaction_timer.start()
+
+    def _compact_in_background(self):
+        with self._lock:
+            self._compaction_timer = None
+        try:
+            if self.compact() is None:
+                print("⏳ Compaction hoãn lại: tiến trình khác đang ghi kho vector")
+        except Exception as e:
+            print(f"⚠️ Compaction lỗi: {e}")
+        with self._lock:
+            pending = bool(self.tombstones)
+        if pending:
+            self.schedule_compaction()
@@ -0,0 +1,237 @@
+"""
+Semantic cache cho câu trả lời của RAGService.chat
+- Dùng lại embedding của câu hỏi (đã tính để tìm FAISS) để tra các câu hỏi cũ
+- Nếu độ tương đồng cosine >= threshold thì trả lại answer + sources đã lưu, không gọi Gemini
+- Giới hạn theo LRU (max_entries) + TTL, lưu bằng SQLite cạnh storage/vector_db: mỗi put chỉ ghi/xóa
+  đúng các dòng thay đổi, ngoài lock của phần trong RAM (lookup không phải chờ ghi ổ cứng)
+- Nhiều worker ghi chung 1 bảng (WAL). put chỉ xóa entry trong RAM của chính worker đó (TTL / LRU),
+  nhưng _load dọn cho cả bảng (khác corpus_version, quá TTL, ngoài max_entries mới nhất) và
+  set_corpus_version / clear xóa toàn bộ bảng - entry của worker khác cũng mất theo
+- Gắn với corpus_version: tri thức thay đổi (ingest PDF) thì cache tự xóa
+"""
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import faiss
+import numpy as np
+
+
+class SemanticCache:
+    def __init__(self, path: str, threshold: float = 0.92, max_entries: int = 1000,
+                 ttl_seconds: int = 7 * 24 * 3600):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        self.corpus_version = None
+        self.entries = OrderedDict()  # id -> {question, answer, sources, created_at, vector}
+        self.index = None  # faiss IndexIDMap2(IndexFlatIP) trên vector đã chuẩn hóa
+        self.next_id = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_puts_skipped = 0
+
+        self._lock = threading.Lock()  # dữ liệu trong RAM
+        self._db_lock = threading.Lock()  # kết nối SQLite (không giữ _lock khi ghi ổ cứng)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")  # mất vài câu cuối khi mất điện cũng không sao
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                question TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                sources TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                corpus_version TEXT,
+                vector BLOB NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_entries_created ON entries (created_at)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.commit()
+        self._load()
+
+    # ---------- Lưu / đọc ổ cứng ----------
+    def _load(self):
+        """Đọc max_entries câu mới nhất còn hạn (kể cả của worker khác), dọn phần cũ hơn"""
+        try:
+            with self._db_lock:
+                row = self._conn.execute("SELECT value FROM meta WHERE key = 'corpus_version'").fetchone()
+                self.corpus_version = row[0] if row else None
+                cutoff = time.time() - self.ttl_seconds
+                # Chỉ entry của đúng version tri thức (put đang dở lúc worker khác xóa cache thì bỏ)
+                self._conn.execute("DELETE FROM entries WHERE corpus_version IS NOT ?", (self.corpus_version,))
+                rows = self._conn.execute(
+                    "SELECT key, question, answer, sources, created_at, vector FROM entries "
+                    "WHERE created_at >= ? ORDER BY created_at DESC LIMIT ?", (cutoff, self.max_entries)
+                ).fetchall()
+                self._conn.execute("DELETE FROM entries WHERE created_at < ?",
+                                   (rows[-1][4] if len(rows) == self.max_entries else cutoff,))
+                self._conn.commit()
+            for key, question, answer, sources, created_at, vector in reversed(rows):
+                self._insert(key, question, answer, json.loads(sources),
+                             np.frombuffer(vector, dtype="float32"), created_at)
+            if self.entries:
+                print(f"✅ Đã load semantic cache: {len(self.entries)} câu hỏi")
+        except Exception as e:
+            print(f"❌ Lỗi load semantic cache: {e}")
+            self._reset()
+
+    def _write(self, added=None, removed=(), clear: bool = False, version: str = None):
+        """Ghi thay đổi xuống SQLite (gọi ngoài _lock); lỗi chỉ ghi log, cache trong RAM vẫn dùng được"""
+        try:
+            with self._db_lock:
+                if clear:
+                    self._conn.execute("DELETE FROM entries")
+                    self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('corpus_version', ?)",
+                                       (self.corpus_version,))
+                for start in range(0, len(removed), 500):
+                    batch = removed[start:start + 500]
+                    placeholders = ",".join("?" * len(batch))
+                    self._conn.execute(f"DELETE FROM entries WHERE key IN ({placeholders})", batch)
+                if added is not None:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO entries "
+                        "(key, question, answer, sources, created_at, corpus_version, vector) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (added["key"], added["question"], added["answer"],
+                         json.dumps(added["sources"], ensure_ascii=False), added["created_at"], version,
+                         added["vector"].tobytes())
+                    )
+                self._conn.commit()
+        except sqlite3.Error as e:
+            print(f"⚠️ Không ghi được semantic cache: {e}")
+
+    # ---------- Thao tác nội bộ (gọi khi đã giữ lock) ----------
+    def _reset(self):
+        self.entries.clear()
+        self.index = None
+        self.next_id = 0
+
+    def _insert(self, key, question, answer, sources, vector, created_at):
+        if self.index is None:
+            self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(vector.shape[0]))
+        entry_id = self.next_id
+        self.next_id += 1
+        self.entries[entry_id] = {
+            "key": key,
+            "question": question,
+            "answer": answer,
+            "sources": sources,
+            "created_at": created_at,
+            "vector": vector,
+        }
+        self.index.add_with_ids(vector.reshape(1, -1), np.array([entry_id], dtype="int64"))
+        return self.entries[entry_id]
+
+    def _remove(self, entry_ids):
+        """Bỏ khỏi RAM, trả về key các entry đã bỏ (để xóa trong SQLite)"""
+        keys = [self.entries.pop(entry_id)["key"] for entry_id in entry_ids if entry_id in self.entries]
+        if self.index is not None and entry_ids:
+            self.index.remove_ids(np.array(entry_ids, dtype="int64"))
+        return keys
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype="float32").reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    # ---------- API ----------
+    def set_corpus_version(self, version: str):
+        """Đặt version của kho tri thức; khác version đã lưu thì xóa toàn bộ cache"""
+        with self._lock:
+            if version == self.corpus_version:
+                return
+            if self.entries:
+                self.invalidations += 1
+                print(f"♻️ Tri thức đã thay đổi - xóa {len(self.entries)} câu trả lời trong semantic cache")
+            self._reset()
+            self.corpus_version = version
+        self._write(clear=True)
+
+    def lookup(self, query_vector):
+        """Trả về {"answer", "sources", "question", "similarity"} nếu trúng cache, ngược lại None"""
+        vector = self._normalize(query_vector)
+        with self._lock:
+            if not self.entries:
+                self.misses += 1
+                return None
+
+            scores, ids = self.index.search(vector.reshape(1, -1), 1)
+            score, entry_id = float(scores[0][0]), int(ids[0][0])
+            entry = self.entries.get(entry_id)
+
+            if entry is not None and time.time() - entry["created_at"] > self.ttl_seconds:
+                self._remove([entry_id])  # dòng trong SQLite được dọn lúc load
+                entry = None
+
+            if entry is None or score < self.threshold:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(entry_id)  # LRU: vừa dùng xong thì đưa về cuối
+            self.hits += 1
+            return {
+                "answer": entry["answer"],
+                "sources": list(entry["sources"]),
+                "question": entry["question"],
+                "similarity": score,
+            }
+
+    def put(self, question: str, query_vector, answer: str, sources, version: str = None):
+        """
+        Lưu câu trả lời mới vào cache (kèm dọn TTL + LRU)
+        version: version tri thức lúc retrieval; khác version hiện tại (ingest / xóa / nạp snapshot trong lúc
+        sinh câu trả lời) thì bỏ qua - câu trả lời dựng từ context cũ
+        """
+        vector = self._normalize(query_vector)
+        now = time.time()
+        with self._lock:
+            if version is not None and version != self.corpus_version:
+                self.stale_puts_skipped += 1
+                return
+            expired = [i for i, e in self.entries.items() if now - e["created_at"] > self.ttl_seconds]
+            removed = self._remove(expired)
+
+            entry = self._insert(uuid.uuid4().hex, question, answer, list(sources), vector, now)
+
+            overflow = len(self.entries) - self.max_entries
+            if overflow > 0:
+                oldest = list(self.entries.keys())[:overflow]
+                removed += self._remove(oldest)
+                self.evictions += overflow
+            version = self.corpus_version
+        self._write(entry, removed, version=version)
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+        self._write(clear=True)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "ttl_seconds": self.ttl_seconds,
+                "corpus_version": self.corpus_version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "stale_puts_skipped": self.stale_puts_skipped,
+            }
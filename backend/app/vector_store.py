@@ -0,0 +1,339 @@
+"""
+Kho vector trên ổ cứng, load bằng mmap (không copy toàn bộ vào RAM)
+Cấu trúc thư mục (storage/vector_db/tcm_store):
+- index.<gen>.faiss : FAISS index, đọc bằng IO_FLAG_MMAP -> các tiến trình dùng chung page cache
+                     (mỗi lần commit ghi 1 file mới, meta.json trỏ tới file hiện hành)
+- chunks.bin  : nội dung + metadata từng chunk (JSON UTF-8 nối tiếp nhau, chỉ ghi thêm)
+- chunks.idx  : offset kết thúc của từng bản ghi trong chunks.bin (uint64), đọc bằng np.memmap
+- hashes.bin  : SHA-256 (32 byte) nội dung từng chunk, dùng chống trùng khi ingest
+- meta.json   : điểm commit (số chunk, số chiều...) - ghi sau cùng, atomically
+Chỉ k chunk trúng kết quả tìm kiếm mới được đọc và giải mã.
+Thứ tự vector trong index = thứ tự bản ghi trong chunks.bin (ID 0..n-1).
+Khi ingest, bản ghi mới được spill() dần xuống cuối chunks.bin (sau điểm commit) để RAM không
+phình theo cỡ sách; chúng tìm kiếm được ngay, nhưng chỉ bền vững sau save().
+"""
+import os
+import json
+import mmap
+import threading
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+
+META_FILE = "meta.json"
+CHUNKS_FILE = "chunks.bin"
+OFFSETS_FILE = "chunks.idx"
+HASHES_FILE = "hashes.bin"
+HASH_BYTES = 32
+
+
+def _read_index(path: str, use_mmap: bool):
+    """Đọc FAISS index bằng mmap nếu bản faiss hỗ trợ cho loại index này, không thì đọc thường"""
+    if use_mmap:
+        flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY | getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+        try:
+            return faiss.read_index(path, flags), True
+        except RuntimeError:
+            pass
+    return faiss.read_index(path), False
+
+
+def _write_atomic(path: str, data: bytes):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class VectorStore:
+    def __init__(self, path: str, use_mmap: bool = True):
+        self.path = path
+        self.use_mmap = use_mmap
+        self.index = None
+        self.mmapped = False
+        self.count = 0
+        self.dim = None
+        self.data_bytes = 0
+        self.generation = 0
+
+        self._data = None      # mmap của chunks.bin
+        self._offsets = None   # np.memmap của chunks.idx
+        self._hashes = None    # set hash, chỉ build khi cần (ingest)
+        self._pending = []     # bản ghi đã add, còn trong RAM: (hash, bytes)
+        self._spilled = []     # bản ghi đã ghi xuống cuối chunks.bin nhưng chưa commit: (hash, offset kết thúc)
+        self._tail = 0         # offset cuối phần đã ghi của chunks.bin (>= data_bytes)
+        self._lock = threading.RLock()  # tìm kiếm và ingest có thể chạy song song ở 2 luồng
+
+    # ---------- Mở / đọc ----------
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.exists(os.path.join(path, META_FILE))
+
+    @classmethod
+    def load(cls, path: str, use_mmap: bool = True):
+        store = cls(path, use_mmap)
+        with open(os.path.join(path, META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        store.count = meta["count"]
+        store.dim = meta["dim"]
+        store.data_bytes = meta["data_bytes"]
+        store.generation = meta["generation"]
+        store._tail = store.data_bytes
+        store.index, store.mmapped = _read_index(store.index_file(), use_mmap)
+        store._open_readers()
+        return store
+
+    def index_file(self, generation: int = None) -> str:
+        generation = self.generation if generation is None else generation
+        return os.path.join(self.path, f"index.{generation}.faiss")
+
+    def _open_readers(self):
+        """Map chunks.bin và chunks.idx (chỉ phần đã commit) vào bộ nhớ ảo"""
+        self._close_readers()
+        if self.count == 0:
+            return
+        with open(os.path.join(self.path, CHUNKS_FILE), "rb") as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._offsets = np.memmap(
+            os.path.join(self.path, OFFSETS_FILE), dtype="<u8", mode="r", shape=(self.count,)
+        )
+
+    def _close_readers(self):
+        if self._data is not None:
+            self._data.close()
+        self._data = None
+        self._offsets = None
+
+    def _total(self) -> int:
+        """Số chunk tìm kiếm được (đã commit + đang ingest)"""
+        return self.count + len(self._spilled) + len(self._pending)
+
+    def _record(self, position: int) -> dict:
+        if position < self.count:
+            start = int(self._offsets[position - 1]) if position > 0 else 0
+            end = int(self._offsets[position])
+            return json.loads(self._data[start:end].decode("utf-8"))
+
+        position -= self.count
+        if position < len(self._spilled):
+            start = self._spilled[position - 1][1] if position > 0 else self.data_bytes
+            with open(os.path.join(self.path, CHUNKS_FILE), "rb") as f:
+                f.seek(start)
+                return json.loads(f.read(self._spilled[position][1] - start).decode("utf-8"))
+        return json.loads(self._pending[position - len(self._spilled)][1].decode("utf-8"))
+
+    def get_documents(self, positions):
+        """Đọc lazily các chunk theo vị trí (chỉ giải mã đúng những bản ghi được hỏi)"""
+        docs = []
+        with self._lock:
+            for position in positions:
+                record = self._record(int(position))
+                docs.append(Document(page_content=record["text"], metadata=record["metadata"]))
+        return docs
+
+    def iter_records(self):
+        """Duyệt toàn bộ bản ghi (hash, text, metadata) theo thứ tự vector (dùng khi chuyển định dạng)"""
+        for position in range(self._total()):
+            with self._lock:
+                record = self._record(position)
+            yield record["id"], record["text"], record["metadata"]
+
+    # ---------- Tìm kiếm (giao diện giống LangChain FAISS) ----------
+    def similarity_search_with_score_by_vector(self, embedding, k: int = 5):
+        with self._lock:
+            total = self._total()
+            if self.index is None or total == 0:
+                return []
+            query = np.asarray(embedding, dtype="float32").reshape(1, -1)
+            scores, positions = self.index.search(query, min(k, total))
+            hits = [(int(p), float(s)) for p, s in zip(positions[0], scores[0]) if 0 <= p < total]
+            docs = self.get_documents([p for p, _ in hits])
+        return [(doc, score) for doc, (_, score) in zip(docs, hits)]
+
+    def search(self, queries, k: int = 5):
+        """
+        index.search thô trên ma trận query, không đọc nội dung chunk (SegmentStore gộp kết quả nhiều segment)
+        Trả về (scores, positions) - vị trí -1 là không có kết quả; None nếu kho rỗng
+        """
+        with self._lock:
+            total = self._total()
+            if self.index is None or total == 0:
+                return None
+            queries = np.ascontiguousarray(queries, dtype="float32").reshape(len(queries), -1)
+            scores, positions = self.index.search(queries, min(k, total))
+            positions[positions >= total] = -1
+            return scores, positions
+
+    def similarity_search_by_vector(self, embedding, k: int = 5):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k)]
+
+    def similarity_search_batch_by_vectors(self, embeddings, k: int = 5):
+        """Nhiều query trong 1 lần index.search (FAISS xử lý cả ma trận); trả về list docs theo từng query"""
+        with self._lock:
+            total = self._total()
+            if self.index is None or total == 0 or len(embeddings) == 0:
+                return [[] for _ in range(len(embeddings))]
+            queries = np.ascontiguousarray(embeddings, dtype="float32").reshape(len(embeddings), -1)
+            _, positions = self.index.search(queries, min(k, total))
+            return [self.get_documents([p for p in row if 0 <= p < total]) for row in positions]
+
+    # ---------- Ghi (chỉ tiến trình ingest dùng) ----------
+    def _load_hashes(self):
+        """Đọc hashes.bin thành set (chỉ khi ingest cần chống trùng, lúc serve không đụng tới)"""
+        if self._hashes is not None:
+            return
+        self._hashes = set()
+        if self.count:
+            raw = np.fromfile(os.path.join(self.path, HASHES_FILE), dtype=np.uint8,
+                              count=self.count * HASH_BYTES).reshape(-1, HASH_BYTES)
+            self._hashes = {row.tobytes().hex() for row in raw}
+
+    def has_chunk(self, chunk_hash: str) -> bool:
+        self._load_hashes()
+        return chunk_hash in self._hashes
+
+    def _ensure_writable(self):
+        """Index mở bằng mmap là read-only -> đọc bản đầy đủ vào RAM trước khi add"""
+        if self.mmapped:
+            self.index = faiss.read_index(self.index_file())
+            self.mmapped = False
+
+    def add(self, ids, texts, metadatas, vectors):
+        """Thêm chunk vào index (tìm kiếm được ngay); chỉ bền vững trên ổ cứng sau save()"""
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        records = [
+            json.dumps({"id": chunk_hash, "text": text, "metadata": metadata},
+                       ensure_ascii=False, default=str).encode("utf-8")
+            for chunk_hash, text, metadata in zip(ids, texts, metadatas)
+        ]
+        with self._lock:
+            if self.index is None:
+                self.dim = vectors.shape[1]
+                self.index = faiss.IndexFlatL2(self.dim)
+            else:
+                self._ensure_writable()
+            self._load_hashes()
+            self.index.add(vectors)
+            for chunk_hash, record in zip(ids, records):
+                self._pending.append((chunk_hash, record))
+                self._hashes.add(chunk_hash)
+
+    def spill(self) -> int:
+        """
+        Ghi các bản ghi đang giữ trong RAM xuống cuối chunks.bin (sau điểm commit, chưa đổi meta.json)
+        -> RAM khi ingest sách lớn chỉ phụ thuộc cỡ lô. Trả về số byte đã ghi
+        """
+        with self._lock:
+            if not self._pending:
+                return 0
+            os.makedirs(self.path, exist_ok=True)
+            data_path = os.path.join(self.path, CHUNKS_FILE)
+            if not self._spilled and os.path.exists(data_path) and os.path.getsize(data_path) != self.data_bytes:
+                # Phần thừa của lần ghi trước bị dừng giữa chừng -> cắt bỏ trước khi ghi tiếp
+                self._close_readers()
+                with open(data_path, "r+b") as f:
+                    f.truncate(self.data_bytes)
+                self._open_readers()
+            offset = self._tail
+            with open(data_path, "ab") as f:
+                for chunk_hash, record in self._pending:
+                    f.write(record)
+                    offset += len(record)
+                    self._spilled.append((chunk_hash, offset))
+            written = offset - self._tail
+            self._tail = offset
+            self._pending = []
+            return written
+
+    def save(self) -> int:
+        """
+        Commit: ghi nốt bản ghi mới vào cuối chunks.bin/chunks.idx/hashes.bin,
+        ghi index, rồi mới ghi meta.json (điểm commit). Trả về số byte đã ghi
+        """
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            bytes_written = 0
+
+            # Cắt bỏ phần thừa của lần ghi trước bị dừng giữa chừng (sau điểm commit)
+            self._close_readers()
+            new_records = list(self._spilled)
+            with open(os.path.join(self.path, CHUNKS_FILE), "ab") as data_f, \
+                    open(os.path.join(self.path, OFFSETS_FILE), "ab") as offsets_f, \
+                    open(os.path.join(self.path, HASHES_FILE), "ab") as hashes_f:
+                data_f.truncate(self._tail if self._spilled else self.data_bytes)
+                offsets_f.truncate(self.count * 8)
+                hashes_f.truncate(self.count * HASH_BYTES)
+                offset = self._tail if self._spilled else self.data_bytes
+                for chunk_hash, record in self._pending:
+                    data_f.write(record)
+                    offset += len(record)
+                    new_records.append((chunk_hash, offset))
+                offsets_f.write(np.asarray([end for _, end in new_records], dtype="<u8").tobytes())
+                hashes_f.write(b"".join(bytes.fromhex(chunk_hash) for chunk_hash, _ in new_records))
+                for f in (data_f, offsets_f, hashes_f):
+                    f.flush()
+                    os.fsync(f.fileno())
+                bytes_written += (offset - self.data_bytes) + len(new_records) * (8 + HASH_BYTES)
+
+            # Index ghi ra file mới (generation kế tiếp); file cũ vẫn nguyên cho tới khi meta.json đổi
+            generation = self.generation + 1
+            faiss.write_index(self.index, self.index_file(generation))
+            bytes_written += os.path.getsize(self.index_file(generation))
+
+            self.count += len(new_records)
+            self.data_bytes = offset
+            self._tail = offset
+            self._pending = []
+            self._spilled = []
+            meta = {"count": self.count, "dim": self.dim, "data_bytes": self.data_bytes, "generation": generation}
+            _write_atomic(os.path.join(self.path, META_FILE), json.dumps(meta).encode("utf-8"))
+            old_index_file = self.index_file()
+            self.generation = generation
+            try:
+                # Tiến trình khác đang mmap file cũ vẫn đọc được tới khi tự load lại (POSIX)
+                os.remove(old_index_file)
+            except OSError:
+                pass
+
+            # Mở lại bằng mmap để RAM quay về mức tối thiểu
+            if self.use_mmap:
+                self.index, self.mmapped = _read_index(self.index_file(), True)
+            self._open_readers()
+            return bytes_written
+
+    def replace_index(self, index) -> int:
+        """Thay FAISS index (vd: chuyển flat -> hnsw), giữ nguyên thứ tự vector; commit luôn"""
+        if index.ntotal != self._total():
+            raise ValueError("Index mới phải chứa đúng số vector hiện có")
+        self.index = index
+        self.mmapped = False
+        return self.save()
+
+    def version(self) -> str:
+        """Dấu hiệu thay đổi của kho (dùng cho semantic cache)"""
+        meta_path = os.path.join(self.path, META_FILE)
+        if not os.path.exists(meta_path):
+            return "empty"
+        stat = os.stat(meta_path)
+        return f"{self.count}-{stat.st_mtime_ns}"
+
+
+def migrate_langchain_index(legacy_path: str, store_path: str, embeddings):
+    """Chuyển index cũ (FAISS.save_local: index.faiss + index.pkl) sang VectorStore"""
+    from langchain_community.vectorstores import FAISS
+    from app.ingest_store import hash_chunk
+
+    legacy = FAISS.load_local(legacy_path, embeddings, allow_dangerous_deserialization=True)
+    store = VectorStore(store_path)
+    store.index = legacy.index
+    store.dim = legacy.index.d
+    for position in range(legacy.index.ntotal):
+        doc = legacy.docstore.search(legacy.index_to_docstore_id[position])
+        record = json.dumps({"id": hash_chunk(doc.page_content), "text": doc.page_content,
+                             "metadata": doc.metadata}, ensure_ascii=False, default=str).encode("utf-8")
+        store._pending.append((hash_chunk(doc.page_content), record))
+    store.save()
+    return store
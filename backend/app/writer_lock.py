@@ -0,0 +1,89 @@
+"""
+Khóa ghi kho vector giữa các tiến trình (API server, pdf_watcher.py, load_pdfs.py, convert_index.py...)
+- File lock trên storage/vector_db/writer.lock (fcntl trên Linux/Mac, msvcrt trên Windows)
+- Reentrant trong cùng tiến trình: ingest gọi delete/compaction lồng nhau không tự khóa chính mình
+- Hệ điều hành tự nhả khóa khi tiến trình chết -> không bao giờ kẹt khóa sau crash
+Đọc (tìm kiếm) không cần khóa: manifest.json được publish atomically
+"""
+import os
+import time
+import threading
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+POLL_SECONDS = 0.2
+
+
+class WriterLockTimeout(Exception):
+    """Tiến trình khác đang ghi kho vector quá lâu"""
+
+
+class WriterLock:
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def _try_lock_file(self) -> bool:
+        try:
+            if os.name == "nt":
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def _unlock_file(self):
+        if os.name == "nt":
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+    def acquire(self, blocking: bool = True, timeout: float = None) -> bool:
+        """Giữ khóa ghi; blocking=False thì trả về False ngay nếu tiến trình khác đang ghi"""
+        if not self._local.acquire(blocking, -1 if timeout is None or not blocking else timeout):
+            return False
+        if self._depth:
+            self._depth += 1
+            return True
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._file = open(self.path, "a+b")
+        deadline = None if timeout is None else time.monotonic() + timeout
+        waiting = False
+        while not self._try_lock_file():
+            if not blocking or (deadline is not None and time.monotonic() >= deadline):
+                self._file.close()
+                self._file = None
+                self._local.release()
+                if blocking:
+                    raise WriterLockTimeout(f"Kho vector đang được tiến trình khác ghi (quá {timeout}s)")
+                return False
+            if not waiting:
+                print("⏳ Tiến trình khác đang ghi kho vector, đang chờ...")
+                waiting = True
+            time.sleep(POLL_SECONDS)
+        self._depth = 1
+        return True
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            self._unlock_file()
+            self._file.close()
+            self._file = None
+        self._local.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
@@ -0,0 +1,147 @@
+"""
+So sánh backend embedding với model hiện tại (torch) trước khi đổi EMBEDDING_BACKEND:
+tốc độ embedding văn bản (chunk/s), độ trễ 1 query, độ lệch cosine, độ trùng top-5 khi tìm kiếm
+Chạy từ thư mục backend:
+    python -m benchmarks.bench_embeddings                         # onnx + onnx_int8 so với torch
+    python -m benchmarks.bench_embeddings --backends onnx_int8 --threads 4 --batch-size 64
+    python -m benchmarks.bench_embeddings --json embeddings.json
+Văn bản mẫu lấy từ tcm_store hiện có (nếu có), không thì dùng văn bản giả.
+Thoát với mã 1 nếu cosine nhỏ nhất thấp hơn --min-cosine (không nên đổi backend)
+"""
+import json
+import time
+import argparse
+
+import numpy as np
+
+from app.embedding_factory import EMBEDDING_BACKENDS, embedding_params_from_env, create_embeddings
+from benchmarks.corpus import synthetic_page, synthetic_questions
+
+K = 5
+
+
+def load_texts(num_texts: int):
+    from app.rag_service import STORE_PATH
+    from app.segment_store import SegmentStore
+    if SegmentStore.exists(STORE_PATH):
+        store = SegmentStore.load(STORE_PATH)
+        segments = list(store.segments.values())
+        texts = []
+        for segment in segments:  # lấy đều từ mọi tài liệu
+            per_segment = min(segment.count, max(1, num_texts // len(segments)))
+            positions = np.linspace(0, segment.count - 1, per_segment).astype(int).tolist()
+            texts += [doc.page_content for doc in segment.get_documents(positions)]
+        texts = texts[:num_texts]
+        if texts:
+            print(f"📚 Dùng {len(texts)} chunk từ {STORE_PATH}")
+            return texts
+    import random
+    rng = random.Random(0)
+    print(f"📚 Chưa có tcm_store - dùng {num_texts} đoạn văn bản giả")
+    return [" ".join(synthetic_page(rng, lines=8)) for _ in range(num_texts)]
+
+
+def measure(embeddings, texts, queries):
+    embeddings.embed_documents(texts[:8])  # làm nóng (cấp phát, JIT của runtime)
+    started = time.perf_counter()
+    doc_vectors = np.asarray(embeddings.embed_documents(texts), dtype="float32")
+    doc_seconds = time.perf_counter() - started
+
+    latencies, query_vectors = [], []
+    for query in queries:
+        started = time.perf_counter()
+        query_vectors.append(embeddings.embed_query(query))
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies = np.array(latencies)
+    return doc_vectors, np.asarray(query_vectors, dtype="float32"), {
+        "dim": int(doc_vectors.shape[1]),
+        "chunks_per_sec": round(len(texts) / doc_seconds, 2),
+        "query_p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "query_p99_ms": round(float(np.percentile(latencies, 99)), 3),
+    }
+
+
+def cosine(a, b):
+    a = a / np.clip(np.linalg.norm(a, axis=1, keepdims=True), 1e-12, None)
+    b = b / np.clip(np.linalg.norm(b, axis=1, keepdims=True), 1e-12, None)
+    return (a * b).sum(axis=1)
+
+
+def top_k(query_vectors, doc_vectors):
+    """Top-k theo khoảng cách L2 như FAISS index"""
+    distances = (
+        (query_vectors ** 2).sum(axis=1, keepdims=True)
+        - 2 * query_vectors @ doc_vectors.T
+        + (doc_vectors ** 2).sum(axis=1)
+    )
+    return np.argsort(distances, axis=1)[:, :K]
+
+
+def main():
+    defaults = embedding_params_from_env()
+    parser = argparse.ArgumentParser(description="So sánh tốc độ + độ lệch của các backend embedding")
+    parser.add_argument("--backends", default="onnx,onnx_int8", help=f"Các backend cần so, trong {EMBEDDING_BACKENDS}")
+    parser.add_argument("--texts", type=int, default=512, help="Số chunk mẫu")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=defaults["batch_size"])
+    parser.add_argument("--threads", type=int, default=defaults["threads"], help="0 = để thư viện tự chọn")
+    parser.add_argument("--min-cosine", type=float, default=0.99,
+                        help="Cosine nhỏ nhất chấp nhận được so với torch")
+    parser.add_argument("--json", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    texts = load_texts(args.texts)
+    queries = synthetic_questions(args.queries)
+    params = {**defaults, "batch_size": args.batch_size, "threads": args.threads}
+
+    print("\n⏱️ torch (baseline)...")
+    base_docs, base_queries, base_row = measure(create_embeddings({**params, "backend": "torch"}), texts, queries)
+    base_top = top_k(base_queries, base_docs)
+    results = [{"backend": "torch", **base_row, "speedup": 1.0}]
+
+    ok = True
+    for backend in [b.strip() for b in args.backends.split(",") if b.strip() and b.strip() != "torch"]:
+        print(f"\n⏱️ {backend}...")
+        docs, query_vectors, row = measure(create_embeddings({**params, "backend": backend}), texts, queries)
+        if row["dim"] != base_row["dim"]:
+            print(f"❌ {backend}: {row['dim']} chiều, khác torch ({base_row['dim']}) - không dùng chung index được")
+            ok = False
+            continue
+        similarities = cosine(np.vstack([docs, query_vectors]), np.vstack([base_docs, base_queries]))
+        overlap = np.mean([len(set(a) & set(b)) / K for a, b in zip(top_k(query_vectors, base_docs), base_top)])
+        row = {"backend": backend, **row}
+        row.update({
+            "speedup": round(row["chunks_per_sec"] / base_row["chunks_per_sec"], 2),
+            "query_speedup": round(base_row["query_p50_ms"] / row["query_p50_ms"], 2) if row["query_p50_ms"] else None,
+            "cosine_mean": round(float(similarities.mean()), 5),
+            "cosine_min": round(float(similarities.min()), 5),
+            "cosine_p1": round(float(np.percentile(similarities, 1)), 5),
+            "top5_overlap": round(float(overlap), 4),
+        })
+        results.append(row)
+        ok = ok and row["cosine_min"] >= args.min_cosine
+
+    print(f"\n📊 {len(texts)} chunk, {len(queries)} query, batch_size={args.batch_size}, threads={args.threads or 'auto'}\n")
+    print(f"{'backend':<10} {'chunk/s':>9} {'speedup':>8} {'q_p50_ms':>9} {'q_p99_ms':>9} "
+          f"{'cos_mean':>9} {'cos_min':>8} {'top5':>6}")
+    for row in results:
+        print(f"{row['backend']:<10} {row['chunks_per_sec']:>9.1f} {row['speedup']:>8.2f} "
+              f"{row['query_p50_ms']:>9.2f} {row['query_p99_ms']:>9.2f} "
+              f"{row.get('cosine_mean', 1.0):>9.5f} {row.get('cosine_min', 1.0):>8.5f} {row.get('top5_overlap', 1.0):>6.3f}")
+
+    # Query mới (backend mới) vẫn so với vector cũ trong index (torch) -> cosine_min là chỉ số quyết định
+    if ok:
+        print(f"\n✅ Cosine nhỏ nhất >= {args.min_cosine}: đổi EMBEDDING_BACKEND an toàn, không cần học lại tài liệu")
+    else:
+        print(f"\n⚠️ Có backend lệch quá ngưỡng {args.min_cosine}: nếu vẫn đổi thì nên học lại tài liệu")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"num_texts": len(texts), "num_queries": len(queries), "batch_size": args.batch_size,
+                       "threads": args.threads, "min_cosine": args.min_cosine, "results": results}, f, indent=2)
+        print(f"\n💾 Đã ghi kết quả: {args.json}")
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
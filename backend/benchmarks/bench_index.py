@@ -0,0 +1,122 @@
+"""
+Benchmark các loại FAISS index: recall@5 so với flat, độ trễ p50/p99, dung lượng
+Chạy từ thư mục backend:
+    python -m benchmarks.bench_index                      # dùng vector trong tcm_store hiện có
+    python -m benchmarks.bench_index --synthetic 200000   # vector ngẫu nhiên, không cần index
+    python -m benchmarks.bench_index --json results.json
+"""
+import json
+import time
+import argparse
+
+import faiss
+import numpy as np
+
+from app.index_factory import index_params_from_env, build_index, all_vectors, index_memory_bytes
+
+K = 5
+
+# Các cấu hình so sánh (ghi đè lên params mặc định)
+CONFIGS = [
+    {"type": "flat"},
+    {"type": "hnsw", "hnsw_m": 16, "ef_search": 32},
+    {"type": "hnsw", "hnsw_m": 32, "ef_search": 64},
+    {"type": "hnsw", "hnsw_m": 32, "ef_search": 128},
+    {"type": "ivf_flat", "nprobe": 8},
+    {"type": "ivf_flat", "nprobe": 32},
+    {"type": "ivf_pq", "nprobe": 16},
+    {"type": "ivf_pq", "nprobe": 64},
+]
+
+
+def load_vectors(args):
+    if args.synthetic:
+        rng = np.random.default_rng(0)
+        # Dữ liệu có cấu trúc cụm cho giống embedding thật hơn nhiễu đều
+        centers = rng.normal(size=(256, args.dim)).astype("float32")
+        labels = rng.integers(0, len(centers), size=args.synthetic)
+        vectors = centers[labels] + 0.3 * rng.normal(size=(args.synthetic, args.dim)).astype("float32")
+        return np.ascontiguousarray(vectors, dtype="float32")
+
+    from app.rag_service import STORE_PATH
+    from app.segment_store import SegmentStore
+    if not SegmentStore.exists(STORE_PATH):
+        raise SystemExit(f"❌ Không tìm thấy {STORE_PATH} - dùng --synthetic N để chạy với dữ liệu giả")
+    # Gộp vector của mọi segment (tài liệu) thành 1 tập để so các loại index trên cùng dữ liệu
+    store = SegmentStore.load(STORE_PATH, use_mmap=False)
+    return np.vstack([all_vectors(segment.index) for segment in store.segments.values()])
+
+
+def make_queries(vectors, num_queries: int):
+    """Query = vector có sẵn + nhiễu nhỏ (giống câu hỏi gần nghĩa với 1 đoạn trong sách)"""
+    rng = np.random.default_rng(1)
+    picks = rng.choice(len(vectors), min(num_queries, len(vectors)), replace=False)
+    noise = rng.normal(scale=vectors.std() * 0.1, size=(len(picks), vectors.shape[1]))
+    return np.ascontiguousarray(vectors[picks] + noise, dtype="float32")
+
+
+def measure(index, queries, ground_truth):
+    latencies = []
+    hits = 0
+    for i, query in enumerate(queries):
+        started = time.perf_counter()
+        _, ids = index.search(query.reshape(1, -1), K)
+        latencies.append((time.perf_counter() - started) * 1000)
+        hits += len(set(ids[0]) & set(ground_truth[i]))
+    latencies = np.array(latencies)
+    return {
+        "recall_at_5": round(hits / (len(queries) * K), 4),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 4),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark recall/latency/memory các loại FAISS index")
+    parser.add_argument("--synthetic", type=int, default=0, help="Số vector ngẫu nhiên (0 = dùng tcm_store)")
+    parser.add_argument("--dim", type=int, default=384, help="Số chiều cho dữ liệu giả")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--threads", type=int, default=1, help="Số luồng FAISS (1 = giống 1 request)")
+    parser.add_argument("--json", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(args.threads)
+    vectors = load_vectors(args)
+    queries = make_queries(vectors, args.queries)
+    print(f"📊 {len(vectors)} vector x {vectors.shape[1]} chiều, {len(queries)} query, k={K}\n")
+
+    flat = build_index(vectors, {**index_params_from_env(), "type": "flat"})
+    _, ground_truth = flat.search(queries, K)
+
+    results = []
+    print(f"{'config':<36} {'build_s':>8} {'recall@5':>9} {'p50_ms':>8} {'p99_ms':>8} {'MB':>9}")
+    for overrides in CONFIGS:
+        params = {**index_params_from_env(), **overrides}
+        name = ",".join(f"{k}={v}" for k, v in overrides.items())
+        try:
+            started = time.perf_counter()
+            index = build_index(vectors, params)
+            build_seconds = time.perf_counter() - started
+        except ValueError as e:
+            print(f"{name:<36} bỏ qua: {e}")
+            continue
+
+        row = {
+            "config": overrides,
+            "build_seconds": round(build_seconds, 3),
+            **measure(index, queries, ground_truth),
+            "memory_bytes": index_memory_bytes(index),
+        }
+        results.append(row)
+        print(f"{name:<36} {row['build_seconds']:>8.2f} {row['recall_at_5']:>9.4f} "
+              f"{row['p50_ms']:>8.3f} {row['p99_ms']:>8.3f} {row['memory_bytes'] / (1024 * 1024):>9.2f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"num_vectors": len(vectors), "dim": int(vectors.shape[1]),
+                       "num_queries": len(queries), "k": K, "results": results}, f, indent=2)
+        print(f"\n💾 Đã ghi kết quả: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
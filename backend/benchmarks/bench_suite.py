@@ -0,0 +1,405 @@
+"""
+Bộ benchmark chạy offline (không cần Gemini, SQL Server hay mạng): LLM giả, SQLite, dữ liệu giả
+Đo:
+- ingest  : ingest_pdf (như /api/upload) trên sách PDF giả -> trang/s, chunk/s
+- retrieval: QPS, p50/p99 tìm kiếm vector ở nhiều cỡ kho (mặc định 1k/10k/100k chunk)
+- chat    : độ trễ /api/chat end-to-end khi nhiều request đồng thời (LLM giả có độ trễ cố định)
+- patients: độ trễ /api/patients (trang đầu + trang sâu) và /api/search ở 10k/100k bệnh nhân
+- export  : xuất stream NDJSON / CSV ở 10k/100k bệnh nhân: dòng/s, RAM đỉnh (tracemalloc) không tăng theo cỡ bảng
+- import  : nhập hàng loạt CSV qua /api/patients/import (dòng/s) so với tạo từng bệnh nhân qua /api/patients
+Chạy từ thư mục backend:
+    python -m benchmarks.bench_suite --json bench.json
+    python -m benchmarks.bench_suite --only retrieval,patients --patient-sizes 10000
+    python -m benchmarks.bench_suite --quick          # cỡ nhỏ, chạy thử nhanh
+So sánh 2 lần chạy: đối chiếu 2 file JSON (cùng cấu trúc, có kèm tham số + commit)
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+from datetime import datetime
+
+import numpy as np
+
+from benchmarks import offline, corpus
+
+STAGES = ("ingest", "retrieval", "chat", "patients", "export", "import")
+K = 5
+
+
+def percentiles(latencies_ms):
+    latencies = np.asarray(latencies_ms, dtype="float64")
+    return {
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+        "mean_ms": round(float(latencies.mean()), 3),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# ---------- Ingest ----------
+def bench_ingest(rag, workdir, args):
+    paths = corpus.generate_pdfs(os.path.join(workdir, "pdfs"), args.pdfs, args.pages)
+    pages, chunks = 0, 0
+    started = time.perf_counter()
+    for path in paths:
+        report = rag.ingest_pdfs([path])  # đúng đường đi của ingest_pdf / /api/upload
+        pages += report["pages"]
+        chunks += report["chunks_added"]
+    elapsed = time.perf_counter() - started
+    return {
+        "files": len(paths), "pages": pages, "chunks": chunks, "seconds": round(elapsed, 3),
+        "pages_per_sec": round(pages / elapsed, 2), "chunks_per_sec": round(chunks / elapsed, 2),
+    }
+
+
+# ---------- Retrieval ----------
+def _synthetic_store(path, size, dim, index_params):
+    from app.vector_store import VectorStore
+    from app.index_factory import build_index
+
+    rng = np.random.default_rng(size)
+    centers = rng.normal(size=(256, dim)).astype("float32")
+    vectors = centers[rng.integers(0, len(centers), size=size)] + \
+        0.3 * rng.normal(size=(size, dim)).astype("float32")
+    store = VectorStore(path, use_mmap=True)
+    for start in range(0, size, 10000):
+        end = min(start + 10000, size)
+        store.add(
+            [f"{i:064x}" for i in range(start, end)],
+            [f"Đoạn giả số {i}: " + "phong hàn khái thấu " * 40 for i in range(start, end)],
+            [{"source": f"synthetic_{i % 20}.pdf", "page": i % 300} for i in range(start, end)],
+            vectors[start:end],
+        )
+    if index_params["type"] != "flat":
+        store.index = build_index(vectors, index_params)
+    store.save()
+    return VectorStore.load(path, use_mmap=True), vectors
+
+
+def bench_retrieval(workdir, args):
+    from app.index_factory import index_params_from_env, tune_index
+
+    params = {**index_params_from_env(), "type": args.index_type or index_params_from_env()["type"]}
+    results = []
+    for size in args.retrieval_sizes:
+        path = os.path.join(workdir, f"retrieval_{size}")
+        try:
+            store, vectors = _synthetic_store(path, size, offline.EMBEDDING_DIM, params)
+        except ValueError as e:  # vd: quá ít vector để train IVF
+            results.append({"corpus_size": size, "index_type": params["type"], "skipped": str(e)})
+            continue
+        tune_index(store.index, params)
+        rng = np.random.default_rng(7)
+        queries = vectors[rng.choice(size, min(args.queries, size), replace=False)]
+        queries = queries + rng.normal(scale=0.05, size=queries.shape).astype("float32")
+
+        latencies = []
+        started = time.perf_counter()
+        for query in queries:
+            t = time.perf_counter()
+            store.similarity_search_by_vector(query, k=K)  # gồm cả đọc + giải mã k chunk
+            latencies.append((time.perf_counter() - t) * 1000)
+        elapsed = time.perf_counter() - started
+
+        t = time.perf_counter()
+        store.similarity_search_batch_by_vectors(queries, k=K)
+        batch_elapsed = time.perf_counter() - t
+
+        results.append({
+            "corpus_size": size, "index_type": params["type"], "queries": len(queries),
+            "qps": round(len(queries) / elapsed, 1),
+            "batch_qps": round(len(queries) / batch_elapsed, 1),
+            **percentiles(latencies),
+        })
+        print(f"   retrieval {size:>8}: {results[-1]['qps']} QPS, p99 {results[-1]['p99_ms']} ms")
+        shutil.rmtree(path, ignore_errors=True)
+    return results
+
+
+# ---------- HTTP (chat + bệnh nhân) ----------
+async def _timed_get(client, url, params=None):
+    started = time.perf_counter()
+    response = await client.get(url, params=params)
+    response.raise_for_status()
+    return (time.perf_counter() - started) * 1000, response.json()
+
+
+async def _bench_chat(client, args):
+    results = []
+    questions = corpus.synthetic_questions(max(args.chat_requests, 1))
+    for concurrency in args.chat_concurrency:
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies, errors = [], 0
+
+        async def one(question):
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post("/api/chat", data={"question": question})
+                latencies.append((time.perf_counter() - started) * 1000)
+                if response.status_code != 200:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*[one(q) for q in questions[:args.chat_requests]])
+        elapsed = time.perf_counter() - started
+        results.append({
+            "concurrency": concurrency, "requests": args.chat_requests, "errors": errors,
+            "llm_latency_s": args.llm_latency, "seconds": round(elapsed, 3),
+            "throughput_rps": round(args.chat_requests / elapsed, 2),
+            **percentiles(latencies),
+        })
+        print(f"   chat c={concurrency:>3}: {results[-1]['throughput_rps']} req/s, p99 {results[-1]['p99_ms']} ms")
+    return results
+
+
+async def _bench_patients(client, size, args):
+    latencies = {"first_page": [], "deep_page": [], "search_name": [], "search_digits": [],
+                 "detail_cold": [], "detail_hot": [], "detail_304": []}
+    for _ in range(args.repeat):
+        ms, page = await _timed_get(client, "/api/patients", {"limit": 100})
+        latencies["first_page"].append(ms)
+        # Đi theo cursor tới trang thứ deep_pages -> chi phí trang sâu
+        cursor = page["next_cursor"]
+        for _ in range(args.deep_pages):
+            if not cursor:
+                break
+            ms, page = await _timed_get(client, "/api/patients", {"limit": 100, "cursor": cursor})
+            cursor = page["next_cursor"]
+        latencies["deep_page"].append(ms)
+
+    for q in ("nguyen van", "tran thi lan", "ha noi", "pham duc"):
+        for _ in range(args.repeat):
+            ms, _ = await _timed_get(client, "/api/search", {"q": q, "limit": 20})
+            latencies["search_name"].append(ms)
+    for q in ("0000000", "0912", "00000001234"):
+        for _ in range(args.repeat):
+            ms, _ = await _timed_get(client, "/api/search", {"q": q, "limit": 20})
+            latencies["search_digits"].append(ms)
+
+    # Chi tiết bệnh nhân: lần đầu đọc DB (cold), lần sau trúng cache (hot), gửi lại ETag -> 304
+    from app.main import patient_cache
+    patient_cache.clear()
+    ids = [item["ID"] for item in page["items"]] or [1]
+    for patient_id in ids[:args.repeat * 5]:
+        ms, _ = await _timed_get(client, f"/api/patients/{patient_id}")
+        latencies["detail_cold"].append(ms)
+        started = time.perf_counter()
+        response = await client.get(f"/api/patients/{patient_id}")
+        latencies["detail_hot"].append((time.perf_counter() - started) * 1000)
+        started = time.perf_counter()
+        response = await client.get(f"/api/patients/{patient_id}", headers={"If-None-Match": response.headers["etag"]})
+        latencies["detail_304"].append((time.perf_counter() - started) * 1000)
+        assert response.status_code == 304
+
+    row = {"patients": size}
+    for name, values in latencies.items():
+        row[name] = percentiles(values)
+    print(f"   patients {size:>8}: /api/patients p99 {row['first_page']['p99_ms']} ms, "
+          f"/api/search p99 {row['search_name']['p99_ms']} ms, chi tiết p50 {row['detail_cold']['p50_ms']} ms "
+          f"-> {row['detail_hot']['p50_ms']} ms (cache)")
+    return row
+
+
+def _bench_export(size):
+    from app.database import SessionLocal
+    from app import patient_export
+
+    row = {"patients": size}
+    for fmt in patient_export.FORMATS:
+        stats = patient_export.new_stats()
+        started = time.perf_counter()
+        with SessionLocal() as db:
+            size_bytes = sum(len(chunk.encode("utf-8")) for chunk in patient_export.iter_export(db, fmt, stats=stats))
+        seconds = time.perf_counter() - started
+        # Lần 2 chỉ để đo RAM đỉnh (tracemalloc làm chậm nên không tính vào thời gian)
+        tracemalloc.start()
+        with SessionLocal() as db:
+            for _ in patient_export.iter_export(db, fmt):
+                pass
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        row[fmt] = {"rows": stats["rows"], "seconds": round(seconds, 3), "rows_per_sec": round(stats["rows"] / seconds, 1),
+                    "mb": round(size_bytes / 1024 / 1024, 1), "peak_mb": round(peak / 1024 / 1024, 2)}
+    print(f"   export {size:>8}: NDJSON {row['ndjson']['rows_per_sec']} dòng/s, RAM đỉnh {row['ndjson']['peak_mb']} MB; "
+          f"CSV {row['csv']['rows_per_sec']} dòng/s, RAM đỉnh {row['csv']['peak_mb']} MB")
+    return row
+
+
+async def _bench_import(client, workdir, args):
+    # Cách cũ: mỗi bệnh nhân 1 request (kèm lượt khám đầu), CCCD riêng để không trùng file nhập
+    singles = corpus.patient_import_rows(args.import_single, seed=1, cccd_prefix="8")
+    payloads = {}
+    for row in singles:
+        visit = {k: row[k] for k in ("TrieuChung", "BenhDanh") if k in row}
+        payloads.setdefault(row["CCCD"], {**{k: v for k, v in row.items() if k not in visit and k != "NgayKham"},
+                                          "LuotKhamDau": visit or None})
+    started = time.perf_counter()
+    for payload in payloads.values():
+        response = await client.post("/api/patients", json=payload)
+        response.raise_for_status()
+    single_seconds = time.perf_counter() - started
+
+    path = corpus.write_csv(os.path.join(workdir, "import.csv"), corpus.patient_import_rows(args.import_rows))
+    started = time.perf_counter()
+    with open(path, "rb") as f:
+        response = await client.post("/api/patients/import", files={"file": ("import.csv", f, "text/csv")})
+    response.raise_for_status()
+    seconds = time.perf_counter() - started
+    report = response.json()
+
+    single_rate = len(payloads) / single_seconds
+    bulk_rate = report["patients_created"] / seconds
+    row = {
+        "rows": report["rows"], "patients": report["patients_created"], "visits": report["visits_created"],
+        "failed": report["failed"], "seconds": round(seconds, 3), "rows_per_sec": round(report["rows"] / seconds, 1),
+        "patients_per_sec": round(bulk_rate, 1),
+        "single_patients": len(payloads), "single_patients_per_sec": round(single_rate, 1),
+        "speedup": round(bulk_rate / single_rate, 1),
+    }
+    print(f"   import: {row['rows_per_sec']} dòng/s ({row['patients_per_sec']} bệnh nhân/s) so với "
+          f"{row['single_patients_per_sec']} bệnh nhân/s từng request -> x{row['speedup']}")
+    return row
+
+
+async def _bench_http(app, args, run_chat, run_patients, run_import=False, workdir=None, run_export=False):
+    import httpx
+    from app import models
+    from app.database import SessionLocal
+
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+        if run_chat:
+            results["chat"] = await _bench_chat(client, args)
+        if run_patients or run_export:
+            if run_patients:
+                results["patients"] = []
+            if run_export:
+                results["export"] = []
+            db = SessionLocal()
+            try:
+                total = db.query(models.BenhNhan).count()
+                for size in sorted(args.patient_sizes):
+                    if size > total:
+                        started = time.perf_counter()
+                        total = corpus.generate_patients(db, size - total)
+                        print(f"   đã sinh {total} bệnh nhân ({time.perf_counter() - started:.1f}s)")
+                    if run_patients:
+                        results["patients"].append(await _bench_patients(client, size, args))
+                    if run_export:
+                        results["export"].append(_bench_export(size))
+            finally:
+                db.close()
+        if run_import:
+            results["import"] = await _bench_import(client, workdir, args)
+    return results
+
+
+def parse_sizes(text):
+    return [int(x) for x in text.split(",") if x.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline: ingest, retrieval, chat, API bệnh nhân")
+    parser.add_argument("--only", default=",".join(STAGES), help=f"Các phần cần chạy, trong {STAGES}")
+    parser.add_argument("--json", help="Ghi kết quả ra file JSON")
+    parser.add_argument("--workdir", help="Thư mục dữ liệu tạm (mặc định: tạo mới rồi xóa)")
+    parser.add_argument("--quick", action="store_true", help="Cỡ nhỏ để chạy thử")
+    parser.add_argument("--real-embeddings", action="store_true",
+                        help="Dùng model embedding thật theo EMBEDDING_BACKEND (cần model đã tải sẵn) thay vì embedding giả")
+    parser.add_argument("--pdfs", type=int, default=5, help="Số sách PDF giả")
+    parser.add_argument("--pages", type=int, default=40, help="Số trang mỗi sách")
+    parser.add_argument("--retrieval-sizes", type=parse_sizes, default=[1000, 10000, 100000])
+    parser.add_argument("--index-type", help="Loại index cho phần retrieval (mặc định VECTOR_INDEX_TYPE)")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Độ trễ giả lập của Gemini (giây)")
+    parser.add_argument("--chat-requests", type=int, default=64)
+    parser.add_argument("--chat-concurrency", type=parse_sizes, default=[1, 8, 32])
+    parser.add_argument("--patient-sizes", type=parse_sizes, default=[10000, 100000])
+    parser.add_argument("--deep-pages", type=int, default=50, help="Số trang đi theo cursor để đo trang sâu")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--import-rows", type=int, default=20000, help="Số bệnh nhân trong file CSV nhập hàng loạt")
+    parser.add_argument("--import-single", type=int, default=500, help="Số bệnh nhân tạo từng request để so sánh")
+    args = parser.parse_args()
+
+    if args.quick:
+        args.pdfs, args.pages, args.queries, args.repeat = 2, 10, 100, 5
+        args.retrieval_sizes, args.patient_sizes = [1000, 10000], [2000]
+        args.chat_requests, args.chat_concurrency, args.deep_pages = 16, [1, 8], 5
+        args.import_rows, args.import_single = 2000, 100
+        args.llm_latency = min(args.llm_latency, 0.1)
+    stages = [s.strip() for s in args.only.split(",") if s.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"Không có phần benchmark: {', '.join(sorted(unknown))}")
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="tcm_bench_")
+    rag_module = offline.setup(workdir, llm_latency=args.llm_latency, real_embeddings=args.real_embeddings)
+
+    started = time.perf_counter()
+    from app.main import app, rag_service, STARTUP_TIMINGS
+    import_seconds = time.perf_counter() - started
+    # ASGITransport không chạy sự kiện startup -> tự khởi động AI (đo riêng từng phase)
+    if not rag_service.ready.is_set():
+        rag_service.warm_up()
+
+    results = {
+        "meta": {
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(), "python": sys.version.split()[0], "platform": platform.platform(),
+            "cpu_count": os.cpu_count(), "embeddings": os.getenv("EMBEDDING_BACKEND", "torch") if args.real_embeddings else "fake",
+            "args": {k: v for k, v in vars(args).items() if k not in ("json", "workdir")},
+            "vector_index_type": rag_module.index_params_from_env()["type"],
+        }
+    }
+    results["startup"] = {"import_app_seconds": round(import_seconds, 3), "app": STARTUP_TIMINGS,
+                          "rag_warm_up": rag_service.startup_timings}
+    print(f"🚀 Import app (API bệnh nhân sẵn sàng): {import_seconds:.2f}s, "
+          f"khởi động AI: {rag_service.startup_timings['total']:.2f}s")
+    try:
+        if "ingest" in stages:
+            print("📚 Ingest...")
+            results["ingest"] = bench_ingest(rag_service, workdir, args)
+            print(f"   {results['ingest']['pages_per_sec']} trang/s, {results['ingest']['chunks_per_sec']} chunk/s")
+        if "retrieval" in stages:
+            print("🔎 Retrieval...")
+            results["retrieval"] = bench_retrieval(workdir, args)
+        if "chat" in stages and not rag_service.vector_db:
+            # Chưa chạy ingest -> nạp 1 sách nhỏ để chat có tài liệu mà tìm
+            rag_service.ingest_pdfs(corpus.generate_pdfs(os.path.join(workdir, "pdfs"), 1, 5, seed=99))
+        if {"chat", "patients", "export", "import"} & set(stages):
+            print("🌐 HTTP (chat / bệnh nhân / xuất / nhập hàng loạt)...")
+            results.update(asyncio.run(_bench_http(app, args, "chat" in stages, "patients" in stages,
+                                                   "import" in stages, workdir, "export" in stages)))
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            f.write(output)
+        print(f"\n💾 Đã ghi kết quả: {args.json}")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
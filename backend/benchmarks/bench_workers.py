@@ -0,0 +1,192 @@
+"""
+So sánh chạy nhiều API worker: mỗi worker tự load model + index (local) và dùng chung retrieval server (remote)
+Đo RAM (RSS) mỗi worker, tổng RAM, QPS và độ trễ retrieval (embedding câu hỏi + tìm kiếm) khi mọi worker
+cùng gửi câu hỏi, cỡ lô embedding trung bình mà retrieval server gom được
+Chạy từ thư mục backend:
+    python -m benchmarks.bench_workers
+    python -m benchmarks.bench_workers --workers 1,2,4,8 --real-embeddings --json workers.json
+Với embedding giả RAM của model gần như bằng 0 -> nên chạy --real-embeddings để thấy khác biệt thật
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+
+import numpy as np
+
+from benchmarks import offline, corpus
+from benchmarks.bench_suite import percentiles, parse_sizes, git_commit
+
+
+REPORT_PREFIX = "@@bench "  # dòng kết quả gửi về tiến trình cha (phân biệt với log của RAGService)
+
+
+def report(payload):
+    sys.stdout.write(REPORT_PREFIX + json.dumps(payload) + "\n")
+    sys.stdout.flush()
+
+
+def rss_mb() -> float:
+    """RAM đang dùng của tiến trình (Linux: /proc, nơi khác: đỉnh RSS)"""
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_server(args):
+    """Tiến trình retrieval server (giống retrieval_server.py, trên dữ liệu giả)"""
+    rag_module = offline.setup(args.workdir, real_embeddings=args.real_embeddings)
+    from app.ingest_jobs import IngestJobQueue
+    from app.retrieval_rpc import RetrievalServer, load_authkey
+    rag = rag_module.RAGService()
+    server = RetrievalServer(rag, IngestJobQueue(rag, os.path.join(args.workdir, "pdfs")), args.address,
+                             load_authkey(rag_module.RETRIEVAL_KEY_PATH, create=True))
+    server.bind()  # socket sẵn sàng rồi mới báo worker kết nối
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    report({"ready": True, "rss_mb": round(rss_mb(), 1)})
+    sys.stdin.read()  # chạy tới khi tiến trình cha đóng stdin
+    report({"rss_mb": round(rss_mb(), 1), **server.stats()})
+
+
+def run_worker(args):
+    """1 API worker: RAGService (local hoặc remote), args.threads luồng gửi câu hỏi liên tục"""
+    rag_module = offline.setup(args.workdir, real_embeddings=args.real_embeddings)
+    rag = rag_module.RAGService(retrieval_server=args.address or None)
+    questions = corpus.synthetic_questions(args.queries, seed=os.getpid())
+    latencies = []
+    lock = threading.Lock()
+    report({"ready": True})
+    sys.stdin.readline()  # chờ tín hiệu bắt đầu để mọi worker chạy cùng lúc
+
+    def loop(offset):
+        for i in range(offset, len(questions), args.threads):
+            started = time.perf_counter()
+            rag._retrieve(questions[i])
+            with lock:
+                latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=loop, args=(i,)) for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    report({"rss_mb": round(rss_mb(), 1), "queries": len(latencies), "seconds": elapsed, "latencies": latencies})
+
+
+def _spawn(role, args, address=""):
+    command = [sys.executable, "-m", "benchmarks.bench_workers", "--role", role, "--workdir", args.workdir,
+               "--address", address, "--queries", str(args.queries), "--threads", str(args.threads)]
+    if args.real_embeddings:
+        command.append("--real-embeddings")
+    env = {**os.environ, "SEMANTIC_CACHE_ENABLED": "0", "CASE_INDEX_ENABLED": "0"}
+    return subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                            text=True, env=env)
+
+
+def _read_json(process):
+    for line in process.stdout:
+        if line.startswith(REPORT_PREFIX):
+            return json.loads(line[len(REPORT_PREFIX):])
+    raise RuntimeError(f"Tiến trình benchmark dừng bất thường (mã {process.wait()})")
+
+
+def bench_mode(args, num_workers: int, address: str = ""):
+    workers = [_spawn("worker", args, address) for _ in range(num_workers)]
+    for worker in workers:
+        _read_json(worker)
+    for worker in workers:
+        worker.stdin.write("go\n")
+        worker.stdin.flush()
+    reports = [_read_json(worker) for worker in workers]
+    for worker in workers:
+        worker.stdin.close()
+        worker.wait()
+    latencies = [ms for report in reports for ms in report["latencies"]]
+    seconds = max(report["seconds"] for report in reports)
+    return {
+        "workers": num_workers,
+        "worker_rss_mb": round(float(np.mean([r["rss_mb"] for r in reports])), 1),
+        "workers_total_rss_mb": round(sum(r["rss_mb"] for r in reports), 1),
+        "qps": round(len(latencies) / seconds, 1),
+        **percentiles(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark nhiều API worker: local và retrieval server dùng chung")
+    parser.add_argument("--workers", type=parse_sizes, default=[1, 2, 4])
+    parser.add_argument("--threads", type=int, default=4, help="Số request đồng thời mỗi worker")
+    parser.add_argument("--queries", type=int, default=200, help="Số câu hỏi mỗi worker")
+    parser.add_argument("--pdfs", type=int, default=3)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--real-embeddings", action="store_true",
+                        help="Dùng model embedding thật theo EMBEDDING_BACKEND (cần model đã tải sẵn)")
+    parser.add_argument("--json", help="Ghi kết quả ra file JSON")
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    parser.add_argument("--role", choices=("main", "server", "worker"), default="main", help=argparse.SUPPRESS)
+    parser.add_argument("--address", default="", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.role == "server":
+        return run_server(args)
+    if args.role == "worker":
+        return run_worker(args)
+
+    args.workdir = tempfile.mkdtemp(prefix="tcm_bench_workers_")
+    results = {"meta": {"commit": git_commit(), "cpu_count": os.cpu_count(),
+                        "embeddings": os.getenv("EMBEDDING_BACKEND", "torch") if args.real_embeddings else "fake",
+                        "args": {k: v for k, v in vars(args).items() if k not in ("json", "workdir", "role", "address")}},
+               "local": [], "remote": []}
+    try:
+        rag_module = offline.setup(args.workdir, real_embeddings=args.real_embeddings)
+        print("📚 Chuẩn bị kho tri thức giả...")
+        rag_module.RAGService().ingest_pdfs(
+            corpus.generate_pdfs(os.path.join(args.workdir, "pdfs"), args.pdfs, args.pages)
+        )
+
+        for num_workers in args.workers:
+            print(f"🧍 Local: {num_workers} worker, mỗi worker tự load model + index...")
+            results["local"].append(bench_mode(args, num_workers))
+
+        address = os.path.join(args.workdir, "retrieval.sock") if os.name != "nt" else "127.0.0.1:8766"
+        server = _spawn("server", args, address)
+        results["server_rss_mb"] = _read_json(server)["rss_mb"]
+        for num_workers in args.workers:
+            print(f"🔌 Remote: {num_workers} worker dùng chung retrieval server...")
+            results["remote"].append(bench_mode(args, num_workers, address))
+        server.stdin.close()
+        results["server"] = _read_json(server)
+        server.wait()
+    finally:
+        shutil.rmtree(args.workdir, ignore_errors=True)
+
+    for mode in ("local", "remote"):
+        for row in results[mode]:
+            print(f"   {mode:6} {row['workers']} worker: {row['worker_rss_mb']} MB/worker "
+                  f"(tổng {row['workers_total_rss_mb']} MB), {row['qps']} query/s, p99 {row['p99_ms']} ms")
+    print(f"   retrieval server: {results['server']['rss_mb']} MB, lô embedding trung bình "
+          f"{results['server']['avg_batch']} query (lớn nhất {results['server']['max_batch']})")
+
+    output = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            f.write(output)
+        print(f"\n💾 Đã ghi kết quả: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Sinh dữ liệu giả cho benchmark
+- PDF nhiều trang có text layer (tự ghi định dạng PDF tối thiểu, không cần thư viện ngoài)
+- Bệnh nhân + lượt khám + chỉ mục tìm kiếm, ghi theo lô
+- File CSV bệnh nhân + lượt khám để đo nhập hàng loạt
+"""
+import os
+import csv
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+# Font chuẩn Helvetica của PDF chỉ có bảng mã Latin -> nội dung sách giả viết không dấu
+_TCM_WORDS = (
+    "am duong ngu hanh tang phu kinh lac khi huyet tan dich phong han thu thap tao hoa "
+    "bieu ly hu thuc nhiet chung benh phap tri bai thuoc vi thuoc quan than ta su "
+    "can tam ty phe than dom ho sot dau dau mat ngu tieu hoa kem chan an tieu chay "
+    "bo khi duong huyet hoat huyet thanh nhiet giai doc tru thap hoa dam chi khai "
+    "nhan sam hoang ky bach truat cam thao duong quy xuyen khung thuc dia bach thuoc"
+).split()
+
+_HO = ["Nguyễn", "Trần", "Lê", "Phạm", "Hoàng", "Huỳnh", "Phan", "Vũ", "Võ", "Đặng", "Bùi", "Đỗ", "Hồ", "Ngô"]
+_DEM = ["Văn", "Thị", "Hữu", "Đức", "Minh", "Ngọc", "Thanh", "Quốc", "Gia", "Thu", "Hoài"]
+_TEN = ["An", "Bình", "Cường", "Dũng", "Giang", "Hà", "Hải", "Hạnh", "Hùng", "Lan", "Linh", "Long",
+        "Mai", "Nam", "Nga", "Phong", "Phúc", "Quân", "Sơn", "Tâm", "Thảo", "Trang", "Tuấn", "Yến"]
+_TINH = ["Hà Nội", "TP Hồ Chí Minh", "Đà Nẵng", "Huế", "Cần Thơ", "Hải Phòng", "Nghệ An", "Thanh Hóa",
+         "Bình Dương", "Đồng Nai", "Quảng Nam", "Khánh Hòa", "Lâm Đồng", "Bắc Ninh"]
+_TRIEU_CHUNG = ["Ho khan, sốt nhẹ", "Đau đầu, chóng mặt", "Mất ngủ, hồi hộp", "Đau lưng, mỏi gối",
+                "Ăn kém, đầy bụng", "Ra mồ hôi trộm", "Tê bì chân tay", "Ho có đờm trắng"]
+_BENH_DANH = ["Khái thấu", "Đầu thống", "Thất miên", "Yêu thống", "Vị quản thống", "Tý chứng"]
+
+
+def _escape_pdf_text(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path: str, pages):
+    """Ghi PDF tối thiểu: mỗi phần tử của pages là list dòng text (ASCII) của 1 trang"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for lines in pages:
+        body = "BT /F1 10 Tf 12 TL 40 800 Td " + " ".join(f"({_escape_pdf_text(line)}) Tj T*" for line in lines) + " ET"
+        stream = body.encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        page_ids.append(len(objects))
+    kids = " ".join(f"{i} 0 R" for i in page_ids).encode("ascii")
+    objects[1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % len(page_ids)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + obj + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def synthetic_page(rng: random.Random, lines: int = 60, words_per_line: int = 14):
+    return [" ".join(rng.choice(_TCM_WORDS) for _ in range(words_per_line)) for _ in range(lines)]
+
+
+def generate_pdfs(directory: str, num_files: int, pages_per_file: int, seed: int = 0):
+    """Sinh num_files sách PDF giả, mỗi file pages_per_file trang; trả về danh sách đường dẫn"""
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    paths = []
+    for i in range(num_files):
+        path = os.path.join(directory, f"synthetic_{seed}_{i:03d}.pdf")
+        write_pdf(path, [synthetic_page(rng) for _ in range(pages_per_file)])
+        paths.append(path)
+    return paths
+
+
+def synthetic_questions(count: int, seed: int = 1):
+    rng = random.Random(seed)
+    return [f"Cau hoi {i}: " + " ".join(rng.choice(_TCM_WORDS) for _ in range(8)) for i in range(count)]
+
+
+def generate_patients(db, count: int, batch_size: int = 5000, seed: int = 0):
+    """
+    Thêm count bệnh nhân giả (kèm 0-3 lượt khám + từ khóa tìm kiếm) vào DB, ghi theo lô.
+    CCCD nối tiếp số bệnh nhân đang có nên gọi nhiều lần để tăng dần cỡ dữ liệu được
+    """
+    from app import models, patient_search  # import muộn: app.database đọc DATABASE_URL lúc import
+
+    rng = random.Random(seed + count)
+    start = db.query(models.BenhNhan).count()
+    base_time = datetime(2020, 1, 1)
+    for offset in range(0, count, batch_size):
+        size = min(batch_size, count - offset)
+        first = start + offset
+        rows = [{
+            "HoTen": f"{rng.choice(_HO)} {rng.choice(_DEM)} {rng.choice(_TEN)}",
+            "NgaySinh": (base_time - timedelta(days=rng.randint(6000, 30000))).date(),
+            "GioiTinh": rng.choice(["Nam", "Nữ"]),
+            "CCCD": f"{first + i:012d}",
+            "DiaChi": f"{rng.randint(1, 300)} đường số {rng.randint(1, 50)}, {rng.choice(_TINH)}",
+            "SDT": f"09{rng.randint(0, 99999999):08d}",
+            "NgayTao": base_time + timedelta(minutes=(first + i) * 7),
+        } for i in range(size)]
+        db.execute(insert(models.BenhNhan), rows)
+
+        patients = db.query(models.BenhNhan.ID, models.BenhNhan.HoTen, models.BenhNhan.DiaChi, models.BenhNhan.NgayTao)\
+            .filter(models.BenhNhan.CCCD.between(rows[0]["CCCD"], rows[-1]["CCCD"])).all()
+        visits = [{
+            "BenhNhanID": patient.ID,
+            "TrieuChung": rng.choice(_TRIEU_CHUNG),
+            "BenhDanh": rng.choice(_BENH_DANH),
+            "NgayKham": patient.NgayTao + timedelta(days=30 * n),
+        } for patient in patients for n in range(rng.randint(0, 3))]
+        if visits:
+            db.execute(insert(models.LuotKham), visits)
+        keywords = [
+            {"TuKhoa": token, "BenhNhanID": patient.ID, "TrongSo": weight}
+            for patient in patients
+            for token, weight in patient_search.patient_tokens(patient).items()
+        ]
+        db.execute(insert(models.BenhNhanTuKhoa), keywords)
+        db.commit()
+    return start + count
+
+
+def patient_import_rows(count: int, seed: int = 0, cccd_prefix: str = "9"):
+    """
+    count bệnh nhân giả theo định dạng nhập hàng loạt: mỗi lượt khám 1 dòng (CCCD lặp lại),
+    bệnh nhân chưa khám lần nào 1 dòng. cccd_prefix khác nhau -> không trùng với generate_patients
+    """
+    rng = random.Random(seed)
+    base_time = datetime(2020, 1, 1)
+    rows = []
+    for i in range(count):
+        patient = {
+            "HoTen": f"{rng.choice(_HO)} {rng.choice(_DEM)} {rng.choice(_TEN)}",
+            "NgaySinh": (base_time - timedelta(days=rng.randint(6000, 30000))).date().isoformat(),
+            "GioiTinh": rng.choice(["Nam", "Nữ"]),
+            "CCCD": f"{cccd_prefix}{i:0{12 - len(cccd_prefix)}d}",
+            "DiaChi": f"{rng.randint(1, 300)} đường số {rng.randint(1, 50)}, {rng.choice(_TINH)}",
+            "SDT": f"09{rng.randint(0, 99999999):08d}",
+        }
+        visits = rng.randint(0, 3)
+        if not visits:
+            rows.append(patient)
+        for n in range(visits):
+            rows.append({
+                **patient,
+                "TrieuChung": rng.choice(_TRIEU_CHUNG),
+                "BenhDanh": rng.choice(_BENH_DANH),
+                "NgayKham": (base_time + timedelta(days=30 * n, minutes=i)).isoformat(),
+            })
+    return rows
+
+
+def write_csv(path: str, rows):
+    fields = list(dict.fromkeys(field for row in rows for field in row))
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields, restval="")
+        writer.writeheader()
+        writer.writerows(rows)
+    return path
@@ -0,0 +1,94 @@
+"""
+Môi trường chạy benchmark hoàn toàn offline
+- StubChatModel thay ChatGoogleGenerativeAI: trả lời giả sau một độ trễ cấu hình được
+- Embedding giả (DeterministicFakeEmbedding, 384 chiều) thay model embedding thật (EMBEDDING_BACKEND), trừ khi dùng --real-embeddings
+- SQLite thay SQL Server (cột MaBenhNhan computed được dịch sang cú pháp SQLite)
+- Mọi dữ liệu (vector store, cache, DB) nằm trong thư mục làm việc tạm, không đụng storage/ thật
+Phải gọi setup() TRƯỚC khi import app.main (app.main tạo RAGService + engine ngay lúc import)
+AI khởi động nền ở sự kiện startup mà ASGITransport không chạy -> gọi rag_service.warm_up() sau khi import
+"""
+import os
+import time
+import asyncio
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+EMBEDDING_DIM = 384
+
+STUB_ANSWER = (
+    "1. Các bệnh có thể gặp: chứng khái thấu do phong hàn. "
+    "2. Phác đồ: sơ phong tán hàn, tuyên phế chỉ khái. "
+    "3. Lời khuyên: giữ ấm, tránh đồ lạnh, ăn cháo hành gừng."
+)
+
+
+class StubChatModel(BaseChatModel):
+    """Chat model giả: chờ `latency` giây (mô phỏng Gemini) rồi trả về câu trả lời cố định"""
+    latency: float = 0.5
+    answer: str = STUB_ANSWER
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub-chat"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.answer))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.answer))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        words = self.answer.split(" ")
+        for word in words:
+            time.sleep(self.latency / len(words))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        words = self.answer.split(" ")
+        for word in words:
+            await asyncio.sleep(self.latency / len(words))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+
+
+def _install_sqlite_computed():
+    """MaBenhNhan là computed column của SQL Server -> dịch sang generated column của SQLite"""
+    from sqlalchemy import Computed
+    from sqlalchemy.ext.compiler import compiles
+
+    @compiles(Computed, "sqlite")
+    def _computed_sqlite(element, compiler, **kw):
+        return "GENERATED ALWAYS AS ('BN' || substr('00000' || ID, -5, 5)) VIRTUAL"
+
+
+def setup(workdir: str, llm_latency: float = 0.5, real_embeddings: bool = False):
+    """Chuẩn bị env + thay LLM/embedding/đường dẫn lưu trữ; trả về module app.rag_service đã vá"""
+    os.makedirs(workdir, exist_ok=True)
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.sqlite3')}"
+    os.environ.setdefault("SEMANTIC_CACHE_ENABLED", "0")  # đo đường đi đầy đủ, không để cache trả lời hộ
+    os.environ.setdefault("GOOGLE_API_KEY", "offline")
+    _install_sqlite_computed()
+
+    from app import rag_service
+
+    vector_db_path = os.path.join(workdir, "vector_db")
+    rag_service.BASE_DIR = workdir  # storage/pdfs không tồn tại -> không tự auto-load PDF thật
+    rag_service.VECTOR_DB_PATH = vector_db_path
+    rag_service.STORE_PATH = os.path.join(vector_db_path, "tcm_store")
+    rag_service.SEMANTIC_CACHE_PATH = os.path.join(vector_db_path, "semantic_cache.sqlite3")
+    rag_service.INGEST_STORE_PATH = os.path.join(vector_db_path, "ingest_store.sqlite3")
+    rag_service.INGEST_JOURNAL_PATH = os.path.join(vector_db_path, "ingest_journal.jsonl")
+    rag_service.CASE_INDEX_PATH = os.path.join(vector_db_path, "case_index.sqlite3")
+    rag_service.WRITER_LOCK_PATH = os.path.join(vector_db_path, "writer.lock")
+    rag_service.RETRIEVAL_KEY_PATH = os.path.join(workdir, "retrieval.key")
+    rag_service.RETRIEVAL_SERVER = ""  # app.main chạy 1 tiến trình (bench_workers tự dựng retrieval server)
+    os.makedirs(vector_db_path, exist_ok=True)
+
+    rag_service.ChatGoogleGenerativeAI = lambda **kwargs: StubChatModel(latency=llm_latency)
+    if not real_embeddings:
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+        rag_service.create_embeddings = lambda params=None: DeterministicFakeEmbedding(size=EMBEDDING_DIM)
+    return rag_service
@@ -0,0 +1,66 @@
+"""
+Script chuyển đổi FAISS index đã có (storage/vector_db/tcm_store) sang loại khác
+Ví dụ:
+    python convert_index.py --type hnsw
+    python convert_index.py --type ivf_pq --nlist 1024 --pq-m 48
+Chuyển từng segment (mỗi tài liệu 1 segment); segment quá ít vector để train IVF thì giữ flat.
+Thứ tự vector giữ nguyên nên nội dung chunk (chunks.bin) không phải ghi lại.
+Không cần load model embedding. API server đang chạy tự nạp index mới (snapshot version mới), không cần restart.
+"""
+import time
+import argparse
+
+from app.rag_service import STORE_PATH, WRITER_LOCK_PATH
+from app.writer_lock import WriterLock
+from app.segment_store import SegmentStore
+from app.index_factory import INDEX_TYPES, index_params_from_env, index_type_of, index_memory_bytes
+
+
+def main():
+    defaults = index_params_from_env()
+    parser = argparse.ArgumentParser(description="Chuyển FAISS index sang flat/hnsw/ivf_flat/ivf_pq")
+    parser.add_argument("--type", choices=INDEX_TYPES, default=defaults["type"])
+    parser.add_argument("--nlist", type=int, default=defaults["nlist"], help="Số cụm IVF (0 = tự tính)")
+    parser.add_argument("--nprobe", type=int, default=defaults["nprobe"])
+    parser.add_argument("--hnsw-m", type=int, default=defaults["hnsw_m"])
+    parser.add_argument("--ef-construction", type=int, default=defaults["ef_construction"])
+    parser.add_argument("--ef-search", type=int, default=defaults["ef_search"])
+    parser.add_argument("--pq-m", type=int, default=defaults["pq_m"])
+    parser.add_argument("--pq-nbits", type=int, default=defaults["pq_nbits"])
+    parser.add_argument("--train-size", type=int, default=defaults["train_size"])
+    args = parser.parse_args()
+
+    params = {
+        "type": args.type, "nlist": args.nlist, "nprobe": args.nprobe,
+        "hnsw_m": args.hnsw_m, "ef_construction": args.ef_construction, "ef_search": args.ef_search,
+        "pq_m": args.pq_m, "pq_nbits": args.pq_nbits, "train_size": args.train_size,
+    }
+
+    if not SegmentStore.exists(STORE_PATH):
+        print(f"❌ Không tìm thấy kho vector: {STORE_PATH}")
+        return
+
+    # Giữ khóa ghi suốt quá trình: không chạy chồng với ingest của API / pdf_watcher.py
+    writer_lock = WriterLock(WRITER_LOCK_PATH)
+    with writer_lock:
+        convert_store(params, writer_lock)
+
+
+def convert_store(params: dict, writer_lock):
+    store = SegmentStore.load(STORE_PATH, use_mmap=False, index_params=params, writer_lock=writer_lock)
+    indexes = [segment.index for segment in store.segments.values()]
+    types = sorted({index_type_of(index) for index in indexes})
+    print(f"📂 Index hiện tại: {', '.join(types) or 'trống'}, {len(indexes)} segment, "
+          f"{sum(index.ntotal for index in indexes)} vector, "
+          f"{sum(index_memory_bytes(index) for index in indexes) / (1024 * 1024):.2f} MB")
+
+    # Mỗi segment ghi index mới thành generation kế tiếp rồi mới đổi meta.json của segment (atomic)
+    started = time.perf_counter()
+    converted = store.convert(params)
+    size = sum(index_memory_bytes(segment.index) for segment in store.segments.values())
+    print(f"✅ Đã chuyển {converted}/{len(indexes)} segment sang {params['type']} trong "
+          f"{time.perf_counter() - started:.1f}s, {size / (1024 * 1024):.2f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Script xuất toàn bộ bệnh nhân + lượt khám ra NDJSON / CSV (báo cáo, sao lưu), cùng logic GET /api/patients/export
+Đọc bằng server-side cursor theo khối -> RAM không đổi dù bảng lớn cỡ nào
+    python export_patients.py benh_nhan.ndjson
+    python export_patients.py benh_nhan.csv --since 2025-01-01T00:00:00   # chỉ phần mới từ lần xuất trước
+File xuất nhập lại được bằng import_patients.py
+"""
+import os
+import time
+import argparse
+from datetime import datetime
+
+from app.database import SessionLocal
+from app.patient_import import detect_format
+from app.patient_export import iter_export, new_stats, EXPORT_CHUNK_SIZE, FORMATS
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Xuất bệnh nhân + lượt khám ra NDJSON / CSV")
+    parser.add_argument("path", help="File .ndjson / .csv")
+    parser.add_argument("--format", choices=FORMATS, help="Định dạng (mặc định theo đuôi file)")
+    parser.add_argument("--since", type=datetime.fromisoformat,
+                        help="Chỉ xuất bệnh nhân tạo / lượt khám từ thời điểm này (ISO, VD 2025-01-01T00:00:00)")
+    parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE, help="Số dòng đọc mỗi lần từ DB")
+    args = parser.parse_args()
+
+    try:
+        fmt = detect_format(args.path, args.format)
+    except ValueError as e:
+        parser.error(str(e))
+
+    started_at = datetime.now()
+    started = time.perf_counter()
+    print(f"📤 Đang xuất ra {args.path} ({fmt})" + (f", từ {args.since.isoformat()}" if args.since else "") + "...")
+    stats = new_stats()
+    tmp_path = args.path + ".part"
+    with SessionLocal() as db, open(tmp_path, "w", encoding="utf-8", newline="") as f:
+        for chunk in iter_export(db, fmt, args.since, args.chunk_size, stats):
+            f.write(chunk)
+    os.replace(tmp_path, args.path)  # file đích chỉ xuất hiện khi đã xuất xong
+
+    elapsed = time.perf_counter() - started
+    size_mb = os.path.getsize(args.path) / (1024 * 1024)
+    print(f"✅ Đã xuất {stats['patients']} bệnh nhân, {stats['visits']} lượt khám ({size_mb:.1f} MB) "
+          f"trong {elapsed:.1f}s ({stats['rows'] / elapsed:.0f} dòng/s)")
+    print(f"   Lần sau xuất tiếp: --since {started_at.isoformat(timespec='seconds')}")
+
+
+if __name__ == "__main__":
+    main()
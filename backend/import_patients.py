@@ -0,0 +1,52 @@
+"""
+Script nhập hàng loạt bệnh nhân + lượt khám từ CSV / NDJSON (onboarding phòng khám mới)
+Cùng logic với POST /api/patients/import: kiểm tra từng dòng, bỏ CCCD đã có, ghi theo lô
+    python import_patients.py benh_nhan.csv
+    python import_patients.py du_lieu.ndjson --batch-size 5000 --report import_report.json
+    python import_patients.py benh_nhan.csv --dry-run        # chỉ kiểm tra, không ghi DB
+Lượt khám mới được đưa vào chỉ mục ca bệnh khi API khởi động lại (hoặc chạy rebuild_case_index.py)
+"""
+import json
+import argparse
+
+from app.database import SessionLocal, engine
+from app import models
+from app.patient_import import detect_format, import_file, IMPORT_BATCH_SIZE, FORMATS
+
+MAX_PRINTED_ERRORS = 20
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Nhập hàng loạt bệnh nhân + lượt khám từ CSV / NDJSON")
+    parser.add_argument("path", help="File .csv / .ndjson")
+    parser.add_argument("--format", choices=FORMATS, help="Định dạng (mặc định theo đuôi file)")
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE, help="Số dòng mỗi lô (1 commit)")
+    parser.add_argument("--dry-run", action="store_true", help="Chỉ kiểm tra dữ liệu, không ghi DB")
+    parser.add_argument("--report", help="Ghi báo cáo đầy đủ (kèm lỗi từng dòng) ra file JSON")
+    args = parser.parse_args()
+
+    try:
+        fmt = detect_format(args.path, args.format)
+    except ValueError as e:
+        parser.error(str(e))
+
+    models.Base.metadata.create_all(bind=engine)
+    print(f"📥 Đang nhập {args.path} ({fmt}, lô {args.batch_size} dòng)...")
+    with SessionLocal() as db, open(args.path, "rb") as f:
+        try:
+            report = import_file(db, f, fmt, batch_size=args.batch_size, dry_run=args.dry_run)
+        except ValueError as e:
+            parser.error(str(e))
+
+    for error in report["errors"][:MAX_PRINTED_ERRORS]:
+        print(f"   ⚠️ Dòng {error['line']} ({error['CCCD'] or '-'}): {error['error']}")
+    if len(report["errors"]) > MAX_PRINTED_ERRORS:
+        print(f"   ... và {len(report['errors']) - MAX_PRINTED_ERRORS} dòng khác (xem --report)")
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 Đã ghi báo cáo: {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,11 +3,13 @@ Script để load tất cả PDF có sẵn vào Vector Database
 Chạy script này 1 lần để import tất cả tài liệu
 """
 import os
+import argparse
 from app.rag_service import RAGService
+from app.ingest_pipeline import default_workers
 
 PDF_DIR = os.path.join("storage", "pdfs")
 
-def load_all_pdfs():
+def load_all_pdfs(workers: int = None):
     """Load tất cả PDF files vào vector database"""
     rag = RAGService()
     
@@ -19,32 +21,28 @@ def load_all_pdfs():
         return
     
     print(f"📚 Tìm thấy {len(pdf_files)} file PDF:")
-    for pdf in pdf_files:
-        print(f"  - {pdf}")
+    for idx, pdf_file in enumerate(pdf_files, 1):
+        file_size = os.path.getsize(os.path.join(PDF_DIR, pdf_file)) / (1024 * 1024)  # MB
+        print(f"  [{idx}/{len(pdf_files)}] {pdf_file} ({file_size:.2f} MB)")
     
     print("\n" + "="*60)
-    print("🚀 Bắt đầu xử lý...")
+    print(f"🚀 Bắt đầu xử lý với {workers or default_workers()} worker...")
     print("="*60 + "\n")
     
-    total_chunks = 0
-    for idx, pdf_file in enumerate(pdf_files, 1):
-        pdf_path = os.path.join(PDF_DIR, pdf_file)
-        file_size = os.path.getsize(pdf_path) / (1024 * 1024)  # MB
-        
-        print(f"\n📖 [{idx}/{len(pdf_files)}] Đang xử lý: {pdf_file}")
-        print(f"   Kích thước: {file_size:.2f} MB")
-        
-        try:
-            chunks = rag.ingest_pdf(pdf_path)
-            total_chunks += chunks
-            print(f"   ✅ Hoàn thành: {chunks} đoạn kiến thức")
-        except Exception as e:
-            print(f"   ❌ Lỗi: {str(e)}")
+    # Bulk ingest: embedding theo lô lớn, chỉ ghi index xuống ổ cứng 1 lần
+    report = rag.ingest_pdfs([os.path.join(PDF_DIR, f) for f in pdf_files], workers=workers)
     
     print("\n" + "="*60)
     print(f"🎉 HOÀN TẤT!")
-    print(f"📊 Tổng cộng: {total_chunks} đoạn kiến thức từ {len(pdf_files)} file PDF")
+    print(f"📊 Tổng cộng: {report['chunks_added']} đoạn kiến thức mới từ {len(pdf_files)} file PDF")
+    print(f"   Đã học: {report['files_ingested']} | Bỏ qua (không đổi): {report['files_skipped']} | Lỗi: {report['files_failed']}")
+    print(f"   Tốc độ: {report['pages_per_sec']} trang/s, {report['chunks_per_sec']} chunk/s")
+    print(f"   Dung lượng đã ghi: {report['bytes_written'] / (1024 * 1024):.2f} MB")
     print("="*60)
 
 if __name__ == "__main__":
-    load_all_pdfs()
+    parser = argparse.ArgumentParser(description="Nạp tất cả PDF trong storage/pdfs vào Vector Database")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Số tiến trình parse + chunk song song (mặc định: INGEST_WORKERS hoặc số CPU)")
+    args = parser.parse_args()
+    load_all_pdfs(workers=args.workers)
@@ -1,58 +1,138 @@
 """
 Script giám sát và xử lý tự động các PDF files
 Tự động phát hiện PDF mới trong storage/pdfs và nạp vào AI
+- Debounce: mỗi file chờ WATCHER_DEBOUNCE_SECONDS giây không có sự kiện mới và kích thước không đổi
+  (đang copy/upload dở thì chờ tiếp), các file sẵn sàng cùng lúc được học chung 1 đợt (1 lần commit)
+- Ghi kho vector qua writer lock: chạy song song với API server an toàn, API tự nạp snapshot mới
 """
 import os
 import time
+import threading
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 from app.rag_service import RAGService
 
 PDF_DIR = os.path.join("storage", "pdfs")
+# Số giây yên lặng (không có sự kiện ghi) trước khi coi file đã copy xong
+DEBOUNCE_SECONDS = float(os.getenv("WATCHER_DEBOUNCE_SECONDS", "2"))
 
 class PDFHandler(FileSystemEventHandler):
     """Handler để theo dõi thay đổi trong folder PDFs"""
-    def __init__(self):
+    def __init__(self, debounce: float = DEBOUNCE_SECONDS):
         self.rag = RAGService()
-        
+        self.debounce = debounce
+        self.pending = {}  # đường dẫn -> (thời điểm sự kiện cuối, kích thước lúc đó)
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.worker = threading.Thread(target=self._run, name="pdf-ingest", daemon=True)
+        self.worker.start()
+
+    def _touch(self, path: str):
+        """Ghi nhận sự kiện của 1 file PDF (bỏ qua file tạm/ẩn), đặt lại đồng hồ debounce"""
+        name = os.path.basename(path)
+        if not name.lower().endswith('.pdf') or name.startswith('.'):
+            return
+        with self.lock:
+            if path not in self.pending:
+                print(f"\n🆕 Phát hiện PDF mới: {name}")
+            self.pending[path] = (time.monotonic(), self._size(path))
+        self.wakeup.set()
+
+    @staticmethod
+    def _size(path: str):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return None
+
     def on_created(self, event):
         """Khi có file mới được tạo"""
-        if event.is_directory:
-            return
-        
-        if event.src_path.endswith('.pdf'):
-            print(f"\n🆕 Phát hiện PDF mới: {os.path.basename(event.src_path)}")
-            # Đợi file được copy xong (nếu đang upload)
-            time.sleep(2)
-            
-            try:
-                chunks = self.rag.ingest_pdf(event.src_path)
-                print(f"✅ Đã nạp thành công: {chunks} chunks")
-            except Exception as e:
-                print(f"❌ Lỗi khi nạp PDF: {str(e)}")
+        if not event.is_directory:
+            self._touch(event.src_path)
+
+    def on_modified(self, event):
+        """File đang được ghi tiếp (copy file lớn) -> lùi thời điểm học"""
+        if not event.is_directory:
+            self._touch(event.src_path)
+
+    def on_moved(self, event):
+        """Upload ghi ra file tạm rồi đổi tên sang .pdf"""
+        if not event.is_directory:
+            self._touch(event.dest_path)
+
+    def _ready(self):
+        """Lấy các file đã yên lặng đủ lâu và kích thước không đổi; trả về (file sẵn sàng, giây chờ tiếp)"""
+        now = time.monotonic()
+        ready = []
+        wait = None
+        with self.lock:
+            for path, (last_event, size) in list(self.pending.items()):
+                remaining = last_event + self.debounce - now
+                if remaining <= 0:
+                    current = self._size(path)
+                    if current is None:
+                        del self.pending[path]  # file đã bị xóa/đổi tên
+                        continue
+                    if current != size:
+                        # Vẫn đang ghi nhưng không phát sự kiện (ổ mạng...) -> chờ thêm 1 chu kỳ
+                        self.pending[path] = (now, current)
+                        remaining = self.debounce
+                    else:
+                        del self.pending[path]
+                        ready.append(path)
+                        continue
+                wait = remaining if wait is None else min(wait, remaining)
+        return ready, wait
+
+    def _run(self):
+        while not self.stopped.is_set():
+            ready, wait = self._ready()
+            if ready:
+                self._ingest(ready)
+                continue
+            self.wakeup.wait(wait)
+            self.wakeup.clear()
+
+    def _ingest(self, paths):
+        names = ", ".join(os.path.basename(path) for path in paths)
+        print(f"📥 Đang nạp {len(paths)} PDF: {names}")
+        try:
+            # Chờ writer lock nếu API / load_pdfs.py đang ghi kho vector
+            report = self.rag.ingest_pdfs(paths)
+            print(f"✅ Đã nạp thành công: {report['chunks_added']} chunks "
+                  f"({report['files_ingested']} file mới, {report['files_skipped']} file không đổi)")
+        except Exception as e:
+            print(f"❌ Lỗi khi nạp PDF: {str(e)}")
+
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
+        self.worker.join()
 
 def watch_pdf_folder():
     """Theo dõi folder PDF và tự động xử lý file mới"""
     if not os.path.exists(PDF_DIR):
         os.makedirs(PDF_DIR)
         print(f"✅ Đã tạo thư mục: {PDF_DIR}")
-    
+
     event_handler = PDFHandler()
     observer = Observer()
     observer.schedule(event_handler, PDF_DIR, recursive=False)
     observer.start()
-    
+
     print(f"👁️  Đang theo dõi thư mục: {PDF_DIR}")
     print("📂 Mọi PDF mới sẽ được tự động nạp vào AI")
     print("Nhấn Ctrl+C để dừng...\n")
-    
+
     try:
         while True:
             time.sleep(1)
     except KeyboardInterrupt:
         observer.stop()
+        event_handler.stop()
         print("\n⏹️  Đã dừng theo dõi")
-    
+
     observer.join()
 
 if __name__ == "__main__":
@@ -0,0 +1,43 @@
+"""
+Script xây lại chỉ mục ca bệnh tương tự (storage/vector_db/case_index.sqlite3) từ bảng LuotKham
+Chạy sau khi import/sửa lượt khám trực tiếp bằng SQL (VD: storage/tcm_clinic.sql)
+Lượt khám có chẩn đoán không đổi dùng lại vector cũ; --reembed để embedding lại tất cả (sau khi đổi model)
+    python rebuild_case_index.py
+    python rebuild_case_index.py --reembed --batch-size 512
+"""
+import time
+import argparse
+
+from app.database import SessionLocal, engine
+from app import models
+from app.case_index import CaseIndex
+from app.embedding_factory import create_embeddings
+from app.rag_service import CASE_INDEX_PATH, EMBED_BATCH_SIZE
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Xây lại chỉ mục ca bệnh tương tự từ bảng LuotKham")
+    parser.add_argument("--reembed", action="store_true", help="Embedding lại toàn bộ, không dùng vector cũ")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE, help="Số lượt khám mỗi lô embedding")
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=engine)
+    case_index = CaseIndex(CASE_INDEX_PATH, create_embeddings(), batch_size=args.batch_size)
+    db = SessionLocal()
+    started = time.perf_counter()
+
+    def progress(scanned, embedded):
+        elapsed = time.perf_counter() - started
+        print(f"   ... {scanned} lượt khám ({embedded} embedding), {scanned / elapsed:.0f} lượt/s")
+
+    try:
+        report = case_index.rebuild(db, reembed=args.reembed, progress=progress)
+        elapsed = time.perf_counter() - started
+        print(f"✅ Chỉ mục ca bệnh: {report['total']} ca ({report['scanned']} lượt khám đã quét, "
+              f"{report['embedded']} embedding, bỏ {report['removed']} ca đã xóa) trong {elapsed:.1f}s")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+"""
+Script xây lại chỉ mục tìm kiếm bệnh nhân (bảng BenhNhanTuKhoa) từ bảng BenhNhan
+Bệnh nhân chưa có từ khóa nào được API tự bổ sung lúc khởi động; chạy script này khi sửa
+HoTen / DiaChi trực tiếp bằng SQL (từ khóa cũ không còn đúng)
+"""
+import time
+
+from app.database import SessionLocal, engine
+from app import models, patient_search
+
+
+def main():
+    models.Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        total = patient_search.rebuild_index(db)
+        print(f"✅ Đã lập chỉ mục {total} bệnh nhân trong {time.perf_counter() - started:.1f}s")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Retrieval server: 1 tiến trình giữ model embedding + kho vector + chỉ mục ca bệnh + hàng đợi ingest
+cho mọi API worker -> chạy uvicorn nhiều worker mà RAM không nhân theo số worker
+    python retrieval_server.py                                    # nghe tại RETRIEVAL_SERVER
+    RETRIEVAL_SERVER=storage/retrieval.sock uvicorn app.main:app --workers 4
+Chạy từ thư mục backend (worker và server phải thấy cùng storage/pdfs).
+Authkey tự tạo ở storage/retrieval.key (hoặc đặt RETRIEVAL_SERVER_AUTHKEY cho mọi tiến trình).
+"""
+import os
+import time
+import argparse
+import threading
+
+from app.rag_service import RAGService, RETRIEVAL_SERVER, RETRIEVAL_KEY_PATH
+from app.ingest_jobs import IngestJobQueue
+from app.retrieval_rpc import RetrievalServer, load_authkey
+
+PDF_DIR = os.path.join("storage", "pdfs")
+DEFAULT_ADDRESS = "127.0.0.1:8765" if os.name == "nt" else os.path.join("storage", "retrieval.sock")
+
+
+def sync_case_index(rag):
+    """Bắt kịp lượt khám thêm/xóa thẳng trong DB khi server tắt (giống API chạy 1 tiến trình)"""
+    from app.database import SessionLocal
+    started = time.perf_counter()
+    try:
+        with SessionLocal() as db:
+            report = rag.case_index.sync(db)
+        print(f"🩺 Đồng bộ chỉ mục ca bệnh: +{report['scanned']} lượt khám ({report['embedded']} embedding), "
+              f"-{report['removed']}, tổng {report['total']} ca trong {time.perf_counter() - started:.1f}s")
+    except Exception as e:
+        print(f"⚠️ Không đồng bộ được chỉ mục ca bệnh: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrieval server dùng chung cho nhiều API worker")
+    parser.add_argument("--address", default=RETRIEVAL_SERVER or DEFAULT_ADDRESS,
+                        help="Unix socket (đường dẫn), host:port hoặc \\\\.\\pipe\\tên (mặc định: RETRIEVAL_SERVER)")
+    args = parser.parse_args()
+
+    os.makedirs(PDF_DIR, exist_ok=True)
+    rag = RAGService()
+    rag.start_snapshot_watch()  # tài liệu do pdf_watcher.py / load_pdfs.py học được nạp luôn
+    if rag.case_index:
+        threading.Thread(target=sync_case_index, args=(rag,), name="case-index-sync", daemon=True).start()
+
+    server = RetrievalServer(rag, IngestJobQueue(rag, PDF_DIR), args.address, load_authkey(RETRIEVAL_KEY_PATH, create=True))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n⏹️  Đã dừng retrieval server")
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -32,7 +32,7 @@ CREATE TABLE BenhNhan (
     LienHeKhanCap NVARCHAR(255),
     TienSuBanThan NVARCHAR(MAX),
     TienSuGiaDinh NVARCHAR(MAX),
-    NgayTao DATETIME DEFAULT GETDATE()
+    NgayTao DATETIME NOT NULL DEFAULT GETDATE() -- NOT NULL: phân trang keyset không cần nhánh IS NULL
 );
 
 -- 3. TẠO BẢNG 2: LỊCH SỬ LƯỢT KHÁM
@@ -47,20 +47,44 @@ CREATE TABLE LuotKham (
     ChamCuuXoaBop NVARCHAR(MAX),
     CheDoAnUongSinhHoat NVARCHAR(MAX),
     LoiDanBacSi NVARCHAR(MAX),
-    NgayKham DATETIME DEFAULT GETDATE(),
+    NgayKham DATETIME NOT NULL DEFAULT GETDATE(),
     
     CONSTRAINT FK_LuotKham_BenhNhan FOREIGN KEY (BenhNhanID) REFERENCES BenhNhan(ID)
 );
 GO
 
+-- 3a. INDEX PHỤC VỤ DANH SÁCH / LỊCH SỬ KHÁM
+-- Phân trang keyset: ORDER BY NgayTao DESC, ID DESC
+CREATE INDEX IX_BenhNhan_NgayTao_ID ON BenhNhan(NgayTao DESC, ID DESC);
+-- Lượt khám mới nhất + lịch sử khám theo bệnh nhân
+CREATE INDEX IX_LuotKham_BenhNhanID_NgayKham ON LuotKham(BenhNhanID, NgayKham DESC, LuotKhamID DESC);
+GO
+
+-- 3b. CHỈ MỤC TÌM KIẾM BỆNH NHÂN
+-- Tìm theo tiền tố SĐT (CCCD đã có index nhờ UNIQUE)
+CREATE INDEX IX_BenhNhan_SDT ON BenhNhan(SDT);
+
+-- Chỉ mục đảo: từ khóa (đã bỏ dấu, viết thường) của HoTen/DiaChi -> bệnh nhân
+-- Dữ liệu mẫu bên dưới tự ghi từ khóa; bệnh nhân chèn bằng SQL khác thì API tự bổ sung lúc khởi động
+-- (bệnh nhân chưa có từ khóa nào), hoặc chạy: python rebuild_search_index.py
+CREATE TABLE BenhNhanTuKhoa (
+    TuKhoa VARCHAR(64) NOT NULL,
+    BenhNhanID INT NOT NULL,
+    TrongSo INT NOT NULL DEFAULT 1,
+    CONSTRAINT PK_BenhNhanTuKhoa PRIMARY KEY (TuKhoa, BenhNhanID),
+    CONSTRAINT FK_BenhNhanTuKhoa_BenhNhan FOREIGN KEY (BenhNhanID) REFERENCES BenhNhan(ID)
+);
+CREATE INDEX IX_BenhNhanTuKhoa_BenhNhanID ON BenhNhanTuKhoa(BenhNhanID);
+GO
+
 -- 4. CHÈN 100 BẢN GHI MẪU (Dữ liệu thật, không trùng lặp)
 DECLARE @i INT = 1;
 DECLARE @CurrentBN_ID INT;
 
--- Danh sách tên mẫu để random
-CREATE TABLE #Ho (H NVARCHAR(20)); INSERT INTO #Ho VALUES (N'Nguyễn'), (N'Trần'), (N'Lê'), (N'Phạm'), (N'Hoàng'), (N'Phan'), (N'Vũ'), (N'Đặng'), (N'Bùi'), (N'Đỗ'), (N'Hồ'), (N'Ngô'), (N'Dương'), (N'Lý'), (N'Trịnh');
-CREATE TABLE #Dem (D NVARCHAR(20)); INSERT INTO #Dem VALUES (N'Văn'), (N'Thị'), (N'Minh'), (N'Đức'), (N'Hồng'), (N'Ngọc'), (N'Bảo'), (N'Quốc'), (N'Thành'), (N'Anh');
-CREATE TABLE #Ten (T NVARCHAR(20)); INSERT INTO #Ten VALUES (N'An'), (N'Bình'), (N'Cường'), (N'Dũng'), (N'Giang'), (N'Hương'), (N'Lan'), (N'Minh'), (N'Nam'), (N'Phúc'), (N'Sơn'), (N'Tùng'), (N'Uyên'), (N'Vinh'), (N'Yến'), (N'Trang'), (N'Thắng'), (N'Hùng'), (N'Kiên'), (N'Hà');
+-- Danh sách tên mẫu để random (K: từ khóa đã bỏ dấu, viết thường cho BenhNhanTuKhoa)
+CREATE TABLE #Ho (H NVARCHAR(20), K VARCHAR(20)); INSERT INTO #Ho VALUES (N'Nguyễn', 'nguyen'), (N'Trần', 'tran'), (N'Lê', 'le'), (N'Phạm', 'pham'), (N'Hoàng', 'hoang'), (N'Phan', 'phan'), (N'Vũ', 'vu'), (N'Đặng', 'dang'), (N'Bùi', 'bui'), (N'Đỗ', 'do'), (N'Hồ', 'ho'), (N'Ngô', 'ngo'), (N'Dương', 'duong'), (N'Lý', 'ly'), (N'Trịnh', 'trinh');
+CREATE TABLE #Dem (D NVARCHAR(20), K VARCHAR(20)); INSERT INTO #Dem VALUES (N'Văn', 'van'), (N'Thị', 'thi'), (N'Minh', 'minh'), (N'Đức', 'duc'), (N'Hồng', 'hong'), (N'Ngọc', 'ngoc'), (N'Bảo', 'bao'), (N'Quốc', 'quoc'), (N'Thành', 'thanh'), (N'Anh', 'anh');
+CREATE TABLE #Ten (T NVARCHAR(20), K VARCHAR(20)); INSERT INTO #Ten VALUES (N'An', 'an'), (N'Bình', 'binh'), (N'Cường', 'cuong'), (N'Dũng', 'dung'), (N'Giang', 'giang'), (N'Hương', 'huong'), (N'Lan', 'lan'), (N'Minh', 'minh'), (N'Nam', 'nam'), (N'Phúc', 'phuc'), (N'Sơn', 'son'), (N'Tùng', 'tung'), (N'Uyên', 'uyen'), (N'Vinh', 'vinh'), (N'Yến', 'yen'), (N'Trang', 'trang'), (N'Thắng', 'thang'), (N'Hùng', 'hung'), (N'Kiên', 'kien'), (N'Hà', 'ha');
 
 -- Mẫu bệnh lý Đông Y
 CREATE TABLE #Samples (BD NVARCHAR(100), CD NVARCHAR(100), TC NVARCHAR(MAX), BT NVARCHAR(MAX));
@@ -74,7 +98,11 @@ INSERT INTO #Samples VALUES
 WHILE @i <= 100
 BEGIN
     -- Tạo thông tin Bệnh nhân mới
-    DECLARE @HoTen NVARCHAR(100) = (SELECT TOP 1 H FROM #Ho ORDER BY NEWID()) + ' ' + (SELECT TOP 1 D FROM #Dem ORDER BY NEWID()) + ' ' + (SELECT TOP 1 T FROM #Ten ORDER BY NEWID());
+    DECLARE @H NVARCHAR(20), @HK VARCHAR(20), @D NVARCHAR(20), @DK VARCHAR(20), @T NVARCHAR(20), @TK VARCHAR(20);
+    SELECT TOP 1 @H = H, @HK = K FROM #Ho ORDER BY NEWID();
+    SELECT TOP 1 @D = D, @DK = K FROM #Dem ORDER BY NEWID();
+    SELECT TOP 1 @T = T, @TK = K FROM #Ten ORDER BY NEWID();
+    DECLARE @HoTen NVARCHAR(100) = @H + ' ' + @D + ' ' + @T;
     DECLARE @CCCD VARCHAR(20) = CAST(CAST(ABS(CHECKSUM(NEWID())) % 1000000000000 AS BIGINT) AS VARCHAR(20));
     
     INSERT INTO BenhNhan (HoTen, NgaySinh, GioiTinh, CCCD, DiaChi, SDT, TienSuBanThan)
@@ -83,6 +111,15 @@ BEGIN
     -- Lấy ID của bệnh nhân vừa chèn
     SET @CurrentBN_ID = SCOPE_IDENTITY();
 
+    -- Từ khóa tìm kiếm, cùng trọng số với patient_search.patient_tokens (HoTen 3, DiaChi 1, cộng dồn)
+    INSERT INTO BenhNhanTuKhoa (TuKhoa, BenhNhanID, TrongSo)
+    SELECT TuKhoa, @CurrentBN_ID, SUM(TrongSo) FROM (
+        SELECT DISTINCT TuKhoa, 3 AS TrongSo FROM (VALUES (@HK), (@DK), (@TK)) AS HoTen(TuKhoa)
+        UNION ALL
+        SELECT TuKhoa, 1 FROM (VALUES ('ha'), ('noi')) AS DiaChi(TuKhoa)
+    ) AS TuKhoaBenhNhan
+    GROUP BY TuKhoa;
+
     -- Cho bệnh nhân này đi khám từ 1-3 lần
     DECLARE @v INT = 1;
     DECLARE @MaxV INT = (ABS(CHECKSUM(NEWID())) % 3) + 1;
@@ -75,20 +75,29 @@ Hãy mô tả triệu chứng, tôi sẽ hỗ trợ bạn!`
         setLoading(true);
 
         try {
-            const response = await api.chat(input);
-
-            // Format response with sources
-            let formattedContent = response.answer;
-
-            // Sources are handled separately in the UI now, but keep text appending just in case
-            // actually let's keep it separate in the object
-
-            const aiMessage = {
-                role: 'assistant',
-                content: formattedContent,
-                sources: response.sources || []
+            // Streaming: hiển thị nguồn ngay sau retrieval, sau đó nối dần từng token
+            let started = false;
+            const updateAiMessage = (patch) => {
+                if (!started) {
+                    started = true;
+                    setMessages(prev => [...prev, { role: 'assistant', content: '', sources: [] }]);
+                }
+                setMessages(prev => {
+                    const last = prev[prev.length - 1];
+                    return [...prev.slice(0, -1), { ...last, ...patch(last) }];
+                });
             };
-            setMessages(prev => [...prev, aiMessage]);
+
+            await api.chatStream(input, (event) => {
+                if (event.type === 'sources') {
+                    updateAiMessage(() => ({ sources: event.sources || [] }));
+                } else if (event.type === 'token') {
+                    setLoading(false);
+                    updateAiMessage((last) => ({ content: last.content + event.content }));
+                } else if (event.type === 'error') {
+                    throw new Error(event.detail);
+                }
+            });
         } catch (error) {
             const errorMessage = {
                 role: 'assistant',
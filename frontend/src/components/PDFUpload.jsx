@@ -1,4 +1,4 @@
-import { useState } from 'react';
+import { useState, useEffect } from 'react';
 import { Upload, FileText, CheckCircle, Book, Sparkles, AlertCircle } from 'lucide-react';
 import { api } from '../services/api';
 
@@ -7,6 +7,37 @@ export default function PDFUpload() {
     const [loading, setLoading] = useState(false);
     const [result, setResult] = useState(null);
 
+    // Job học tài liệu chạy nền -> hỏi tiến độ mỗi giây tới khi xong
+    useEffect(() => {
+        if (!result || result.status === 'done' || result.status === 'failed') return;
+        const timer = setTimeout(async () => {
+            try {
+                setResult(await api.getIngestJob(result.job_id));
+            } catch (error) {
+                setResult({ ...result, status: 'failed', error: error.message });
+            }
+        }, 1000);
+        return () => clearTimeout(timer);
+    }, [result]);
+
+    const jobTitle = (job) => {
+        if (job.status === 'queued') return `Đang xếp hàng${job.queue_position ? ` (vị trí ${job.queue_position})` : ''}...`;
+        if (job.status === 'running') return job.stage === 'embedding' ? 'Đang học tài liệu...' : 'Đang đọc PDF...';
+        if (job.status === 'failed') return 'Học tài liệu thất bại';
+        return 'Thành công';
+    };
+
+    const jobMessage = (job) => {
+        if (job.status === 'failed') return job.error;
+        if (job.status === 'done') {
+            return job.skipped
+                ? 'Tài liệu này đã được học từ trước.'
+                : `Đã học xong tài liệu. Chia thành ${job.chunks_added} đoạn kiến thức.`;
+        }
+        if (job.chunks) return `${job.pages} trang - đã xử lý ${job.chunks_processed}/${job.chunks} đoạn`;
+        return job.message || 'Vui lòng chờ trong giây lát';
+    };
+
     const handleFileChange = (e) => {
         const selectedFile = e.target.files[0];
         if (selectedFile && selectedFile.type === 'application/pdf') {
@@ -26,7 +57,7 @@ export default function PDFUpload() {
             setResult(response);
             setFile(null);
         } catch (error) {
-            alert('❌ Lỗi upload: ' + error.message);
+            alert('❌ Lỗi upload: ' + (error.response?.data?.detail || error.message));
         } finally {
             setLoading(false);
         }
@@ -115,12 +146,22 @@ export default function PDFUpload() {
                 {result && (
                     <div className="bg-white rounded-xl shadow-md border-l-4 border-green-600 p-6">
                         <div className="flex items-start gap-4">
-                            <div className="p-3 bg-green-600 rounded-xl">
-                                <CheckCircle className="w-8 h-8 text-white" strokeWidth={2.5} />
+                            <div className={`p-3 rounded-xl ${result.status === 'failed' ? 'bg-red-600' : 'bg-green-600'}`}>
+                                {result.status === 'failed'
+                                    ? <AlertCircle className="w-8 h-8 text-white" strokeWidth={2.5} />
+                                    : <CheckCircle className="w-8 h-8 text-white" strokeWidth={2.5} />}
                             </div>
                             <div className="flex-1">
-                                <h3 className="font-bold text-xl text-green-900 mb-2">{result.status}</h3>
-                                <p className="text-sm text-green-700 mb-3">{result.message}</p>
+                                <h3 className="font-bold text-xl text-green-900 mb-2">{jobTitle(result)}</h3>
+                                <p className="text-sm text-green-700 mb-3">{jobMessage(result)}</p>
+                                {(result.status === 'queued' || result.status === 'running') && (
+                                    <div className="w-full h-2 bg-green-100 rounded-full mb-3 overflow-hidden">
+                                        <div
+                                            className="h-2 bg-green-600 rounded-full transition-all"
+                                            style={{ width: `${Math.round((result.progress || 0) * 100)}%` }}
+                                        />
+                                    </div>
+                                )}
                                 <div className="p-3 bg-green-50 rounded-lg border border-green-200">
                                     <p className="text-sm text-green-800">
                                         📄 File đã lưu: <span className="font-semibold">{result.filename}</span>
@@ -80,7 +80,7 @@ export default function PatientList() {
         setError(null);
         try {
             const data = await api.getPatients();
-            setPatients(data);
+            setPatients(data.items);
         } catch (err) {
             console.error('Error loading patients:', err);
             setError(err.message || 'Lỗi không xác định');
@@ -197,14 +197,8 @@ export default function PatientList() {
         return date.toLocaleDateString('vi-VN');
     };
 
-    // Helper to get latest visit info for List View
-    const getLatestVisit = (patient) => {
-        if (patient.luot_khams && patient.luot_khams.length > 0) {
-            const visits = [...patient.luot_khams].sort((a, b) => new Date(b.NgayKham) - new Date(a.NgayKham));
-            return visits[0];
-        }
-        return {};
-    };
+    // Helper to get latest visit info for List View (API danh sách chỉ trả lượt khám mới nhất)
+    const getLatestVisit = (patient) => patient.LuotKhamMoiNhat || {};
 
     // Pagination
     const indexOfLastItem = currentPage * itemsPerPage;
@@ -327,7 +321,7 @@ export default function PatientList() {
                                                 </td>
                                                 <td className="px-6 py-4 text-center">
                                                     <span className="inline-flex items-center justify-center w-8 h-8 rounded-full bg-green-100 text-green-700 font-bold text-sm">
-                                                        {patient.luot_khams ? patient.luot_khams.length : 0}
+                                                        {patient.SoLuotKham || 0}
                                                     </span>
                                                 </td>
                                                 <td className="px-6 py-4 text-center">
@@ -11,20 +11,54 @@ export const api = {
         return response.data;
     },
 
+    // Chat với AI dạng streaming (NDJSON): gọi onEvent cho từng frame sources/token/done/error
+    chatStream: async (question, onEvent) => {
+        const formData = new FormData();
+        formData.append('question', question);
+        const response = await fetch(`${API_BASE_URL}/api/chat/stream`, {
+            method: 'POST',
+            body: formData
+        });
+        if (!response.ok || !response.body) {
+            throw new Error(`HTTP ${response.status}`);
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            const lines = buffer.split('\n');
+            buffer = lines.pop();
+            for (const line of lines) {
+                if (line.trim()) onEvent(JSON.parse(line));
+            }
+        }
+        if (buffer.trim()) onEvent(JSON.parse(buffer));
+    },
+
     // Upload PDF
     uploadPDF: async (file) => {
         const formData = new FormData();
         formData.append('file', file);
         const response = await axios.post(`${API_BASE_URL}/api/upload`, formData);
+        return response.data; // job ingest chạy nền: { job_id, status, ... }
+    },
+
+    // Trạng thái + tiến độ job học tài liệu
+    getIngestJob: async (jobId) => {
+        const response = await axios.get(`${API_BASE_URL}/api/ingest/jobs/${jobId}`);
         return response.data;
     },
 
     // Lấy danh sách bệnh nhân (MỚI)
-    getPatients: async (skip = 0, limit = 100) => {
+    getPatients: async (cursor = null, limit = 100) => {
         const response = await axios.get(`${API_BASE_URL}/api/patients`, {
-            params: { skip, limit }
+            params: cursor ? { cursor, limit } : { limit }
         });
-        return response.data;
+        return response.data; // { items, next_cursor }
     },
 
     // Kiểm tra bệnh nhân (MỚI)
@@ -62,9 +96,9 @@ export const api = {
     },
 
     // Tìm kiếm (MỚI)
-    search: async (query) => {
+    search: async (query, skip = 0, limit = 100) => {
         const response = await axios.get(`${API_BASE_URL}/api/search`, {
-            params: { q: query }
+            params: { q: query, skip, limit }
         });
         return response.data;
     },